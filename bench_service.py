@@ -0,0 +1,225 @@
+# Bad Chess
+# Copyright (C) Jared De Blander 2022
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+
+# load test for the analysis service
+#
+# starts service.py on a free local port, or uses one already running with
+# --port, then keeps --concurrency clients busy over keep-alive connections
+# until --requests requests have been answered. every request goes to one
+# of the endpoints in turn for a position a few random moves out of an
+# opening, and a --repeat share of them ask about a position asked about
+# before, the way a tool going back and forth over a game would. latency
+# percentiles are reported per endpoint and overall, along with the
+# service's own cache and queue counters.
+#
+#   python bench_service.py
+#   python bench_service.py --requests 5000 --concurrency 64 --depth 4
+#   python bench_service.py --port 8765 --endpoints bestmove --movetime 100
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+from urllib.parse import urlencode
+
+from board import Board
+from match import load_openings
+from moves import move_to_uci
+
+ENDPOINTS = ("moves", "eval", "bestmove")
+
+
+def make_positions(count: int, openings, rng):
+    # (fen, moves) pairs, each a few random legal moves out of an opening
+    positions = []
+    board = Board()
+    while len(positions) < count:
+        fen = rng.choice(openings)
+        board.fen_decode(fen)
+        moves = []
+        for ply in range(rng.randrange(8)):
+            legal = list(board.generate_legal_moves())
+            if not legal:
+                break
+            move = rng.choice(legal)
+            moves.append(move_to_uci(move))
+            board.make_move(move)
+        if board.generate_legal_moves().count:
+            positions.append((fen, moves))
+    return positions
+
+
+async def request(reader, writer, host: str, target: str):
+    # status and decoded json body of one GET on a kept-alive connection
+    writer.write(("GET " + target + " HTTP/1.1\r\nHost: " + host +
+                  "\r\n\r\n").encode("latin-1"))
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if not line.strip():
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        if name.strip().lower() == "content-length":
+            length = int(value)
+    return status, json.loads(await reader.readexactly(length))
+
+
+async def client(host: str, port: int, jobs, latencies, failures):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        while jobs:
+            endpoint, target = jobs.pop()
+            start = time.perf_counter()
+            status, reply = await request(reader, writer, host, target)
+            elapsed = time.perf_counter() - start
+            if status == 200:
+                latencies[endpoint].append(elapsed)
+            else:
+                statuses = failures.setdefault(endpoint, {})
+                statuses[status] = statuses.get(status, 0) + 1
+    finally:
+        writer.close()
+
+
+async def run(host: str, port: int, jobs, concurrency: int):
+    latencies = {endpoint: [] for endpoint in ENDPOINTS}
+    failures = {}
+    start = time.perf_counter()
+    await asyncio.gather(*(client(host, port, jobs, latencies, failures)
+                           for index in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    reader, writer = await asyncio.open_connection(host, port)
+    status, service_stats = await request(reader, writer, host, "/stats")
+    writer.close()
+    return latencies, failures, elapsed, service_stats
+
+
+def percentile_line(name: str, latencies):
+    if not latencies:
+        return format(name, "<9") + " no answers"
+    if len(latencies) > 1:
+        cuts = statistics.quantiles(latencies, n=100, method="inclusive")
+        p50, p90, p99 = cuts[49], cuts[89], cuts[98]
+    else:
+        p50 = p90 = p99 = latencies[0]
+    return (format(name, "<9") + format(len(latencies), ">7") +
+            "  p50 " + format(p50 * 1000, ">8.2f") +
+            "  p90 " + format(p90 * 1000, ">8.2f") +
+            "  p99 " + format(p99 * 1000, ">8.2f") +
+            "  max " + format(max(latencies) * 1000, ">8.2f") + " ms")
+
+
+def start_service(workers: int, extra):
+    # a service on a port of its own choosing, and that port
+    here = os.path.dirname(os.path.abspath(__file__))
+    command = [sys.executable, os.path.join(here, "service.py"),
+               "--port", "0"]
+    if workers:
+        command += ["--workers", str(workers)]
+    process = subprocess.Popen(command + extra, stdout=subprocess.PIPE,
+                               text=True)
+    line = process.stdout.readline()
+    if not line.startswith("listening on "):
+        process.kill()
+        raise SystemExit("service.py did not start")
+    return process, int(line.rsplit(":", 1)[1])
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure the latency of the analysis service under load.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int,
+                        help="port of a running service (default: start one)")
+    parser.add_argument("--workers", type=int,
+                        help="workers of the started service")
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=32,
+                        help="clients sending requests at the same time")
+    parser.add_argument("--endpoints", default=",".join(ENDPOINTS),
+                        help="comma separated endpoints to take turns on")
+    parser.add_argument("--depth", type=int, default=3,
+                        help="depth of every bestmove request")
+    parser.add_argument("--movetime", type=int,
+                        help="ms of every bestmove request instead of depth")
+    parser.add_argument("--positions", type=int, default=200,
+                        help="distinct positions to ask about")
+    parser.add_argument("--repeat", type=float, default=0.5,
+                        help="share of requests for an earlier position")
+    parser.add_argument("--openings",
+                        help="fen, epd or pgn file (default: match.py suite)")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    positions = make_positions(args.positions, load_openings(args.openings),
+                               rng)
+    endpoints = [name.strip() for name in args.endpoints.split(",")]
+    limits = {"movetime": args.movetime} if args.movetime else \
+        {"depth": args.depth}
+    jobs = []
+    fresh = 0
+    for index in range(args.requests):
+        if fresh and (fresh >= len(positions) or rng.random() < args.repeat):
+            fen, moves = positions[rng.randrange(fresh)]
+        else:
+            fen, moves = positions[fresh]
+            fresh += 1
+        endpoint = endpoints[index % len(endpoints)]
+        query = {"fen": fen, "moves": " ".join(moves)}
+        if endpoint == "bestmove":
+            query.update(limits)
+        jobs.append((endpoint, "/" + endpoint + "?" + urlencode(query)))
+    # clients pop from the end
+    jobs.reverse()
+
+    process = None
+    port = args.port
+    if port is None:
+        extra = [] if not args.movetime else \
+            ["--max-movetime", str(max(args.movetime, 1))]
+        process, port = start_service(args.workers, extra)
+    try:
+        latencies, failures, elapsed, service_stats = asyncio.run(
+            run(args.host, port, jobs, args.concurrency))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    answered = sum(len(values) for values in latencies.values())
+    failed = sum(sum(statuses.values()) for statuses in failures.values())
+    print(str(answered) + " answered, " + str(failed) +
+          " failed in " + format(elapsed, ".2f") + " s, " +
+          format(answered / elapsed, ".0f") + " requests/s with " +
+          str(args.concurrency) + " clients")
+    for endpoint in endpoints:
+        line = percentile_line(endpoint, latencies.get(endpoint, []))
+        for status, count in sorted(failures.get(endpoint, {}).items()):
+            line += "  " + str(count) + " x " + str(status)
+        print(line)
+    print(percentile_line("all", [latency for values in latencies.values()
+                                  for latency in values]))
+    cache = service_stats["cache"]
+    print("service: " + str(service_stats["searches"]) + " searches, " +
+          str(service_stats["coalesced"]) + " coalesced, " +
+          str(service_stats["rejected"]) + " rejected, cache hit rate " +
+          format(cache["hit_rate"], ".1%"))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,97 @@
+# Bad Chess
+# Copyright (C) Jared De Blander 2022
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+
+# cold start benchmark for worker processes
+#
+# every run starts a fresh interpreter, imports a module and loads a
+# position. the import time is measured inside the child so interpreter
+# startup is reported separately, and the child also reports whether pygame
+# was dragged in.
+#
+#   python bench_startup.py
+#   python bench_startup.py --runs 50 --module search
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+CHILD = """
+import sys, time
+start = time.perf_counter()
+import {module}
+imported = time.perf_counter()
+from board import Board
+Board()
+loaded = time.perf_counter()
+print(imported - start, loaded - start, "pygame" in sys.modules)
+"""
+
+
+def measure(module: str, runs: int):
+    here = os.path.dirname(os.path.abspath(__file__))
+    code = CHILD.format(module=module)
+    imports = []
+    ready = []
+    wall = []
+    pygame_loaded = False
+    for run in range(runs):
+        start = time.perf_counter()
+        output = subprocess.run([sys.executable, "-c", code], cwd=here,
+                                capture_output=True, text=True, check=True)
+        wall.append(time.perf_counter() - start)
+        import_time, ready_time, pygame_flag = output.stdout.split()
+        imports.append(float(import_time))
+        ready.append(float(ready_time))
+        pygame_loaded = pygame_loaded or pygame_flag == "True"
+    return imports, ready, wall, pygame_loaded
+
+
+def bare_interpreter(runs: int):
+    wall = []
+    for run in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", "pass"], check=True)
+        wall.append(time.perf_counter() - start)
+    return wall
+
+
+def ms(seconds: float):
+    return format(seconds * 1000, ">8.2f") + " ms"
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure the cold start cost of importing the engine.")
+    parser.add_argument("--runs", type=int, default=20,
+                        help="fresh interpreters per measurement")
+    parser.add_argument("--module", action="append",
+                        help="module to import (default: board, search, main)")
+    args = parser.parse_args()
+
+    modules = args.module or ["board", "search", "main"]
+
+    bare = bare_interpreter(args.runs)
+    print(format("python -c pass", "<16") + " process " +
+          ms(statistics.median(bare)))
+
+    for module in modules:
+        imports, ready, wall, pygame_loaded = measure(module, args.runs)
+        print(format("import " + module, "<16") + " process " +
+              ms(statistics.median(wall)) + "  import " +
+              ms(statistics.median(imports)) + "  first board " +
+              ms(statistics.median(ready)) +
+              ("  pygame LOADED" if pygame_loaded else "  no pygame"))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,198 @@
+# Bad Chess
+# Copyright (C) Jared De Blander 2022
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+
+# bitboards store one bit per square in a 64 bit integer
+#
+# squares are numbered little-endian rank-file: a1 = 0, b1 = 1, ... h1 = 7,
+# a2 = 8, ... h8 = 63. shifting left by 8 moves a set of squares one rank
+# towards black, shifting left by 1 moves it one file towards the h-file.
+
+FULL = 0xFFFFFFFFFFFFFFFF
+
+FILE_A = 0x0101010101010101
+FILE_B = FILE_A << 1
+FILE_G = FILE_A << 6
+FILE_H = FILE_A << 7
+
+RANK_1 = 0xFF
+RANK_2 = RANK_1 << 8
+RANK_3 = RANK_1 << 16
+RANK_4 = RANK_1 << 24
+RANK_5 = RANK_1 << 32
+RANK_6 = RANK_1 << 40
+RANK_7 = RANK_1 << 48
+RANK_8 = RANK_1 << 56
+
+NOT_FILE_A = FULL ^ FILE_A
+NOT_FILE_H = FULL ^ FILE_H
+NOT_FILE_AB = FULL ^ (FILE_A | FILE_B)
+NOT_FILE_GH = FULL ^ (FILE_G | FILE_H)
+
+SQUARE_NAMES = [chr(file + 97) + str(rank + 1)
+                for rank in range(8) for file in range(8)]
+
+
+def square_index(name: str):
+    return (ord(name[0]) - 97) + (int(name[1]) - 1) * 8
+
+
+def square_name(square: int):
+    return SQUARE_NAMES[square]
+
+
+def lsb(bb: int):
+    # index of the least significant set bit
+    return (bb & -bb).bit_length() - 1
+
+
+def msb(bb: int):
+    # index of the most significant set bit
+    return bb.bit_length() - 1
+
+
+def squares_of(bb: int):
+    # list the set squares from a1 towards h8
+    squares = []
+    while bb:
+        low = bb & -bb
+        squares.append(low.bit_length() - 1)
+        bb ^= low
+    return squares
+
+
+def _leaper_attacks(square: int, offsets):
+    attacks = 0
+    rank, file = divmod(square, 8)
+    for d_rank, d_file in offsets:
+        r = rank + d_rank
+        f = file + d_file
+        if 0 <= r < 8 and 0 <= f < 8:
+            attacks |= 1 << (r * 8 + f)
+    return attacks
+
+
+def _ray(square: int, d_rank: int, d_file: int):
+    ray = 0
+    rank, file = divmod(square, 8)
+    rank += d_rank
+    file += d_file
+    while 0 <= rank < 8 and 0 <= file < 8:
+        ray |= 1 << (rank * 8 + file)
+        rank += d_rank
+        file += d_file
+    return ray
+
+
+KNIGHT_ATTACKS = [_leaper_attacks(sq, ((1, 2), (2, 1), (2, -1), (1, -2),
+                                       (-1, -2), (-2, -1), (-2, 1), (-1, 2)))
+                  for sq in range(64)]
+
+KING_ATTACKS = [_leaper_attacks(sq, ((1, -1), (1, 0), (1, 1), (0, -1),
+                                     (0, 1), (-1, -1), (-1, 0), (-1, 1)))
+                for sq in range(64)]
+
+# squares attacked by a pawn of the given color standing on the square
+WHITE_PAWN_ATTACKS = [_leaper_attacks(sq, ((1, -1), (1, 1)))
+                      for sq in range(64)]
+BLACK_PAWN_ATTACKS = [_leaper_attacks(sq, ((-1, -1), (-1, 1)))
+                      for sq in range(64)]
+
+# rays pointing towards h8 are scanned from their lowest blocker, rays
+# pointing towards a1 from their highest blocker
+NORTH_RAYS = [_ray(sq, 1, 0) for sq in range(64)]
+EAST_RAYS = [_ray(sq, 0, 1) for sq in range(64)]
+NORTH_EAST_RAYS = [_ray(sq, 1, 1) for sq in range(64)]
+NORTH_WEST_RAYS = [_ray(sq, 1, -1) for sq in range(64)]
+SOUTH_RAYS = [_ray(sq, -1, 0) for sq in range(64)]
+WEST_RAYS = [_ray(sq, 0, -1) for sq in range(64)]
+SOUTH_WEST_RAYS = [_ray(sq, -1, -1) for sq in range(64)]
+SOUTH_EAST_RAYS = [_ray(sq, -1, 1) for sq in range(64)]
+
+ROOK_RAYS = [NORTH_RAYS[sq] | EAST_RAYS[sq] | SOUTH_RAYS[sq] | WEST_RAYS[sq]
+             for sq in range(64)]
+BISHOP_RAYS = [NORTH_EAST_RAYS[sq] | NORTH_WEST_RAYS[sq] |
+               SOUTH_WEST_RAYS[sq] | SOUTH_EAST_RAYS[sq]
+               for sq in range(64)]
+
+
+def _between(start: int, end: int):
+    for rays in (NORTH_RAYS, EAST_RAYS, SOUTH_RAYS, WEST_RAYS,
+                 NORTH_EAST_RAYS, NORTH_WEST_RAYS, SOUTH_WEST_RAYS,
+                 SOUTH_EAST_RAYS):
+        if rays[start] >> end & 1:
+            return rays[start] & ~rays[end] & ~(1 << end)
+    return 0
+
+
+# BETWEEN[a][b] holds the squares strictly between two squares on one rank,
+# file or diagonal and is 0 for squares that share no line. a piece between
+# a king and a slider aiming at it is pinned, one between a king and a
+# checking slider blocks the check.
+BETWEEN = [[_between(start, end)
+            if (ROOK_RAYS[start] | BISHOP_RAYS[start]) >> end & 1 else 0
+            for end in range(64)]
+           for start in range(64)]
+
+
+def rook_attacks(square: int, occupied: int):
+    # each ray is cut off behind its nearest blocker, the blocker itself
+    # stays attacked so captures fall out of the same mask
+    ray = NORTH_RAYS[square]
+    blockers = ray & occupied
+    if blockers:
+        ray ^= NORTH_RAYS[(blockers & -blockers).bit_length() - 1]
+    attacks = ray
+
+    ray = EAST_RAYS[square]
+    blockers = ray & occupied
+    if blockers:
+        ray ^= EAST_RAYS[(blockers & -blockers).bit_length() - 1]
+    attacks |= ray
+
+    ray = SOUTH_RAYS[square]
+    blockers = ray & occupied
+    if blockers:
+        ray ^= SOUTH_RAYS[blockers.bit_length() - 1]
+    attacks |= ray
+
+    ray = WEST_RAYS[square]
+    blockers = ray & occupied
+    if blockers:
+        ray ^= WEST_RAYS[blockers.bit_length() - 1]
+    return attacks | ray
+
+
+def bishop_attacks(square: int, occupied: int):
+    ray = NORTH_EAST_RAYS[square]
+    blockers = ray & occupied
+    if blockers:
+        ray ^= NORTH_EAST_RAYS[(blockers & -blockers).bit_length() - 1]
+    attacks = ray
+
+    ray = NORTH_WEST_RAYS[square]
+    blockers = ray & occupied
+    if blockers:
+        ray ^= NORTH_WEST_RAYS[(blockers & -blockers).bit_length() - 1]
+    attacks |= ray
+
+    ray = SOUTH_WEST_RAYS[square]
+    blockers = ray & occupied
+    if blockers:
+        ray ^= SOUTH_WEST_RAYS[blockers.bit_length() - 1]
+    attacks |= ray
+
+    ray = SOUTH_EAST_RAYS[square]
+    blockers = ray & occupied
+    if blockers:
+        ray ^= SOUTH_EAST_RAYS[blockers.bit_length() - 1]
+    return attacks | ray
+
+
+def queen_attacks(square: int, occupied: int):
+    return rook_attacks(square, occupied) | bishop_attacks(square, occupied)
@@ -0,0 +1,1238 @@
+# Bad Chess
+# Copyright (C) Jared De Blander 2022
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+
+# chess board is laid out in rows called ranks and columns called files
+# the board is 8 ranks and 8 files
+#
+# Forsyth-Edwards Notation (FEN) is a standard notation for describing
+# a particular board position of a chess game.
+#
+# this module is the rules engine. it only uses the standard library so
+# servers, batch jobs and worker processes can import it without pygame.
+
+import bitboard
+import moves as mv
+import zobrist
+import evaluation
+import log
+import stats
+from moves import MoveList
+
+FEN_NEW_GAME = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
+
+board_log = log.get_logger("board")
+fen_log = log.get_logger("fen")
+movegen_log = log.get_logger("movegen")
+
+# enumerate all the types of chess pieces
+
+
+class PieceType:
+    NONE = None
+    PAWN = 1
+    ROOK = 2
+    KNIGHT = 3
+    BISHOP = 4
+    QUEEN = 5
+    KING = 6
+
+# enumerate all the colors of chess pieces
+
+
+class PieceColor:
+    NONE = None
+    WHITE = 8
+    BLACK = 16
+
+# a piece code combines a PieceType with a PieceColor into one small integer,
+# the board stores these codes rather than Piece objects
+
+
+TYPE_MASK = 7
+COLOR_MASK = PieceColor.WHITE | PieceColor.BLACK
+
+# fen letter and value of each piece type, white letters are upper case
+PIECE_TYPE_CHARS = {
+    PieceType.PAWN: "P",
+    PieceType.ROOK: "R",
+    PieceType.KNIGHT: "N",
+    PieceType.BISHOP: "B",
+    PieceType.QUEEN: "Q",
+    PieceType.KING: "K",
+}
+PIECE_VALUES = {
+    PieceType.PAWN: 1,
+    PieceType.ROOK: 5,
+    PieceType.KNIGHT: 3,
+    PieceType.BISHOP: 3,
+    PieceType.QUEEN: 9,
+    PieceType.KING: 100,
+}
+
+PIECE_CODES = {char: PieceColor.WHITE | piece_type
+               for piece_type, char in PIECE_TYPE_CHARS.items()}
+PIECE_CODES.update({char.lower(): PieceColor.BLACK | piece_type
+                    for piece_type, char in PIECE_TYPE_CHARS.items()})
+PIECE_CHARS = {code: char for char, code in PIECE_CODES.items()}
+
+# define a class to represent a chess piece
+#
+# there is exactly one immutable Piece per fen character, Piece("q") always
+# hands back the same black queen. anything that is not a piece letter maps
+# to a single empty piece with no type or color.
+
+
+class Piece:
+    __slots__ = ("type", "color", "code", "_fen_char", "_value")
+
+    def __new__(cls, fen_character):
+        return PIECES_BY_CHAR.get(fen_character, EMPTY_PIECE)
+
+    @classmethod
+    def _intern(cls, code: int):
+        piece = object.__new__(cls)
+        if code:
+            fields = (code & TYPE_MASK, code & COLOR_MASK, code,
+                      PIECE_CHARS[code], PIECE_VALUES[code & TYPE_MASK])
+        else:
+            fields = (PieceType.NONE, PieceColor.NONE, 0, "?", None)
+        for name, value in zip(cls.__slots__, fields):
+            object.__setattr__(piece, name, value)
+        return piece
+
+    @staticmethod
+    def from_code(code: int):
+        return PIECES_BY_CODE[code]
+
+    def __setattr__(self, name, value):
+        raise AttributeError("pieces are immutable")
+
+    def __reduce__(self):
+        return (Piece, (self._fen_char,))
+
+    def value(self):
+        return self._value
+
+    def fen_char(self):
+        return self._fen_char
+
+    def __str__(self):
+        return self._fen_char
+
+
+EMPTY_PIECE = Piece._intern(0)
+PIECES_BY_CODE = [Piece._intern(code) if code in PIECE_CHARS else EMPTY_PIECE
+                  for code in range(23)]
+PIECES_BY_CHAR = {char: PIECES_BY_CODE[code]
+                  for char, code in PIECE_CODES.items()}
+
+# piece types indexed by the low two flag bits of a promotion move
+PROMOTION_TYPES = (PieceType.KNIGHT, PieceType.BISHOP,
+                   PieceType.ROOK, PieceType.QUEEN)
+
+# centipawn values for exchanges, indexed by piece type. the king is worth
+# more than everything else together so it is only ever the last to take.
+SEE_VALUES = (0, 100, 500, 320, 330, 900, 20000)
+# the order pieces join an exchange in, cheapest first
+SEE_ORDER = (PieceType.PAWN, PieceType.KNIGHT, PieceType.BISHOP,
+             PieceType.ROOK, PieceType.QUEEN, PieceType.KING)
+
+# h1 and every square of its colour
+LIGHT_SQUARES = 0x55AA55AA55AA55AA
+
+# castling rights are kept as a bitmask in "KQkq" order
+CASTLE_WHITE_KING = 1
+CASTLE_WHITE_QUEEN = 2
+CASTLE_BLACK_KING = 4
+CASTLE_BLACK_QUEEN = 8
+CASTLING_CHARS = "KQkq"
+
+# rights that survive a move starting or ending on each square
+CASTLING_MASKS = [15] * 64
+CASTLING_MASKS[0] = 15 ^ CASTLE_WHITE_QUEEN
+CASTLING_MASKS[4] = 15 ^ (CASTLE_WHITE_KING | CASTLE_WHITE_QUEEN)
+CASTLING_MASKS[7] = 15 ^ CASTLE_WHITE_KING
+CASTLING_MASKS[56] = 15 ^ CASTLE_BLACK_QUEEN
+CASTLING_MASKS[60] = 15 ^ (CASTLE_BLACK_KING | CASTLE_BLACK_QUEEN)
+CASTLING_MASKS[63] = 15 ^ CASTLE_BLACK_KING
+
+# for each side: right, squares that must be empty, squares the king passes
+# that must not be attacked, and the packed move
+CASTLING_MOVES = {
+    PieceColor.WHITE: (
+        (CASTLE_WHITE_KING, 0x60, (5, 6), mv.encode_move(4, 6, mv.KING_CASTLE)),
+        (CASTLE_WHITE_QUEEN, 0x0E, (3, 2),
+         mv.encode_move(4, 2, mv.QUEEN_CASTLE)),
+    ),
+    PieceColor.BLACK: (
+        (CASTLE_BLACK_KING, 0x60 << 56, (61, 62),
+         mv.encode_move(60, 62, mv.KING_CASTLE)),
+        (CASTLE_BLACK_QUEEN, 0x0E << 56, (59, 58),
+         mv.encode_move(60, 58, mv.QUEEN_CASTLE)),
+    ),
+}
+
+# rook start and end squares indexed by the king's castling destination
+CASTLING_ROOKS = {6: (7, 5), 2: (0, 3), 62: (63, 61), 58: (56, 59)}
+
+# the undo stack is preallocated to this many plies and grows past it
+MAX_PLY = 256
+
+# state that make_move cannot recompute when the move is taken back
+
+
+class UndoRecord:
+    __slots__ = ("move", "captured", "castling", "en_passant",
+                 "halfmove_clock", "hash", "middlegame_score",
+                 "endgame_score")
+
+    def __init__(self):
+        self.move = 0
+        self.captured = 0
+        self.castling = 0
+        self.en_passant = None
+        self.halfmove_clock = 0
+        self.hash = 0
+        self.middlegame_score = 0
+        self.endgame_score = 0
+
+# define a class to represent a chess board
+
+
+class Board:
+    def __init__(self, fen_string: str = FEN_NEW_GAME):
+        # one bitboard per piece code plus occupancy masks per color, the
+        # squares list mirrors them as a mailbox of piece codes (0 = empty)
+        self.pieces = [0] * 23
+        self.occupied_by = {PieceColor.WHITE: 0, PieceColor.BLACK: 0}
+        self.occupied = 0
+        self.squares = [0] * 64
+        self.turn = PieceColor.WHITE
+        self.castling = 0
+        self.en_passant = None
+        # plies since the last capture or pawn move, and the move number
+        # that goes up after every black move, both as in fen
+        self.halfmove_clock = 0
+        self.fullmove_number = 1
+        self.hash = 0
+        # evaluation state kept up to date as pieces move: material per side
+        # in pawns, tapered piece-square sums (white minus black) and phase
+        self.material = {PieceColor.WHITE: 0, PieceColor.BLACK: 0}
+        self.middlegame_score = 0
+        self.endgame_score = 0
+        self.phase = 0
+        self.undo_stack = [UndoRecord() for ply in range(MAX_PLY)]
+        self.ply = 0
+        self.fen_decode(fen_string)
+
+    def __str__(self):
+        return "Board: " + str(self.board)
+
+    @property
+    def board(self):
+        # 8x8 view of the position, index 0 is the 8th rank
+        return [[self.piece_at(rank * 8 + file) for file in range(8)]
+                for rank in range(7, -1, -1)]
+
+    def piece_at(self, square: int):
+        code = self.squares[square]
+        if code == 0:
+            return None
+        return PIECES_BY_CODE[code]
+
+    def put_piece(self, square: int, code: int):
+        bit = 1 << square
+        self.pieces[code] |= bit
+        self.occupied_by[code & COLOR_MASK] |= bit
+        self.occupied |= bit
+        self.squares[square] = code
+        self.material[code & COLOR_MASK] += PIECE_VALUES[code & TYPE_MASK]
+        self.middlegame_score += evaluation.MIDDLEGAME_TABLES[code][square]
+        self.endgame_score += evaluation.ENDGAME_TABLES[code][square]
+        self.phase += evaluation.PHASES[code]
+
+    def remove_piece(self, square: int):
+        code = self.squares[square]
+        if code:
+            mask = ~(1 << square)
+            self.pieces[code] &= mask
+            self.occupied_by[code & COLOR_MASK] &= mask
+            self.occupied &= mask
+            self.squares[square] = 0
+            self.material[code & COLOR_MASK] -= PIECE_VALUES[code & TYPE_MASK]
+            self.middlegame_score -= \
+                evaluation.MIDDLEGAME_TABLES[code][square]
+            self.endgame_score -= evaluation.ENDGAME_TABLES[code][square]
+            self.phase -= evaluation.PHASES[code]
+        return code
+
+    def wipe_board(self):
+        # clear every bitboard and the mailbox
+        for code in range(len(self.pieces)):
+            self.pieces[code] = 0
+        self.occupied_by[PieceColor.WHITE] = 0
+        self.occupied_by[PieceColor.BLACK] = 0
+        self.occupied = 0
+        for square in range(64):
+            self.squares[square] = 0
+        self.material[PieceColor.WHITE] = 0
+        self.material[PieceColor.BLACK] = 0
+        self.middlegame_score = 0
+        self.endgame_score = 0
+        self.phase = 0
+
+    def army_difference(self, color: PieceColor = None):
+        army_differential = self.material[PieceColor.WHITE] - \
+            self.material[PieceColor.BLACK]
+
+        if color == PieceColor.BLACK:
+            army_differential = -army_differential
+
+        return army_differential
+
+    def evaluate(self):
+        # static evaluation in centipawns from the side to move's view
+        score = evaluation.taper(self.middlegame_score, self.endgame_score,
+                                 self.phase)
+        if self.turn == PieceColor.WHITE:
+            return score
+        return -score
+
+    def reset_board(self):
+        self.fen_decode(FEN_NEW_GAME)
+
+    def move(self, start: str, end: str):
+        # play a move given by its squares, returns the encoded move or None
+        # when it is not legal
+        if log.is_tracing(board_log):
+            board_log.log(log.TRACE, "Moving piece from %s to %s", start, end)
+        move = self.parse_move(start + end)
+        if move is None:
+            board_log.debug("Illegal move %s%s", start, end)
+            return None
+
+        self.make_move(move)
+        return move
+
+    def make_move(self, move: int):
+        # play a legal move, everything needed to take it back is written
+        # into the next preallocated undo record
+        ply = self.ply
+        if ply == len(self.undo_stack):
+            self.undo_stack.append(UndoRecord())
+        undo = self.undo_stack[ply]
+        self.ply = ply + 1
+
+        start = move & 63
+        end = move >> 6 & 63
+        flags = move >> 12
+        us = self.turn
+        them = us ^ COLOR_MASK
+        pieces = self.pieces
+        squares = self.squares
+        occupied_by = self.occupied_by
+
+        undo.move = move
+        undo.castling = self.castling
+        undo.en_passant = self.en_passant
+        undo.halfmove_clock = self.halfmove_clock
+        undo.hash = key = self.hash
+        undo.middlegame_score = middlegame = self.middlegame_score
+        undo.endgame_score = endgame = self.endgame_score
+        middlegame_tables = evaluation.MIDDLEGAME_TABLES
+        endgame_tables = evaluation.ENDGAME_TABLES
+        key ^= zobrist.WHITE_TO_MOVE_KEY
+        if self.en_passant is not None and \
+                self._en_passant_capturable(self.en_passant, us):
+            key ^= zobrist.EN_PASSANT_KEYS[self.en_passant & 7]
+
+        code = squares[start]
+        captured = 0
+        if flags & mv.CAPTURE:
+            capture_square = end
+            if flags == mv.EN_PASSANT:
+                capture_square = end - 8 if us == PieceColor.WHITE else end + 8
+            captured = squares[capture_square]
+            capture_bit = 1 << capture_square
+            pieces[captured] ^= capture_bit
+            occupied_by[them] ^= capture_bit
+            squares[capture_square] = 0
+            key ^= zobrist.PIECE_KEYS[captured][capture_square]
+            middlegame -= middlegame_tables[captured][capture_square]
+            endgame -= endgame_tables[captured][capture_square]
+            self.phase -= evaluation.PHASES[captured]
+            self.material[them] -= PIECE_VALUES[captured & TYPE_MASK]
+        undo.captured = captured
+
+        start_bit = 1 << start
+        end_bit = 1 << end
+        pieces[code] ^= start_bit
+        squares[start] = 0
+        key ^= zobrist.PIECE_KEYS[code][start]
+        middlegame -= middlegame_tables[code][start]
+        endgame -= endgame_tables[code][start]
+        if flags & mv.PROMOTION:
+            code = us | PROMOTION_TYPES[flags & 3]
+            self.phase += evaluation.PHASES[code]
+            self.material[us] += PIECE_VALUES[code & TYPE_MASK] - \
+                PIECE_VALUES[PieceType.PAWN]
+        pieces[code] |= end_bit
+        squares[end] = code
+        occupied_by[us] ^= start_bit | end_bit
+        key ^= zobrist.PIECE_KEYS[code][end]
+        middlegame += middlegame_tables[code][end]
+        endgame += endgame_tables[code][end]
+
+        if flags == mv.KING_CASTLE or flags == mv.QUEEN_CASTLE:
+            rook_start, rook_end = CASTLING_ROOKS[end]
+            rook_bits = 1 << rook_start | 1 << rook_end
+            rook = us | PieceType.ROOK
+            pieces[rook] ^= rook_bits
+            occupied_by[us] ^= rook_bits
+            squares[rook_end] = rook
+            squares[rook_start] = 0
+            key ^= zobrist.PIECE_KEYS[rook][rook_start] ^ \
+                zobrist.PIECE_KEYS[rook][rook_end]
+            middlegame += middlegame_tables[rook][rook_end] - \
+                middlegame_tables[rook][rook_start]
+            endgame += endgame_tables[rook][rook_end] - \
+                endgame_tables[rook][rook_start]
+
+        self.middlegame_score = middlegame
+        self.endgame_score = endgame
+
+        self.occupied = occupied_by[PieceColor.WHITE] | \
+            occupied_by[PieceColor.BLACK]
+        castling = self.castling & CASTLING_MASKS[start] & CASTLING_MASKS[end]
+        if castling != self.castling:
+            key ^= zobrist.CASTLING_KEYS[self.castling] ^ \
+                zobrist.CASTLING_KEYS[castling]
+            self.castling = castling
+        if flags == mv.DOUBLE_PAWN_PUSH:
+            self.en_passant = (start + end) >> 1
+            if self._en_passant_capturable(self.en_passant, them):
+                key ^= zobrist.EN_PASSANT_KEYS[self.en_passant & 7]
+        else:
+            self.en_passant = None
+        self.hash = key
+        # a promotion is a pawn move too, code already holds the new piece
+        if captured or code & TYPE_MASK == PieceType.PAWN or \
+                flags & mv.PROMOTION:
+            self.halfmove_clock = 0
+        else:
+            self.halfmove_clock += 1
+        if us == PieceColor.BLACK:
+            self.fullmove_number += 1
+        self.turn = them
+
+    def unmake_move(self):
+        # take back the last move played with make_move
+        self.ply -= 1
+        undo = self.undo_stack[self.ply]
+        move = undo.move
+
+        start = move & 63
+        end = move >> 6 & 63
+        flags = move >> 12
+        them = self.turn
+        us = them ^ COLOR_MASK
+        pieces = self.pieces
+        squares = self.squares
+        occupied_by = self.occupied_by
+
+        start_bit = 1 << start
+        end_bit = 1 << end
+        code = squares[end]
+        pieces[code] ^= end_bit
+        if flags & mv.PROMOTION:
+            self.phase -= evaluation.PHASES[code]
+            self.material[us] -= PIECE_VALUES[code & TYPE_MASK] - \
+                PIECE_VALUES[PieceType.PAWN]
+            code = us | PieceType.PAWN
+        pieces[code] |= start_bit
+        squares[start] = code
+        squares[end] = 0
+        occupied_by[us] ^= start_bit | end_bit
+
+        captured = undo.captured
+        if captured:
+            capture_square = end
+            if flags == mv.EN_PASSANT:
+                capture_square = end - 8 if us == PieceColor.WHITE else end + 8
+            capture_bit = 1 << capture_square
+            pieces[captured] |= capture_bit
+            occupied_by[them] |= capture_bit
+            squares[capture_square] = captured
+            self.phase += evaluation.PHASES[captured]
+            self.material[them] += PIECE_VALUES[captured & TYPE_MASK]
+
+        if flags == mv.KING_CASTLE or flags == mv.QUEEN_CASTLE:
+            rook_start, rook_end = CASTLING_ROOKS[end]
+            rook_bits = 1 << rook_start | 1 << rook_end
+            pieces[us | PieceType.ROOK] ^= rook_bits
+            occupied_by[us] ^= rook_bits
+            squares[rook_start] = squares[rook_end]
+            squares[rook_end] = 0
+
+        self.occupied = occupied_by[PieceColor.WHITE] | \
+            occupied_by[PieceColor.BLACK]
+        self.castling = undo.castling
+        self.en_passant = undo.en_passant
+        self.halfmove_clock = undo.halfmove_clock
+        self.hash = undo.hash
+        self.middlegame_score = undo.middlegame_score
+        self.endgame_score = undo.endgame_score
+        if us == PieceColor.BLACK:
+            self.fullmove_number -= 1
+        self.turn = us
+
+    def is_repetition(self, times: int = 1):
+        # whether the position occurred at least times before. the undo
+        # records keep the key of every earlier position. only every other
+        # one can match since the side to move is part of the key, and no
+        # position from before the last capture or pawn move can come back,
+        # so the scan stops where the halfmove clock was reset.
+        key = self.hash
+        stack = self.undo_stack
+        oldest = self.ply - self.halfmove_clock
+        if oldest < 0:
+            oldest = 0
+        for ply in range(self.ply - 4, oldest - 1, -2):
+            if stack[ply].hash == key:
+                times -= 1
+                if times <= 0:
+                    return True
+        return False
+
+    def is_fifty_moves(self):
+        # a hundred plies without a capture or a pawn move
+        return self.halfmove_clock >= 100
+
+    def is_insufficient_material(self):
+        # neither side can ever mate: bare kings, a single knight or bishop,
+        # or only bishops that all stand on squares of one colour
+        pieces = self.pieces
+        for color in (PieceColor.WHITE, PieceColor.BLACK):
+            if pieces[color | PieceType.PAWN] or \
+                    pieces[color | PieceType.ROOK] or \
+                    pieces[color | PieceType.QUEEN]:
+                return False
+        knights = pieces[PieceColor.WHITE | PieceType.KNIGHT] | \
+            pieces[PieceColor.BLACK | PieceType.KNIGHT]
+        bishops = pieces[PieceColor.WHITE | PieceType.BISHOP] | \
+            pieces[PieceColor.BLACK | PieceType.BISHOP]
+        minors = knights | bishops
+        if minors & (minors - 1) == 0:
+            return True
+        return not knights and (bishops & LIGHT_SQUARES == 0 or
+                                bishops & ~LIGHT_SQUARES == 0)
+
+    def recent_history(self):
+        # the fen at the last capture or pawn move and the moves played
+        # since, enough for another board to see the same repetitions
+        count = min(self.halfmove_clock, self.ply)
+        moves = [self.undo_stack[ply].move
+                 for ply in range(self.ply - count, self.ply)]
+        for move in moves:
+            self.unmake_move()
+        fen = self.fen_encode()
+        for move in moves:
+            self.make_move(move)
+        return fen, moves
+
+    def _en_passant_capturable(self, square: int, color: PieceColor):
+        # whether a pawn of the color stands ready to capture en passant,
+        # only then does the square count towards the position's identity
+        if color == PieceColor.WHITE:
+            return bitboard.BLACK_PAWN_ATTACKS[square] & \
+                self.pieces[PieceColor.WHITE | PieceType.PAWN] != 0
+        return bitboard.WHITE_PAWN_ATTACKS[square] & \
+            self.pieces[PieceColor.BLACK | PieceType.PAWN] != 0
+
+    def compute_hash(self):
+        # zobrist key from scratch, make_move keeps self.hash up to date
+        key = 0
+        for square in range(64):
+            code = self.squares[square]
+            if code:
+                key ^= zobrist.PIECE_KEYS[code][square]
+        key ^= zobrist.CASTLING_KEYS[self.castling]
+        if self.en_passant is not None and \
+                self._en_passant_capturable(self.en_passant, self.turn):
+            key ^= zobrist.EN_PASSANT_KEYS[self.en_passant & 7]
+        if self.turn == PieceColor.WHITE:
+            key ^= zobrist.WHITE_TO_MOVE_KEY
+        return key
+
+    def fen_encode(self):
+        board_string = ""
+        empty_counter = 0
+
+        for rank in range(7, -1, -1):
+            for file in range(8):
+                code = self.squares[rank * 8 + file]
+                if code == 0:
+                    empty_counter += 1
+                else:
+                    if empty_counter > 0:
+                        board_string += str(empty_counter)
+                        empty_counter = 0
+                    board_string += PIECE_CHARS[code]
+
+            if empty_counter > 0:
+                board_string += str(empty_counter)
+
+            board_string += "/"
+            empty_counter = 0
+
+        board_string = board_string.rstrip("/")
+
+        if self.turn == PieceColor.WHITE:
+            board_string += " w "
+        else:
+            board_string += " b "
+
+        if self.castling:
+            for bit in range(4):
+                if self.castling & (1 << bit):
+                    board_string += CASTLING_CHARS[bit]
+        else:
+            board_string += "-"
+
+        if self.en_passant is None:
+            board_string += " -"
+        else:
+            board_string += " " + bitboard.SQUARE_NAMES[self.en_passant]
+
+        board_string += " " + str(self.halfmove_clock) + " " + \
+            str(self.fullmove_number)
+
+        return board_string
+
+    def fen_decode(self, board_state: str):
+        tracing = log.is_tracing(fen_log)
+        if tracing:
+            fen_log.log(log.TRACE, "Loading board state: %s", board_state)
+        self.wipe_board()
+        self.ply = 0
+        rank = 7
+        file = 0
+
+        fen_chunks = board_state.split(" ")
+
+        if len(fen_chunks) > 0:
+            for char in fen_chunks[0]:
+                if char == "/":
+                    rank -= 1
+                    file = 0
+                elif char.isdigit():
+                    file += int(char)
+                else:
+                    self.put_piece(rank * 8 + file, PIECE_CODES[char])
+                    file += 1
+
+        if len(fen_chunks) > 1:
+            if fen_chunks[1] == "w":
+                self.turn = PieceColor.WHITE
+            else:
+                self.turn = PieceColor.BLACK
+
+        self.castling = 0
+        if len(fen_chunks) > 2:
+            for char in fen_chunks[2]:
+                if char in CASTLING_CHARS:
+                    self.castling |= 1 << CASTLING_CHARS.index(char)
+
+        self.en_passant = None
+        if len(fen_chunks) > 3 and fen_chunks[3] != "-":
+            self.en_passant = bitboard.square_index(fen_chunks[3])
+
+        # the counters are optional, short fens start a fresh count
+        self.halfmove_clock = 0
+        if len(fen_chunks) > 4 and fen_chunks[4].isdigit():
+            self.halfmove_clock = int(fen_chunks[4])
+        self.fullmove_number = 1
+        if len(fen_chunks) > 5 and fen_chunks[5].isdigit():
+            self.fullmove_number = max(1, int(fen_chunks[5]))
+
+        self.hash = self.compute_hash()
+
+        if tracing:
+            fen_log.log(log.TRACE, "Board state loaded: %s", self.fen_encode())
+
+    def attacks_from(self, square: int):
+        # squares attacked by the piece standing on the square
+        code = self.squares[square]
+        piece_type = code & TYPE_MASK
+
+        if piece_type == PieceType.PAWN:
+            if code & COLOR_MASK == PieceColor.WHITE:
+                return bitboard.WHITE_PAWN_ATTACKS[square]
+            return bitboard.BLACK_PAWN_ATTACKS[square]
+        elif piece_type == PieceType.KNIGHT:
+            return bitboard.KNIGHT_ATTACKS[square]
+        elif piece_type == PieceType.BISHOP:
+            return bitboard.bishop_attacks(square, self.occupied)
+        elif piece_type == PieceType.ROOK:
+            return bitboard.rook_attacks(square, self.occupied)
+        elif piece_type == PieceType.QUEEN:
+            return bitboard.queen_attacks(square, self.occupied)
+        elif piece_type == PieceType.KING:
+            return bitboard.KING_ATTACKS[square]
+        return 0
+
+    def attacks_by(self, color: PieceColor):
+        # every square attacked by the given side, pawns are shifted as a set
+        # and the leapers and sliders are unioned from their tables
+        pieces = self.pieces
+        occupied = self.occupied
+
+        pawns = pieces[color | PieceType.PAWN]
+        if color == PieceColor.WHITE:
+            attacks = ((pawns & bitboard.NOT_FILE_A) << 7 |
+                       (pawns & bitboard.NOT_FILE_H) << 9) & bitboard.FULL
+        else:
+            attacks = ((pawns & bitboard.NOT_FILE_A) >> 9 |
+                       (pawns & bitboard.NOT_FILE_H) >> 7)
+
+        for square in bitboard.squares_of(pieces[color | PieceType.KNIGHT]):
+            attacks |= bitboard.KNIGHT_ATTACKS[square]
+        diagonal = pieces[color | PieceType.BISHOP] | \
+            pieces[color | PieceType.QUEEN]
+        for square in bitboard.squares_of(diagonal):
+            attacks |= bitboard.bishop_attacks(square, occupied)
+        straight = pieces[color | PieceType.ROOK] | \
+            pieces[color | PieceType.QUEEN]
+        for square in bitboard.squares_of(straight):
+            attacks |= bitboard.rook_attacks(square, occupied)
+        for square in bitboard.squares_of(pieces[color | PieceType.KING]):
+            attacks |= bitboard.KING_ATTACKS[square]
+
+        return attacks
+
+    def _square_attacked(self, square: int, by: PieceColor, occupied: int,
+                         ignore: int = 0):
+        # ignore masks out a piece that a candidate move would capture
+        pieces = self.pieces
+        live = ~ignore
+
+        if bitboard.KNIGHT_ATTACKS[square] & pieces[by | PieceType.KNIGHT] & live:
+            return True
+        if by == PieceColor.WHITE:
+            pawn_attacks = bitboard.BLACK_PAWN_ATTACKS[square]
+        else:
+            pawn_attacks = bitboard.WHITE_PAWN_ATTACKS[square]
+        if pawn_attacks & pieces[by | PieceType.PAWN] & live:
+            return True
+        if bitboard.KING_ATTACKS[square] & pieces[by | PieceType.KING]:
+            return True
+        queens = pieces[by | PieceType.QUEEN]
+        if bitboard.rook_attacks(square, occupied) & \
+                (pieces[by | PieceType.ROOK] | queens) & live:
+            return True
+        if bitboard.bishop_attacks(square, occupied) & \
+                (pieces[by | PieceType.BISHOP] | queens) & live:
+            return True
+        return False
+
+    def attackers_to(self, square: int, by: PieceColor, occupied: int = None):
+        # every piece of the color attacking the square, sliders see
+        # through the given occupancy (default: the board's)
+        if occupied is None:
+            occupied = self.occupied
+        pieces = self.pieces
+        if by == PieceColor.WHITE:
+            pawn_attacks = bitboard.BLACK_PAWN_ATTACKS[square]
+        else:
+            pawn_attacks = bitboard.WHITE_PAWN_ATTACKS[square]
+        queens = pieces[by | PieceType.QUEEN]
+        return (bitboard.KNIGHT_ATTACKS[square] & pieces[by | PieceType.KNIGHT] |
+                pawn_attacks & pieces[by | PieceType.PAWN] |
+                bitboard.KING_ATTACKS[square] & pieces[by | PieceType.KING] |
+                bitboard.rook_attacks(square, occupied) &
+                (pieces[by | PieceType.ROOK] | queens) |
+                bitboard.bishop_attacks(square, occupied) &
+                (pieces[by | PieceType.BISHOP] | queens))
+
+    def is_square_attacked(self, square: int, by: PieceColor):
+        return self._square_attacked(square, by, self.occupied)
+
+    def checkers(self):
+        # the pieces giving check to the side to move
+        king = self.pieces[self.turn | PieceType.KING]
+        return self.attackers_to(king.bit_length() - 1,
+                                 self.turn ^ COLOR_MASK)
+
+    def pinned(self):
+        # the pieces of the side to move pinned to their king
+        king = self.pieces[self.turn | PieceType.KING]
+        return self._pins(king.bit_length() - 1, self.turn)[0]
+
+    def _pins(self, king_square: int, us: PieceColor):
+        # pinned pieces of the color and, by square, the line each may still
+        # move along: up to and including the pinning piece
+        them = us ^ COLOR_MASK
+        pieces = self.pieces
+        queens = pieces[them | PieceType.QUEEN]
+        snipers = bitboard.ROOK_RAYS[king_square] & \
+            (pieces[them | PieceType.ROOK] | queens) | \
+            bitboard.BISHOP_RAYS[king_square] & \
+            (pieces[them | PieceType.BISHOP] | queens)
+        occupied = self.occupied
+        own = self.occupied_by[us]
+        between_king = bitboard.BETWEEN[king_square]
+        pinned = 0
+        lines = {}
+        while snipers:
+            low = snipers & -snipers
+            snipers ^= low
+            between = between_king[low.bit_length() - 1]
+            blockers = between & occupied
+            # exactly one piece in the way, and it is ours
+            if blockers & own and blockers & (blockers - 1) == 0:
+                pinned |= blockers
+                lines[blockers.bit_length() - 1] = between | low
+        return pinned, lines
+
+    def in_check(self):
+        king = self.pieces[self.turn | PieceType.KING]
+        return self._square_attacked(king.bit_length() - 1,
+                                     self.turn ^ COLOR_MASK, self.occupied)
+
+    def _is_legal(self, move: int, king_square: int):
+        # play the move on the occupancy masks only and ask whether the
+        # king is left attacked
+        start = move & 63
+        end = move >> 6 & 63
+        them = self.turn ^ COLOR_MASK
+
+        occupied = (self.occupied ^ (1 << start)) | (1 << end)
+        captured = 0
+        if move >> 12 == mv.EN_PASSANT:
+            if self.turn == PieceColor.WHITE:
+                captured = 1 << (end - 8)
+            else:
+                captured = 1 << (end + 8)
+            occupied ^= captured
+        elif move & 0x4000:
+            captured = 1 << end
+
+        if start == king_square:
+            king_square = end
+        return not self._square_attacked(king_square, them, occupied, captured)
+
+    def see(self, move: int):
+        # static exchange evaluation: the material the side to move wins,
+        # in centipawns, when both sides keep recapturing on the target
+        # square with their least valuable piece for as long as it pays.
+        # pieces lined up behind one another join in as the ones in front
+        # leave.
+        start = move & 63
+        end = move >> 6 & 63
+        flags = move >> 12
+        squares = self.squares
+        pieces = self.pieces
+        occupied = self.occupied ^ (1 << start)
+
+        if flags == mv.EN_PASSANT:
+            gain = SEE_VALUES[PieceType.PAWN]
+            occupied ^= 1 << (end - 8 if self.turn == PieceColor.WHITE
+                              else end + 8)
+        elif flags & mv.CAPTURE:
+            gain = SEE_VALUES[squares[end] & TYPE_MASK]
+        else:
+            gain = 0
+        on_square = SEE_VALUES[squares[start] & TYPE_MASK]
+        if flags & mv.PROMOTION:
+            promoted = SEE_VALUES[PROMOTION_TYPES[flags & 3]]
+            gain += promoted - on_square
+            on_square = promoted
+
+        diagonal = pieces[PieceColor.WHITE | PieceType.BISHOP] | \
+            pieces[PieceColor.BLACK | PieceType.BISHOP] | \
+            pieces[PieceColor.WHITE | PieceType.QUEEN] | \
+            pieces[PieceColor.BLACK | PieceType.QUEEN]
+        straight = pieces[PieceColor.WHITE | PieceType.ROOK] | \
+            pieces[PieceColor.BLACK | PieceType.ROOK] | \
+            pieces[PieceColor.WHITE | PieceType.QUEEN] | \
+            pieces[PieceColor.BLACK | PieceType.QUEEN]
+        attackers = (self.attackers_to(end, PieceColor.WHITE, occupied) |
+                     self.attackers_to(end, PieceColor.BLACK, occupied)) & \
+            occupied
+
+        gains = [gain]
+        side = self.turn ^ COLOR_MASK
+        while True:
+            own = attackers & self.occupied_by[side]
+            if not own:
+                break
+            for piece_type in SEE_ORDER:
+                candidates = own & pieces[side | piece_type]
+                if candidates:
+                    break
+            # the side may recapture, gains[-1] is what it stands to lose
+            gains.append(on_square - gains[-1])
+            on_square = SEE_VALUES[piece_type]
+            occupied ^= candidates & -candidates
+            attackers |= bitboard.bishop_attacks(end, occupied) & diagonal | \
+                bitboard.rook_attacks(end, occupied) & straight
+            attackers &= occupied
+            side ^= COLOR_MASK
+
+        # walk back, either side stops capturing once it no longer pays
+        for index in range(len(gains) - 1, 0, -1):
+            if gains[index] > -gains[index - 1]:
+                gains[index - 1] = -gains[index]
+        return gains[0]
+
+    def generate_legal_moves(self, moves: MoveList = None,
+                             captures_only: bool = False):
+        # fill the buffer with every legal move for the side to move. the
+        # checkers and pinned pieces are found once up front, then every
+        # target mask is cut down to the squares that stop a check and a
+        # pinned piece to its pin line, so no move has to be tried out.
+        # only king moves and en passant are tested one by one.
+        # captures_only leaves out quiet moves other than promotions, for
+        # the quiescence search.
+        if moves is None:
+            moves = MoveList()
+        buffer = moves.moves
+        n = 0
+
+        pieces = self.pieces
+        us = self.turn
+        them = us ^ COLOR_MASK
+        enemy = self.occupied_by[them]
+        occupied = self.occupied
+        empty = ~occupied & bitboard.FULL
+        not_own = ~self.occupied_by[us] & bitboard.FULL
+
+        king = pieces[us | PieceType.KING]
+        king_square = king.bit_length() - 1
+        checkers = self.attackers_to(king_square, them, occupied)
+        if not checkers:
+            evasions = bitboard.FULL
+        elif checkers & (checkers - 1):
+            # double check, only the king can move
+            evasions = 0
+        else:
+            # capture the checker or step in between
+            evasions = checkers | \
+                bitboard.BETWEEN[king_square][checkers.bit_length() - 1]
+        pinned, pin_lines = self._pins(king_square, us)
+
+        # pawns move as a set, each target mask is walked once
+        pawns = pieces[us | PieceType.PAWN]
+        if us == PieceColor.WHITE:
+            single = (pawns << 8) & empty
+            double = ((single & bitboard.RANK_3) << 8) & empty
+            west = ((pawns & bitboard.NOT_FILE_A) << 7) & enemy
+            east = ((pawns & bitboard.NOT_FILE_H) << 9) & enemy
+            push, west_offset, east_offset = 8, 7, 9
+            promotion_rank = bitboard.RANK_8
+        else:
+            single = (pawns >> 8) & empty
+            double = ((single & bitboard.RANK_6) >> 8) & empty
+            west = ((pawns & bitboard.NOT_FILE_A) >> 9) & enemy
+            east = ((pawns & bitboard.NOT_FILE_H) >> 7) & enemy
+            push, west_offset, east_offset = -8, -9, -7
+            promotion_rank = bitboard.RANK_1
+        if captures_only:
+            single &= promotion_rank
+            double = 0
+
+        for targets, offset, flags in (
+                (single & evasions, push, mv.QUIET),
+                (double & evasions, push * 2, mv.DOUBLE_PAWN_PUSH),
+                (west & evasions, west_offset, mv.CAPTURE),
+                (east & evasions, east_offset, mv.CAPTURE)):
+            while targets:
+                low = targets & -targets
+                targets ^= low
+                end = low.bit_length() - 1
+                start = end - offset
+                if pinned and pinned >> start & 1 and \
+                        not low & pin_lines[start]:
+                    continue
+                move = start | end << 6
+                if low & promotion_rank:
+                    move |= (flags | mv.PROMOTION) << 12
+                    buffer[n] = move | 0x3000
+                    buffer[n + 1] = move
+                    buffer[n + 2] = move | 0x2000
+                    buffer[n + 3] = move | 0x1000
+                    n += 4
+                else:
+                    buffer[n] = move | flags << 12
+                    n += 1
+
+        if self.en_passant is not None and evasions:
+            # rare enough to try out, the captured pawn can uncover the king
+            # along the rank
+            if us == PieceColor.WHITE:
+                attackers = bitboard.BLACK_PAWN_ATTACKS[self.en_passant] & pawns
+            else:
+                attackers = bitboard.WHITE_PAWN_ATTACKS[self.en_passant] & pawns
+            while attackers:
+                low = attackers & -attackers
+                attackers ^= low
+                move = (low.bit_length() - 1) | self.en_passant << 6 | \
+                    mv.EN_PASSANT << 12
+                if self._is_legal(move, king_square):
+                    buffer[n] = move
+                    n += 1
+
+        # leapers and sliders, captures are flagged from the enemy mask
+        queens = pieces[us | PieceType.QUEEN]
+        diagonal = pieces[us | PieceType.BISHOP] | queens
+        straight = pieces[us | PieceType.ROOK] | queens
+        if evasions:
+            # a pinned knight never stays on its pin line
+            knights = pieces[us | PieceType.KNIGHT] & ~pinned
+        else:
+            knights = diagonal = straight = 0
+        targets_mask = (enemy if captures_only else not_own) & evasions
+
+        for group, piece_type in ((knights, PieceType.KNIGHT),
+                                  (diagonal, PieceType.BISHOP),
+                                  (straight, PieceType.ROOK)):
+            while group:
+                low = group & -group
+                group ^= low
+                start = low.bit_length() - 1
+                if piece_type == PieceType.KNIGHT:
+                    targets = bitboard.KNIGHT_ATTACKS[start] & targets_mask
+                elif piece_type == PieceType.BISHOP:
+                    targets = bitboard.bishop_attacks(start, occupied) & \
+                        targets_mask
+                else:
+                    targets = bitboard.rook_attacks(start, occupied) & \
+                        targets_mask
+                if low & pinned:
+                    targets &= pin_lines[start]
+                while targets:
+                    low = targets & -targets
+                    targets ^= low
+                    if low & enemy:
+                        buffer[n] = start | (low.bit_length() - 1) << 6 | 0x4000
+                    else:
+                        buffer[n] = start | (low.bit_length() - 1) << 6
+                    n += 1
+
+        # the king is looked at with itself taken off the board, so a
+        # slider checking it also covers the square behind it
+        targets = bitboard.KING_ATTACKS[king_square] & \
+            (enemy if captures_only else not_own)
+        without_king = occupied ^ king
+        while targets:
+            low = targets & -targets
+            targets ^= low
+            end = low.bit_length() - 1
+            if self._square_attacked(end, them, without_king):
+                continue
+            if low & enemy:
+                buffer[n] = king_square | end << 6 | 0x4000
+            else:
+                buffer[n] = king_square | end << 6
+            n += 1
+
+        if not checkers and not captures_only:
+            for right, between, path, move in CASTLING_MOVES[us]:
+                if self.castling & right and not occupied & between:
+                    if not self._square_attacked(path[0], them, occupied) and \
+                            not self._square_attacked(path[1], them, occupied):
+                        buffer[n] = move
+                        n += 1
+
+        moves.count = n
+        return moves
+
+    def parse_move(self, uci: str):
+        # match a move in coordinate notation against the legal moves, a
+        # promotion without a piece letter promotes to a queen
+        if len(uci) == 4:
+            uci += "q"
+        for move in self.generate_legal_moves():
+            move_uci = mv.move_to_uci(move)
+            if move_uci == uci or move_uci == uci[:4]:
+                return move
+        return None
+
+    def parse_san(self, san: str):
+        # match a move in standard algebraic notation (Nf3, exd5, e8=Q+,
+        # O-O) against the position, None unless exactly one legal move
+        # fits. the candidates are found by looking backwards from the
+        # target square, which is much cheaper than generating every move.
+        san = san.rstrip("+#!?")
+        if san in ("O-O", "0-0"):
+            return self._parse_castle(mv.KING_CASTLE)
+        if san in ("O-O-O", "0-0-0"):
+            return self._parse_castle(mv.QUEEN_CASTLE)
+
+        piece_type = PieceType.PAWN
+        promotion = None
+        if "=" in san:
+            san, promotion_char = san.split("=", 1)
+            promotion = PIECE_CODES.get(promotion_char[:1].upper())
+            if promotion is None:
+                return None
+        elif len(san) > 2 and san[-1] in "NBRQ":
+            promotion = PIECE_CODES[san[-1]]
+            san = san[:-1]
+        if promotion is not None:
+            promotion &= TYPE_MASK
+            if promotion not in PROMOTION_TYPES:
+                return None
+        if san and san[0] in "NBRQK":
+            piece_type = PIECE_CODES[san[0]] & TYPE_MASK
+            san = san[1:]
+        if len(san) < 2 or san[-2] not in "abcdefgh" or \
+                san[-1] not in "12345678":
+            return None
+        target = bitboard.square_index(san[-2:])
+        origin = san[:-2].replace("x", "")
+
+        us = self.turn
+        squares = self.squares
+        if squares[target] and squares[target] & COLOR_MASK == us:
+            return None
+        own = self.pieces[us | piece_type]
+        occupied = self.occupied
+        flags = mv.CAPTURE if squares[target] else mv.QUIET
+        if piece_type == PieceType.PAWN:
+            white = us == PieceColor.WHITE
+            last_rank = target >> 3 == (7 if white else 0)
+            if (promotion is not None) != last_rank:
+                return None
+            if origin:
+                # a capture, pawns attack backwards like the other colour's
+                attacks = bitboard.BLACK_PAWN_ATTACKS if white else \
+                    bitboard.WHITE_PAWN_ATTACKS
+                starts = attacks[target] & own
+                if not squares[target]:
+                    if target != self.en_passant:
+                        return None
+                    flags = mv.EN_PASSANT
+            elif squares[target]:
+                return None
+            else:
+                step = 8 if white else -8
+                behind = target - step
+                if not 0 <= behind < 64:
+                    return None
+                starts = own & (1 << behind)
+                if not starts and not squares[behind] and \
+                        target >> 3 == (3 if white else 4):
+                    starts = own & (1 << (behind - step))
+                    flags = mv.DOUBLE_PAWN_PUSH
+            if promotion is not None:
+                flags |= mv.PROMOTION | PROMOTION_TYPES.index(promotion)
+        elif piece_type == PieceType.KNIGHT:
+            starts = bitboard.KNIGHT_ATTACKS[target] & own
+        elif piece_type == PieceType.BISHOP:
+            starts = bitboard.bishop_attacks(target, occupied) & own
+        elif piece_type == PieceType.ROOK:
+            starts = bitboard.rook_attacks(target, occupied) & own
+        elif piece_type == PieceType.QUEEN:
+            starts = bitboard.queen_attacks(target, occupied) & own
+        else:
+            starts = bitboard.KING_ATTACKS[target] & own
+
+        for char in origin:
+            if char in "abcdefgh":
+                starts &= bitboard.FILE_A << (ord(char) - 97)
+            elif char in "12345678":
+                starts &= bitboard.RANK_1 << (8 * (ord(char) - 49))
+            else:
+                return None
+
+        found = None
+        king_square = bitboard.lsb(self.pieces[us | PieceType.KING])
+        for start in bitboard.squares_of(starts):
+            move = start | target << 6 | flags << 12
+            if not self._is_legal(move, king_square):
+                continue
+            if found is not None:
+                # ambiguous
+                return None
+            found = move
+        return found
+
+    def _parse_castle(self, castle: int):
+        for move in self.generate_legal_moves():
+            if move >> 12 == castle:
+                return move
+        return None
+
+    def move_to_san(self, move: int):
+        # standard algebraic notation of a legal move, with the file, rank
+        # or square of departure only when another piece could also go
+        flags = move >> 12
+        if flags == mv.KING_CASTLE:
+            san = "O-O"
+        elif flags == mv.QUEEN_CASTLE:
+            san = "O-O-O"
+        else:
+            start = move & 63
+            end = move >> 6 & 63
+            squares = self.squares
+            piece_type = squares[start] & TYPE_MASK
+            capture = "x" if flags & mv.CAPTURE else ""
+            if piece_type == PieceType.PAWN:
+                san = (bitboard.SQUARE_NAMES[start][0] + capture
+                       if capture else "") + bitboard.SQUARE_NAMES[end]
+                if flags & mv.PROMOTION:
+                    san += "=" + PIECE_TYPE_CHARS[PROMOTION_TYPES[flags & 3]]
+            else:
+                origin = bitboard.SQUARE_NAMES[start]
+                rivals = [bitboard.SQUARE_NAMES[other & 63]
+                          for other in self.generate_legal_moves()
+                          if other != move and other >> 6 & 63 == end and
+                          squares[other & 63] & TYPE_MASK == piece_type]
+                if not rivals:
+                    origin = ""
+                elif all(rival[0] != origin[0] for rival in rivals):
+                    origin = origin[0]
+                elif all(rival[1] != origin[1] for rival in rivals):
+                    origin = origin[1]
+                san = PIECE_TYPE_CHARS[piece_type] + origin + capture + \
+                    bitboard.SQUARE_NAMES[end]
+
+        self.make_move(move)
+        if self.in_check():
+            san += "+" if self.generate_legal_moves().count else "#"
+        self.unmake_move()
+        return san
+
+    def enumerate_moves(self, start: str):
+        tracing = log.is_tracing(movegen_log)
+        if tracing:
+            movegen_log.log(log.TRACE, "Enumerating moves from %s", start)
+        start_square = bitboard.square_index(start)
+
+        moves = [mv.move_to_uci(move) for move in self.generate_legal_moves()
+                 if move & 63 == start_square]
+
+        if tracing:
+            movegen_log.log(log.TRACE, "Moves: %s", moves)
+
+        if len(moves) > 0:
+            return moves
+        else:
+            return None
+
+
+# hot paths timed while stats collection is on, see stats.py
+stats.watch(Board, "generate_legal_moves", "movegen")
+stats.watch(Board, "enumerate_moves")
+stats.watch(Board, "make_move")
+stats.watch(Board, "unmake_move")
+stats.watch(Board, "fen_encode")
+stats.watch(Board, "fen_decode")
+stats.watch(Board, "evaluate")
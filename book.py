@@ -0,0 +1,217 @@
+# Bad Chess
+# Copyright (C) Jared De Blander 2022
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+
+# polyglot opening books
+#
+# a polyglot .bin file is a flat array of 16 byte big-endian entries
+#
+#   key     8 bytes  zobrist key of the position, see zobrist.py
+#   move    2 bytes  to file, to rank, from file, from rank (3 bits each)
+#                    and the promotion piece (none, n, b, r, q)
+#   weight  2 bytes  how good the move is, relative to its siblings
+#   learn   4 bytes  unused here
+#
+# sorted by key. the file is memory mapped rather than read, so opening a
+# book of any size costs nothing, a lookup is a binary search touching a
+# handful of pages, and processes opening the same book share the pages in
+# the operating system's cache.
+#
+# castling is stored as the king taking its own rook (e1h1 for O-O).
+#
+#   python book.py build games.pgn book.bin --max-ply 24
+#   python book.py probe book.bin --fen "<fen>"
+
+import mmap
+import random
+import struct
+
+import moves as mv
+import stats
+from board import FEN_NEW_GAME, Board
+from pgn import read_games
+
+ENTRY = struct.Struct(">QHHI")
+KEY = struct.Struct(">Q")
+
+# plies from the start of every game that go into a built book
+DEFAULT_MAX_PLY = 24
+
+RESULT_SCORES = {"1-0": (2, 0), "0-1": (0, 2), "1/2-1/2": (1, 1)}
+
+
+def polyglot_move(move: int):
+    # the polyglot encoding of an engine move
+    start = move & 63
+    end = move >> 6 & 63
+    flags = move >> 12
+    if flags == mv.KING_CASTLE:
+        end = start + 3
+    elif flags == mv.QUEEN_CASTLE:
+        end = start - 4
+    promotion = (flags & 3) + 1 if flags & mv.PROMOTION else 0
+    return end | start << 6 | promotion << 12
+
+
+class OpeningBook:
+    def __init__(self, path: str):
+        self.path = path
+        self.file = open(path, "rb")
+        self.map = None
+        self.entries = 0
+        size = self.file.seek(0, 2)
+        if size >= ENTRY.size:
+            # mapping an empty file is an error on some platforms
+            self.map = mmap.mmap(self.file.fileno(), 0,
+                                 access=mmap.ACCESS_READ)
+            self.entries = size // ENTRY.size
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _first_index(self, key: int):
+        # index of the first entry with this key or a larger one
+        low = 0
+        high = self.entries
+        book = self.map
+        while low < high:
+            middle = (low + high) >> 1
+            if KEY.unpack_from(book, middle * ENTRY.size)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def entries_for(self, key: int):
+        # (polyglot move, weight) of every entry for the key
+        found = []
+        index = self._first_index(key)
+        while index < self.entries:
+            entry_key, move, weight, learn = ENTRY.unpack_from(
+                self.map, index * ENTRY.size)
+            if entry_key != key:
+                break
+            found.append((move, weight))
+            index += 1
+        return found
+
+    def moves(self, board):
+        # (move, weight) of the book moves that are legal on the board
+        found = self.entries_for(board.hash)
+        if not found:
+            return []
+        legal = {polyglot_move(move): move
+                 for move in board.generate_legal_moves()}
+        return [(legal[move], weight) for move, weight in found
+                if move in legal]
+
+    def pick(self, board, best: bool = False, rng=None):
+        # a book move for the board, 0 when out of book. moves are chosen
+        # at random in proportion to their weight, or the heaviest one
+        choices = [(move, weight) for move, weight in self.moves(board)
+                   if weight > 0]
+        if not choices:
+            return 0
+        if best:
+            return max(choices, key=lambda choice: choice[1])[0]
+        rng = rng or random
+        target = rng.randrange(sum(weight for move, weight in choices))
+        for move, weight in choices:
+            target -= weight
+            if target < 0:
+                return move
+        return choices[-1][0]
+
+
+def build(pgn_path: str, book_path: str, max_ply: int = DEFAULT_MAX_PLY,
+          min_games: int = 1):
+    # count every move played in the first max_ply plies of every game,
+    # weighted 2 for a win of the side that played it, 1 for a draw or an
+    # unknown result and 0 for a loss. returns the number of games read.
+    weights = {}
+    counts = {}
+    board = Board()
+    games = 0
+    for game in read_games(pgn_path):
+        games += 1
+        if "FEN" in game.headers:
+            # books only follow games from the usual starting position
+            continue
+        white_score, black_score = RESULT_SCORES.get(game.result, (1, 1))
+        board.fen_decode(FEN_NEW_GAME)
+        for ply, san in enumerate(game.moves[:max_ply]):
+            move = board.parse_san(san)
+            if move is None:
+                break
+            entry = (board.hash, polyglot_move(move))
+            weights[entry] = weights.get(entry, 0) + \
+                (white_score if ply % 2 == 0 else black_score)
+            counts[entry] = counts.get(entry, 0) + 1
+            board.make_move(move)
+
+    entries = [(key, move, weight) for (key, move), weight in weights.items()
+               if counts[(key, move)] >= min_games]
+    # weights are 16 bit, scale them all down together if they overflow. a
+    # move that scored keeps a weight of at least 1 so it stays playable.
+    heaviest = max((weight for key, move, weight in entries), default=0)
+    scale = max(1, -(-heaviest // 0xFFFF))
+    entries = [(key, move, max(1, weight // scale) if weight else 0)
+               for key, move, weight in entries]
+    entries.sort(key=lambda entry: (entry[0], -entry[2]))
+    with open(book_path, "wb") as book:
+        for key, move, weight in entries:
+            book.write(ENTRY.pack(key, move, weight, 0))
+    return games
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Build or query a polyglot opening book.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build_parser = commands.add_parser("build", help="build a book from pgn")
+    build_parser.add_argument("pgn", help="pgn file to read, may be "
+                              "compressed")
+    build_parser.add_argument("book", help="book file to write")
+    build_parser.add_argument("--max-ply", type=int, default=DEFAULT_MAX_PLY,
+                              help="plies of every game to include")
+    build_parser.add_argument("--min-games", type=int, default=1,
+                              help="games a move needs to be included")
+    probe_parser = commands.add_parser("probe", help="list the book moves")
+    probe_parser.add_argument("book", help="book file to read")
+    probe_parser.add_argument("--fen", default=FEN_NEW_GAME,
+                              help="position to look up (default: new game)")
+    stats.add_profile_argument(parser)
+    args = parser.parse_args()
+
+    with stats.profiling(args.profile):
+        if args.command == "build":
+            games = build(args.pgn, args.book, args.max_ply, args.min_games)
+            print(str(games) + " games read")
+            return 0
+
+        board = Board(args.fen)
+        with OpeningBook(args.book) as book:
+            for move, weight in sorted(book.moves(board),
+                                       key=lambda choice: -choice[1]):
+                print(mv.move_to_uci(move) + " " + str(weight))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,153 @@
+# Bad Chess
+# Copyright (C) Jared De Blander 2022
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+
+# the engine in a child process, for front ends that must not block
+#
+# the child runs the same UciEngine as uci.py, commands go in through one
+# queue and every line the engine prints comes back through another. a
+# reader thread on the parent side hands each line to a callback along with
+# the number go() returned for the search it belongs to, so a search of any
+# depth never holds up the caller and lines of a search that was called off
+# are easy to tell apart.
+#
+#   engine = EngineProcess(on_line=print)
+#   engine.start()
+#   search_id = engine.go(fen, movetime_ms=1000)
+#
+# the child is started with "spawn" so it does not inherit the parent's
+# window or display connection, board.py imports without pygame which
+# keeps that start cheap.
+
+import multiprocessing
+import os
+import threading
+
+# how much nicer than the front end the search runs, so the window keeps
+# its frames on a machine with a single free core
+WORKER_NICENESS = 5
+
+
+class QueueWriter:
+    # file-like stand-in for stdout that puts every line on a queue
+    def __init__(self, queue):
+        self.queue = queue
+
+    def write(self, text: str):
+        for line in text.splitlines():
+            if line:
+                self.queue.put(line)
+
+    def flush(self):
+        pass
+
+
+def worker_main(requests, replies, hash_mb: int):
+    from uci import UciEngine
+
+    if hasattr(os, "nice"):
+        try:
+            os.nice(WORKER_NICENESS)
+        except OSError:
+            pass
+    engine = UciEngine(QueueWriter(replies))
+    engine.set_option(["name", "Hash", "value", str(hash_mb)])
+    # a None on the queue ends the loop just like end of input would
+    engine.loop(iter(requests.get, None))
+    replies.put(None)
+
+
+def parse_info(line: str):
+    # depth, score and pv of an "info" line, a mate score is kept as the
+    # string "mate n"
+    tokens = line.split()
+    info = {}
+    index = 1
+    while index < len(tokens):
+        token = tokens[index]
+        if token == "depth" and index + 1 < len(tokens):
+            info["depth"] = int(tokens[index + 1])
+            index += 2
+        elif token == "score" and index + 2 < len(tokens):
+            if tokens[index + 1] == "cp":
+                info["score"] = int(tokens[index + 2])
+            else:
+                info["score"] = tokens[index + 1] + " " + tokens[index + 2]
+            index += 3
+        elif token == "pv":
+            info["pv"] = tokens[index + 1:]
+            break
+        else:
+            index += 1
+    return info
+
+
+class EngineProcess:
+    def __init__(self, on_line=None, hash_mb: int = 16):
+        self.on_line = on_line
+        self.hash_mb = hash_mb
+        self.process = None
+        self.reader = None
+        self.requests = None
+        self.replies = None
+        # searches run one after another and each ends with one bestmove
+        self.searches_started = 0
+        self.searches_finished = 0
+
+    def start(self):
+        context = multiprocessing.get_context("spawn")
+        self.requests = context.Queue()
+        self.replies = context.Queue()
+        self.process = context.Process(
+            target=worker_main,
+            args=(self.requests, self.replies, self.hash_mb), daemon=True)
+        self.process.start()
+        self.reader = threading.Thread(target=self._read, daemon=True)
+        self.reader.start()
+
+    def send(self, line: str):
+        self.requests.put(line)
+
+    def go(self, fen: str, moves=(), movetime_ms: int = 1000,
+           ponder: bool = False):
+        # search fen after moves, with ponder the engine waits for
+        # ponder_hit() before its clock starts. returns the search id.
+        position = "position fen " + fen
+        if moves:
+            position += " moves " + " ".join(moves)
+        self.send(position)
+        self.send("go " + ("ponder " if ponder else "") + "movetime " +
+                  str(movetime_ms))
+        self.searches_started += 1
+        return self.searches_started
+
+    def ponder_hit(self):
+        self.send("ponderhit")
+
+    def stop(self):
+        # the search still answers with a bestmove, callers that no longer
+        # want it ignore lines with its id
+        self.send("stop")
+
+    def close(self, timeout: float = 1.0):
+        if self.process is None:
+            return
+        self.send("quit")
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+        self.process = None
+
+    def _read(self):
+        for line in iter(self.replies.get, None):
+            search_id = self.searches_finished + 1
+            if line.startswith("bestmove"):
+                self.searches_finished = search_id
+            if self.on_line is not None:
+                self.on_line(search_id, line)
@@ -0,0 +1,167 @@
+# Bad Chess
+# Copyright (C) Jared De Blander 2022
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+
+# tapered material and piece-square evaluation
+#
+# every piece contributes a middlegame and an endgame score for its square.
+# the board keeps both sums up to date as pieces move, along with a game
+# phase that falls from 24 towards 0 as knights, bishops, rooks and queens
+# come off. the static evaluation blends the two sums by phase.
+#
+# the tables below are laid out as seen from white's side of the board,
+# rank 8 on the first row, and are based on the simplified evaluation
+# function by Tomasz Michniewski.
+
+PAWN = 1
+ROOK = 2
+KNIGHT = 3
+BISHOP = 4
+QUEEN = 5
+KING = 6
+WHITE = 8
+BLACK = 16
+
+MIDDLEGAME_VALUES = {PAWN: 100, KNIGHT: 320, BISHOP: 330, ROOK: 500,
+                     QUEEN: 900, KING: 0}
+ENDGAME_VALUES = {PAWN: 120, KNIGHT: 300, BISHOP: 320, ROOK: 530,
+                  QUEEN: 950, KING: 0}
+PHASE_WEIGHTS = {PAWN: 0, KNIGHT: 1, BISHOP: 1, ROOK: 2, QUEEN: 4, KING: 0}
+TOTAL_PHASE = 24
+
+PAWN_MIDDLEGAME = [
+    0, 0, 0, 0, 0, 0, 0, 0,
+    50, 50, 50, 50, 50, 50, 50, 50,
+    10, 10, 20, 30, 30, 20, 10, 10,
+    5, 5, 10, 25, 25, 10, 5, 5,
+    0, 0, 0, 20, 20, 0, 0, 0,
+    5, -5, -10, 0, 0, -10, -5, 5,
+    5, 10, 10, -20, -20, 10, 10, 5,
+    0, 0, 0, 0, 0, 0, 0, 0,
+]
+
+PAWN_ENDGAME = [
+    0, 0, 0, 0, 0, 0, 0, 0,
+    80, 80, 80, 80, 80, 80, 80, 80,
+    50, 50, 50, 50, 50, 50, 50, 50,
+    30, 30, 30, 30, 30, 30, 30, 30,
+    15, 15, 15, 15, 15, 15, 15, 15,
+    5, 5, 5, 5, 5, 5, 5, 5,
+    0, 0, 0, 0, 0, 0, 0, 0,
+    0, 0, 0, 0, 0, 0, 0, 0,
+]
+
+KNIGHT_TABLE = [
+    -50, -40, -30, -30, -30, -30, -40, -50,
+    -40, -20, 0, 0, 0, 0, -20, -40,
+    -30, 0, 10, 15, 15, 10, 0, -30,
+    -30, 5, 15, 20, 20, 15, 5, -30,
+    -30, 0, 15, 20, 20, 15, 0, -30,
+    -30, 5, 10, 15, 15, 10, 5, -30,
+    -40, -20, 0, 5, 5, 0, -20, -40,
+    -50, -40, -30, -30, -30, -30, -40, -50,
+]
+
+BISHOP_TABLE = [
+    -20, -10, -10, -10, -10, -10, -10, -20,
+    -10, 0, 0, 0, 0, 0, 0, -10,
+    -10, 0, 5, 10, 10, 5, 0, -10,
+    -10, 5, 5, 10, 10, 5, 5, -10,
+    -10, 0, 10, 10, 10, 10, 0, -10,
+    -10, 10, 10, 10, 10, 10, 10, -10,
+    -10, 5, 0, 0, 0, 0, 5, -10,
+    -20, -10, -10, -10, -10, -10, -10, -20,
+]
+
+ROOK_TABLE = [
+    0, 0, 0, 0, 0, 0, 0, 0,
+    5, 10, 10, 10, 10, 10, 10, 5,
+    -5, 0, 0, 0, 0, 0, 0, -5,
+    -5, 0, 0, 0, 0, 0, 0, -5,
+    -5, 0, 0, 0, 0, 0, 0, -5,
+    -5, 0, 0, 0, 0, 0, 0, -5,
+    -5, 0, 0, 0, 0, 0, 0, -5,
+    0, 0, 0, 5, 5, 0, 0, 0,
+]
+
+QUEEN_TABLE = [
+    -20, -10, -10, -5, -5, -10, -10, -20,
+    -10, 0, 0, 0, 0, 0, 0, -10,
+    -10, 0, 5, 5, 5, 5, 0, -10,
+    -5, 0, 5, 5, 5, 5, 0, -5,
+    0, 0, 5, 5, 5, 5, 0, -5,
+    -10, 5, 5, 5, 5, 5, 0, -10,
+    -10, 0, 5, 0, 0, 0, 0, -10,
+    -20, -10, -10, -5, -5, -10, -10, -20,
+]
+
+KING_MIDDLEGAME = [
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -30, -40, -40, -50, -50, -40, -40, -30,
+    -20, -30, -30, -40, -40, -30, -30, -20,
+    -10, -20, -20, -20, -20, -20, -20, -10,
+    20, 20, 0, 0, 0, 0, 20, 20,
+    20, 30, 10, 0, 0, 10, 30, 20,
+]
+
+KING_ENDGAME = [
+    -50, -40, -30, -20, -20, -30, -40, -50,
+    -30, -20, -10, 0, 0, -10, -20, -30,
+    -30, -10, 20, 30, 30, 20, -10, -30,
+    -30, -10, 30, 40, 40, 30, -10, -30,
+    -30, -10, 30, 40, 40, 30, -10, -30,
+    -30, -10, 20, 30, 30, 20, -10, -30,
+    -30, -30, 0, 0, 0, 0, -30, -30,
+    -50, -30, -30, -30, -30, -30, -30, -50,
+]
+
+_PIECE_SQUARE_TABLES = {
+    PAWN: (PAWN_MIDDLEGAME, PAWN_ENDGAME),
+    KNIGHT: (KNIGHT_TABLE, KNIGHT_TABLE),
+    BISHOP: (BISHOP_TABLE, BISHOP_TABLE),
+    ROOK: (ROOK_TABLE, ROOK_TABLE),
+    QUEEN: (QUEEN_TABLE, QUEEN_TABLE),
+    KING: (KING_MIDDLEGAME, KING_ENDGAME),
+}
+
+
+def _signed_tables(values, table_index):
+    # scores indexed by piece code and square (a1 = 0), positive for white
+    # and negative for black, material included. a white piece on square s
+    # reads row s ^ 56 of the printed table, a black piece is mirrored and
+    # reads row s directly.
+    tables = [[0] * 64 for code in range(23)]
+    for piece_type, pair in _PIECE_SQUARE_TABLES.items():
+        table = pair[table_index]
+        value = values[piece_type]
+        tables[WHITE | piece_type] = [value + table[square ^ 56]
+                                      for square in range(64)]
+        tables[BLACK | piece_type] = [-(value + table[square])
+                                      for square in range(64)]
+    return tables
+
+
+MIDDLEGAME_TABLES = _signed_tables(MIDDLEGAME_VALUES, 0)
+ENDGAME_TABLES = _signed_tables(ENDGAME_VALUES, 1)
+
+# phase weight indexed by piece code
+PHASES = [0] * 23
+for _piece_type, _weight in PHASE_WEIGHTS.items():
+    PHASES[WHITE | _piece_type] = _weight
+    PHASES[BLACK | _piece_type] = _weight
+
+
+def taper(middlegame: int, endgame: int, phase: int):
+    # blend the two sums, a phase above the starting total (after
+    # promotions) counts as a full middlegame
+    if phase > TOTAL_PHASE:
+        phase = TOTAL_PHASE
+    return (middlegame * phase + endgame * (TOTAL_PHASE - phase)) // \
+        TOTAL_PHASE
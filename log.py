@@ -0,0 +1,126 @@
+# Bad Chess
+# Copyright (C) Jared De Blander 2022
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+
+# diagnostics are leveled per subsystem under "bad_chess". nothing below
+# WARNING is shown by default. TRACE sits below DEBUG for the per-call
+# chatter of the board, and hot paths check is_tracing() before building
+# any message so a disabled logger costs one attribute read.
+#
+# each subsystem logger filters by level itself and only hands messages
+# that pass on to the standard logging module, which is imported the first
+# time that happens. importing logging costs more than the rest of the
+# engine put together, so worker processes that never log never load it.
+#
+# tracing can be switched on per subsystem from the environment
+#
+#   BAD_CHESS_TRACE=fen,movegen python perft.py 3
+#   BAD_CHESS_TRACE=all python main.py
+#
+# or from code with enable_trace("board").
+
+import os
+
+TRACE = 5
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+
+ROOT_NAME = "bad_chess"
+SUBSYSTEMS = ("board", "fen", "movegen", "search")
+
+_loggers = {}
+_handler_installed = False
+
+
+def _stdlib_logger(name: str, install_handler: bool):
+    global _handler_installed
+    import logging
+
+    logging.addLevelName(TRACE, "TRACE")
+    root = logging.getLogger(ROOT_NAME)
+    if install_handler and not _handler_installed:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter(
+            "%(levelname)s %(name)s: %(message)s"))
+        root.addHandler(handler)
+        _handler_installed = True
+    logger = logging.getLogger(name)
+    logger.setLevel(TRACE)
+    return logger
+
+
+class Logger:
+    __slots__ = ("name", "level", "_logger")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.level = WARNING
+        self._logger = None
+
+    def is_enabled_for(self, level: int):
+        return level >= self.level
+
+    def log(self, level: int, message: str, *args):
+        if level >= self.level:
+            if self._logger is None:
+                self._logger = _stdlib_logger(self.name, self.level < WARNING)
+            self._logger.log(level, message, *args)
+
+    def trace(self, message: str, *args):
+        self.log(TRACE, message, *args)
+
+    def debug(self, message: str, *args):
+        self.log(DEBUG, message, *args)
+
+    def info(self, message: str, *args):
+        self.log(INFO, message, *args)
+
+    def warning(self, message: str, *args):
+        self.log(WARNING, message, *args)
+
+    def error(self, message: str, *args):
+        self.log(ERROR, message, *args)
+
+
+def get_logger(subsystem: str):
+    logger = _loggers.get(subsystem)
+    if logger is None:
+        logger = _loggers[subsystem] = Logger(ROOT_NAME + "." + subsystem)
+    return logger
+
+
+def is_tracing(logger: Logger):
+    return logger.level <= TRACE
+
+
+def set_level(level: int, *subsystems: str):
+    # "all" or no subsystems applies the level everywhere. anything more
+    # verbose than WARNING gets a stderr handler on the first message.
+    if not subsystems or "all" in subsystems:
+        subsystems = SUBSYSTEMS
+    for subsystem in subsystems:
+        logger = get_logger(subsystem)
+        logger.level = level
+        if level < WARNING and logger._logger is not None:
+            logger._logger = _stdlib_logger(logger.name, True)
+
+
+def enable_trace(*subsystems: str):
+    set_level(TRACE, *subsystems)
+
+
+def disable_trace(*subsystems: str):
+    set_level(WARNING, *subsystems)
+
+
+_requested = os.environ.get("BAD_CHESS_TRACE", "").strip()
+if _requested:
+    enable_trace(*[name.strip() for name in _requested.split(",")
+                   if name.strip()])
@@ -7,749 +7,300 @@
 # (at your option) any later version.
 #
 
-# chess board is laid out in rows called ranks and columns called files
-# the board is 8 ranks and 8 files
-#
-# Forsyth-Edwards Notation (FEN) is a standard notation for describing
-# a particular board position of a chess game.
+# the pygame front end, the rules engine lives in board.py. pygame is only
+# imported once the window is opened so importing this module stays cheap.
+
+import sys
 
-import pygame
 import settings
+import bitboard
+import stats
+from engine_process import EngineProcess, parse_info
+from moves import move_to_uci
+# the engine names this module used to define are still importable from it
+from board import FEN_NEW_GAME, Board, Piece, PieceColor, PieceType
+
+# the strip under the board holds the fen and the engine's thinking
+STRIP_TOP = 8 * settings.SQUARE_SIZE
+STRIP_LINE = (settings.HEIGHT - STRIP_TOP) // 2
+
+
+def build_static_layer():
+    # the checkerboard and tile names never change, they are rendered once
+    # and squares are restored from this layer when they need redrawing
+    global static_layer, label_surfaces
+    static_layer = pygame.Surface(
+        (8 * settings.SQUARE_SIZE, 8 * settings.SQUARE_SIZE))
+    label_surfaces = []
+    for rank in range(8):
+        for file in range(8):
+            tile_name = chr(file + 97) + str(8 - rank)
+            label = font.render(tile_name, True, settings.FONT_COLOR_WHITE)
+            label_surfaces.append(label)
 
-FEN_NEW_GAME = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
-
-# enumerate all the types of chess pieces
-
-
-class PieceType:
-    NONE = None
-    PAWN = 1
-    ROOK = 2
-    KNIGHT = 3
-    BISHOP = 4
-    QUEEN = 5
-    KING = 6
-
-# enumerate all the colors of chess pieces
-
-
-class PieceColor:
-    NONE = None
-    WHITE = 8
-    BLACK = 16
-
-# define a class to represent a chess piece
-
-
-class Piece:
-    def __init__(self, fen_character):
-        if fen_character == "P":
-            self.type = PieceType.PAWN
-            self.color = PieceColor.WHITE
-        elif fen_character == "p":
-            self.type = PieceType.PAWN
-            self.color = PieceColor.BLACK
-        elif fen_character == "R":
-            self.type = PieceType.ROOK
-            self.color = PieceColor.WHITE
-        elif fen_character == "r":
-            self.type = PieceType.ROOK
-            self.color = PieceColor.BLACK
-        elif fen_character == "N":
-            self.type = PieceType.KNIGHT
-            self.color = PieceColor.WHITE
-        elif fen_character == "n":
-            self.type = PieceType.KNIGHT
-            self.color = PieceColor.BLACK
-        elif fen_character == "B":
-            self.type = PieceType.BISHOP
-            self.color = PieceColor.WHITE
-        elif fen_character == "b":
-            self.type = PieceType.BISHOP
-            self.color = PieceColor.BLACK
-        elif fen_character == "Q":
-            self.type = PieceType.QUEEN
-            self.color = PieceColor.WHITE
-        elif fen_character == "q":
-            self.type = PieceType.QUEEN
-            self.color = PieceColor.BLACK
-        elif fen_character == "K":
-            self.type = PieceType.KING
-            self.color = PieceColor.WHITE
-        elif fen_character == "k":
-            self.type = PieceType.KING
-            self.color = PieceColor.BLACK
-        else:
-            self.type = PieceType.NONE
-            self.color = PieceColor.NONE
-
-    def value(self):
-        if self.type == PieceType.PAWN:
-            return 1
-        elif self.type == PieceType.ROOK:
-            return 5
-        elif self.type == PieceType.KNIGHT:
-            return 3
-        elif self.type == PieceType.BISHOP:
-            return 3
-        elif self.type == PieceType.QUEEN:
-            return 9
-        elif self.type == PieceType.KING:
-            return 100
-        else:
-            return None
-
-    def fen_char(self):
-
-        my_char = "?"
-        if self.type == PieceType.PAWN:
-            my_char = "P"
-        elif self.type == PieceType.ROOK:
-            my_char = "R"
-        elif self.type == PieceType.KNIGHT:
-            my_char = "N"
-        elif self.type == PieceType.BISHOP:
-            my_char = "B"
-        elif self.type == PieceType.QUEEN:
-            my_char = "Q"
-        elif self.type == PieceType.KING:
-            my_char = "K"
-
-        if self.color == PieceColor.BLACK:
-            my_char = my_char.lower()
-
-        return my_char
-
-    def __str__(self):
-        return self.fen_char()
-
-# define a class to represent a chess board
-
-
-class Board:
-    def __init__(self, fen_string: str = FEN_NEW_GAME):
-        self.board = [[None for x in range(8)] for y in range(8)]
-        self.turn = PieceColor.WHITE
-        self.fen_decode(fen_string)
-
-    def __str__(self):
-        return "Board: " + str(self.board)
-
-    def wipe_board(self):
-        # initialize the board with the starting positions
-        for y in range(8):
-            for x in range(8):
-                self.board[y][x] = None
-
-    def army_difference(self, color: PieceColor = None):
-        army_differential = 0
-        for rank in range(8):
-            for file in range(8):
-                if self.board[rank][file] is not None:
-                    if self.board[rank][file].color == PieceColor.WHITE:
-                        army_differential += self.board[rank][file].value()
-                    else:
-                        army_differential -= self.board[rank][file].value()
-
-        if color == PieceColor.BLACK:
-            army_differential = -army_differential
-
-        return army_differential
-
-    def reset_board(self):
-        self.fen_decode(FEN_NEW_GAME)
-
-    def move(self, start: str, end: str):
-        print("Moving piece from " + start + " to " + end)
-        start_file = ord(start[0]) - 97
-        start_rank = 8 - int(start[1])
-        end_file = ord(end[0]) - 97
-        end_rank = 8 - int(end[1])
-
-        self.board[end_rank][end_file] = self.board[start_rank][start_file]
-        self.board[start_rank][start_file] = None
-
-        if self.turn == PieceColor.WHITE:
-            self.turn = PieceColor.BLACK
-        else:
-            self.turn = PieceColor.WHITE
+            if (file + rank) % 2 == 0:
+                color = settings.WHITE
+            else:
+                color = settings.BLACK
+            pygame.draw.rect(static_layer, color, square_rect(rank, file))
+            static_layer.blit(label, (file * settings.SQUARE_SIZE + 10,
+                                      rank * settings.SQUARE_SIZE + 10))
 
-    def fen_encode(self):
-        board_string = ""
-        empty_counter = 0
 
-        for rank in range(8):
-            for file in range(8):
-                if self.board[rank][file] is None:
-                    empty_counter += 1
-                else:
-                    if empty_counter > 0:
-                        board_string += str(empty_counter)
-                        empty_counter = 0
-                    board_string += str(self.board[rank][file])
+def square_rect(rank: int, file: int):
+    return pygame.Rect(file * settings.SQUARE_SIZE,
+                       rank * settings.SQUARE_SIZE,
+                       settings.SQUARE_SIZE, settings.SQUARE_SIZE)
 
-            if empty_counter > 0:
-                board_string += str(empty_counter)
 
-            board_string += "/"
-            empty_counter = 0
+def handle_clicks():
+    # pick up a piece of the side to move or drop the held one
+    if not mouse['clicked'] or mouse['tile'] is None:
+        return
 
-        board_string = board_string.rstrip("/")
+    if engine_to_move():
+        return
 
-        if self.turn == PieceColor.WHITE:
-            board_string += " w"
-        else:
-            board_string += " b"
-
-        return board_string
-
-    def fen_decode(self, board_state: str):
-        print("Loading board state: " + board_state)
-        self.wipe_board()
-        rank = 7
-        file = 0
-
-        fen_chunks = board_state.split(" ")
-
-        if len(fen_chunks) > 0:
-            for char in fen_chunks[0]:
-                if char == "/":
-                    rank -= 1
-                    file = 0
-                elif char.isdigit():
-                    file += int(char)
-                else:
-                    self.board[7 - rank][file] = Piece(char)
-                    file += 1
-
-        if len(fen_chunks) > 1:
-            if fen_chunks[1] == "w":
-                self.turn = PieceColor.WHITE
+    if mouse['dragging'] is None:
+        piece = board.piece_at(bitboard.square_index(mouse['tile']))
+        if piece is not None and piece.color == board.turn:
+            mouse['moves'] = board.enumerate_moves(mouse['tile'])
+            if mouse['moves'] is not None:
+                mouse['dragging'] = mouse['tile']
+                mouse['targets'] = {move[2:4] for move in mouse['moves']}
+    elif mouse['tile'] != mouse['dragging']:
+        move = board.move(mouse['dragging'], mouse['tile'])
+        mouse['dragging'] = None
+        mouse['moves'] = None
+        mouse['targets'] = set()
+        if move is not None:
+            engine_position_changed(move_to_uci(move))
+
+
+def tile_highlight(tile_name: str, tile_piece: Piece):
+    # highlight color for the tile, None leaves the plain checkerboard
+    color = None
+
+    if tile_name == mouse['tile'] and mouse['dragging'] is None:
+        if tile_piece is not None:
+            if tile_piece.color == board.turn:
+                color = (40, 255, 40)
             else:
-                self.turn = PieceColor.BLACK
-
-        print("Board state loaded: " + self.fen_encode())
-
-    def enumerate_moves(self, start: str):
-        print("Enumerating moves from " + start)
-        moves = []
-        start_file = ord(start[0]) - 97
-        start_rank = 8 - int(start[1])
-
-        piece = self.board[start_rank][start_file]
-
-        if piece is None:
-            return None
-
-        if piece.type == PieceType.PAWN:
-            if piece.color == PieceColor.WHITE:
-                if start_rank == 6:
-                    # check for first turn move
-                    if self.board[start_rank - 1][start_file] is None:
-                        moves.append(start + chr(start_file + 97) +
-                                     str(8 - (start_rank - 1)))
-                    if self.board[start_rank - 2][start_file] is None:
-                        moves.append(start + chr(start_file + 97) +
-                                     str(8 - (start_rank - 2)))
-                else:
-                    # subsequent moves
-                    if self.board[start_rank - 1][start_file] is None:
-                        moves.append(start + chr(start_file + 97) +
-                                     str(8 - (start_rank - 1)))
-                # check for captures
-                if start_rank > 0:
-                    if start_file > 0:
-                        if self.board[start_rank - 1][start_file - 1] is not None:
-                            if self.board[start_rank - 1][start_file - 1].color == PieceColor.BLACK:
-                                moves.append(start + chr(start_file + 96) +
-                                             str(8 - (start_rank - 1)))
-                    if start_file < 7:
-                        if self.board[start_rank - 1][start_file + 1] is not None:
-                            if self.board[start_rank - 1][start_file + 1].color == PieceColor.BLACK:
-                                moves.append(start + chr(start_file + 98) +
-                                             str(8 - (start_rank - 1)))
+                color = (255, 40, 40)
 
-            else:
-                if start_rank == 1:
-                    # check for first turn move
-                    if self.board[start_rank + 1][start_file] is None:
-                        moves.append(start + chr(start_file + 97) +
-                                     str(8 - (start_rank + 1)))
-                    if self.board[start_rank + 2][start_file] is None:
-                        moves.append(start + chr(start_file + 97) +
-                                     str(8 - (start_rank + 2)))
-                else:
-                    # subsequent moves
-                    if self.board[start_rank + 1][start_file] is None:
-                        moves.append(start + chr(start_file + 97) +
-                                     str(8 - (start_rank + 1)))
-                # check for captures
-                if start_rank < 7:
-                    if start_file > 0:
-                        if self.board[start_rank + 1][start_file - 1] is not None:
-                            if self.board[start_rank + 1][start_file - 1].color == PieceColor.WHITE:
-                                moves.append(start + chr(start_file + 96) +
-                                             str(8 - (start_rank + 1)))
-                    if start_file < 7:
-                        if self.board[start_rank + 1][start_file + 1] is not None:
-                            if self.board[start_rank + 1][start_file + 1].color == PieceColor.WHITE:
-                                moves.append(start + chr(start_file + 98) +
-                                             str(8 - (start_rank + 1)))
-
-        elif piece.type == PieceType.ROOK:
-            cur_rank = start_rank
-            cur_file = start_file
-
-            while cur_rank < 7:
-                cur_rank += 1
-                if self.board[cur_rank][cur_file] is None:
-                    moves.append(start + chr(cur_file + 97) +
-                                 str(8 - cur_rank))
-                else:
-                    if self.board[cur_rank][cur_file].color != piece.color:
-                        moves.append(start + chr(cur_file + 97) +
-                                     str(8 - cur_rank))
-                    break
-
-            cur_rank = start_rank
-            cur_file = start_file
-
-            while cur_rank > 0:
-                cur_rank -= 1
-                if self.board[cur_rank][cur_file] is None:
-                    moves.append(start + chr(cur_file + 97) +
-                                 str(8 - cur_rank))
-                else:
-                    if self.board[cur_rank][cur_file].color != piece.color:
-                        moves.append(start + chr(cur_file + 97) +
-                                     str(8 - cur_rank))
-                    break
-
-            cur_rank = start_rank
-            cur_file = start_file
-
-            while cur_file < 7:
-                cur_file += 1
-                if self.board[cur_rank][cur_file] is None:
-                    moves.append(start + chr(cur_file + 97) +
-                                 str(8 - cur_rank))
-                else:
-                    if self.board[cur_rank][cur_file].color != piece.color:
-                        moves.append(start + chr(cur_file + 97) +
-                                     str(8 - cur_rank))
-                    break
-
-            cur_rank = start_rank
-            cur_file = start_file
-
-            while cur_file > 0:
-                cur_file -= 1
-                if self.board[cur_rank][cur_file] is None:
-                    moves.append(start + chr(cur_file + 97) +
-                                 str(8 - cur_rank))
-                else:
-                    if self.board[cur_rank][cur_file].color != piece.color:
-                        moves.append(start + chr(cur_file + 97) +
-                                     str(8 - cur_rank))
-                    break
-
-        elif piece.type == PieceType.KNIGHT:
-            pass
-        elif piece.type == PieceType.BISHOP:
-            # check for captures in each diagonal
-            cur_rank = start_rank
-            cur_file = start_file
-
-            while cur_rank < 7 and cur_file < 7:
-                cur_rank += 1
-                cur_file += 1
-                if self.board[cur_rank][cur_file] is None:
-                    moves.append(start + chr(cur_file + 97) +
-                                 str(8 - cur_rank))
-                else:
-                    if self.board[cur_rank][cur_file].color != piece.color:
-                        moves.append(start + chr(cur_file + 97) +
-                                     str(8 - cur_rank))
-                    break
-
-            cur_rank = start_rank
-            cur_file = start_file
-
-            while cur_rank < 7 and cur_file > 0:
-                cur_rank += 1
-                cur_file -= 1
-                if self.board[cur_rank][cur_file] is None:
-                    moves.append(start + chr(cur_file + 97) +
-                                 str(8 - cur_rank))
-                else:
-                    if self.board[cur_rank][cur_file].color != piece.color:
-                        moves.append(start + chr(cur_file + 97) +
-                                     str(8 - cur_rank))
-                    break
-
-            cur_rank = start_rank
-            cur_file = start_file
-
-            while cur_rank > 0 and cur_file < 7:
-                cur_rank -= 1
-                cur_file += 1
-                if self.board[cur_rank][cur_file] is None:
-                    moves.append(start + chr(cur_file + 97) +
-                                 str(8 - cur_rank))
-                else:
-                    if self.board[cur_rank][cur_file].color != piece.color:
-                        moves.append(start + chr(cur_file + 97) +
-                                     str(8 - cur_rank))
-                    break
-
-            cur_rank = start_rank
-            cur_file = start_file
-
-            while cur_rank > 0 and cur_file > 0:
-                cur_rank -= 1
-                cur_file -= 1
-                if self.board[cur_rank][cur_file] is None:
-                    moves.append(start + chr(cur_file + 97) +
-                                 str(8 - cur_rank))
-                else:
-                    if self.board[cur_rank][cur_file].color != piece.color:
-                        moves.append(start + chr(cur_file + 97) +
-                                     str(8 - cur_rank))
-                    break
-
-        elif piece.type == PieceType.QUEEN:
-            # check the queen horizontal and vertical moves
-            cur_rank = start_rank
-            cur_file = start_file
-
-            while cur_rank < 7:
-                cur_rank += 1
-                if self.board[cur_rank][cur_file] is None:
-                    moves.append(start + chr(cur_file + 97) +
-                                 str(8 - cur_rank))
-                else:
-                    if self.board[cur_rank][cur_file].color != piece.color:
-                        moves.append(start + chr(cur_file + 97) +
-                                     str(8 - cur_rank))
-                    break
-
-            cur_rank = start_rank
-            cur_file = start_file
-
-            while cur_rank > 0:
-                cur_rank -= 1
-                if self.board[cur_rank][cur_file] is None:
-                    moves.append(start + chr(cur_file + 97) +
-                                 str(8 - cur_rank))
-                else:
-                    if self.board[cur_rank][cur_file].color != piece.color:
-                        moves.append(start + chr(cur_file + 97) +
-                                     str(8 - cur_rank))
-                    break
-
-            cur_rank = start_rank
-            cur_file = start_file
-
-            while cur_file < 7:
-                cur_file += 1
-                if self.board[cur_rank][cur_file] is None:
-                    moves.append(start + chr(cur_file + 97) +
-                                 str(8 - cur_rank))
-                else:
-                    if self.board[cur_rank][cur_file].color != piece.color:
-                        moves.append(start + chr(cur_file + 97) +
-                                     str(8 - cur_rank))
-                    break
-
-            cur_rank = start_rank
-            cur_file = start_file
-
-            while cur_file > 0:
-                cur_file -= 1
-                if self.board[cur_rank][cur_file] is None:
-                    moves.append(start + chr(cur_file + 97) +
-                                 str(8 - cur_rank))
-                else:
-                    if self.board[cur_rank][cur_file].color != piece.color:
-                        moves.append(start + chr(cur_file + 97) +
-                                     str(8 - cur_rank))
-                    break
-
-            # check the queen diagonal moves
-            cur_rank = start_rank
-            cur_file = start_file
-
-            while cur_rank < 7 and cur_file < 7:
-                cur_rank += 1
-                cur_file += 1
-                if self.board[cur_rank][cur_file] is None:
-                    moves.append(start + chr(cur_file + 97) +
-                                 str(8 - cur_rank))
-                else:
-                    if self.board[cur_rank][cur_file].color != piece.color:
-                        moves.append(start + chr(cur_file + 97) +
-                                     str(8 - cur_rank))
-                    break
-
-            cur_rank = start_rank
-            cur_file = start_file
-
-            while cur_rank < 7 and cur_file > 0:
-                cur_rank += 1
-                cur_file -= 1
-                if self.board[cur_rank][cur_file] is None:
-                    moves.append(start + chr(cur_file + 97) +
-                                 str(8 - cur_rank))
-                else:
-                    if self.board[cur_rank][cur_file].color != piece.color:
-                        moves.append(start + chr(cur_file + 97) +
-                                     str(8 - cur_rank))
-                    break
-
-            cur_rank = start_rank
-            cur_file = start_file
-
-            while cur_rank > 0 and cur_file < 7:
-                cur_rank -= 1
-                cur_file += 1
-                if self.board[cur_rank][cur_file] is None:
-                    moves.append(start + chr(cur_file + 97) +
-                                 str(8 - cur_rank))
-                else:
-                    if self.board[cur_rank][cur_file].color != piece.color:
-                        moves.append(start + chr(cur_file + 97) +
-                                     str(8 - cur_rank))
-                    break
-
-            cur_rank = start_rank
-            cur_file = start_file
-
-            while cur_rank > 0 and cur_file > 0:
-                cur_rank -= 1
-                cur_file -= 1
-                if self.board[cur_rank][cur_file] is None:
-                    moves.append(start + chr(cur_file + 97) +
-                                 str(8 - cur_rank))
-                else:
-                    if self.board[cur_rank][cur_file].color != piece.color:
-                        moves.append(start + chr(cur_file + 97) +
-                                     str(8 - cur_rank))
-                    break
-        elif piece.type == PieceType.KING:
-            # check the kings moves
-
-            # king horizontal and vertical moves
-            cur_rank = start_rank
-            cur_file = start_file
-
-            if cur_rank < 7:
-                cur_rank += 1
-                if self.board[cur_rank][cur_file] is None:
-                    moves.append(start + chr(cur_file + 97) +
-                                 str(8 - cur_rank))
-                else:
-                    if self.board[cur_rank][cur_file].color != piece.color:
-                        moves.append(start + chr(cur_file + 97) +
-                                     str(8 - cur_rank))
-
-            cur_rank = start_rank
-            cur_file = start_file
-
-            if cur_rank > 0:
-                cur_rank -= 1
-                if self.board[cur_rank][cur_file] is None:
-                    moves.append(start + chr(cur_file + 97) +
-                                 str(8 - cur_rank))
-                else:
-                    if self.board[cur_rank][cur_file].color != piece.color:
-                        moves.append(start + chr(cur_file + 97) +
-                                     str(8 - cur_rank))
-
-            cur_rank = start_rank
-            cur_file = start_file
-
-            if cur_file < 7:
-                cur_file += 1
-                if self.board[cur_rank][cur_file] is None:
-                    moves.append(start + chr(cur_file + 97) +
-                                 str(8 - cur_rank))
-                else:
-                    if self.board[cur_rank][cur_file].color != piece.color:
-                        moves.append(start + chr(cur_file + 97) +
-                                     str(8 - cur_rank))
-
-            cur_rank = start_rank
-            cur_file = start_file
-
-            if cur_file > 0:
-                cur_file -= 1
-                if self.board[cur_rank][cur_file] is None:
-                    moves.append(start + chr(cur_file + 97) +
-                                 str(8 - cur_rank))
-                else:
-                    if self.board[cur_rank][cur_file].color != piece.color:
-                        moves.append(start + chr(cur_file + 97) +
-                                     str(8 - cur_rank))
-
-            # king diagonal moves
-            cur_rank = start_rank
-            cur_file = start_file
-
-            if cur_rank < 7 and cur_file < 7:
-                cur_rank += 1
-                cur_file += 1
-                if self.board[cur_rank][cur_file] is None:
-                    moves.append(start + chr(cur_file + 97) +
-                                 str(8 - cur_rank))
-                else:
-                    if self.board[cur_rank][cur_file].color != piece.color:
-                        moves.append(start + chr(cur_file + 97) +
-                                     str(8 - cur_rank))
-
-            cur_rank = start_rank
-            cur_file = start_file
-
-            if cur_rank < 7 and cur_file > 0:
-                cur_rank += 1
-                cur_file -= 1
-                if self.board[cur_rank][cur_file] is None:
-                    moves.append(start + chr(cur_file + 97) +
-                                 str(8 - cur_rank))
-                else:
-                    if self.board[cur_rank][cur_file].color != piece.color:
-                        moves.append(start + chr(cur_file + 97) +
-                                     str(8 - cur_rank))
-
-            cur_rank = start_rank
-            cur_file = start_file
-
-            if cur_rank > 0 and cur_file < 7:
-                cur_rank -= 1
-                cur_file += 1
-                if self.board[cur_rank][cur_file] is None:
-                    moves.append(start + chr(cur_file + 97) +
-                                 str(8 - cur_rank))
-                else:
-                    if self.board[cur_rank][cur_file].color != piece.color:
-                        moves.append(start + chr(cur_file + 97) +
-                                     str(8 - cur_rank))
-
-            cur_rank = start_rank
-            cur_file = start_file
-
-            if cur_rank > 0 and cur_file > 0:
-                cur_rank -= 1
-                cur_file -= 1
-                if self.board[cur_rank][cur_file] is None:
-                    moves.append(start + chr(cur_file + 97) +
-                                 str(8 - cur_rank))
-                else:
-                    if self.board[cur_rank][cur_file].color != piece.color:
-                        moves.append(start + chr(cur_file + 97) +
-                                     str(8 - cur_rank))
-
-        print("Moves: " + str(moves))
-
-        if len(moves) > 0:
-            return moves
-        else:
-            return None
+    if tile_name in mouse['targets']:
+        color = (255, 255, 180)
+
+    if mouse['dragging'] is not None:
+        if mouse['dragging'] == tile_name:
+            color = (255, 255, 40)
+        elif mouse['tile'] == tile_name:
+            color = (40, 40, 255)
+
+    return color
 
 
 def draw_board():
-    # draw the board
+    # only squares whose piece or highlight changed since they were last
+    # drawn are repainted, their rects are collected for display.update
+    global scoreboard_key
+
     for rank in range(8):
         for file in range(8):
+            index = rank * 8 + file
             # generate the tile name
             tile_name = chr(file + 97) + str(8 - rank)
+            tile_piece = board.piece_at((7 - rank) * 8 + file)
+            color = tile_highlight(tile_name, tile_piece)
 
-            if (file + rank) % 2 == 0:
-                color = settings.WHITE
-            else:
-                color = settings.BLACK
-
-            if tile_name == mouse['tile'] and mouse['dragging'] is None:
-                if board.board[rank][file] is not None:
-                    if board.board[rank][file].color == board.turn:
-                        color = (40, 255, 40)
-                        if mouse['clicked']:
-                            mouse['moves'] = board.enumerate_moves(tile_name)
-                            if mouse['moves'] is not None:
-                                mouse['dragging'] = tile_name
+            state = (color, tile_piece)
+            if square_state[index] == state:
+                continue
+            square_state[index] = state
 
-                    else:
-                        color = (255, 40, 40)
-
-            if mouse['moves'] is not None:
-                search = mouse['dragging'] + tile_name
-                if search in mouse['moves']:
-                    color = (255, 255, 180)
-
-            if mouse['dragging'] is not None:
-
-                if mouse['dragging'] == tile_name:
-                    color = (255, 255, 40)
-
-                elif mouse['tile'] == tile_name:
-                    color = (40, 40, 255)
-                    if mouse['clicked']:
-                        board.move(mouse['dragging'], tile_name)
-                        mouse['dragging'] = None
-                        mouse['moves'] = None
-
-            pygame.draw.rect(screen, color, [
-                             file * settings.SQUARE_SIZE, rank * settings.SQUARE_SIZE, settings.SQUARE_SIZE, settings.SQUARE_SIZE])
-
-            # render the tile name to the screen
-            text = font.render(tile_name, True, settings.FONT_COLOR_WHITE)
-            screen.blit(text, (file * settings.SQUARE_SIZE +
-                        10, rank * settings.SQUARE_SIZE + 10))
+            rect = square_rect(rank, file)
+            if color is None:
+                screen.blit(static_layer, rect, rect)
+            else:
+                pygame.draw.rect(screen, color, rect)
+                screen.blit(label_surfaces[index], (rect.x + 10, rect.y + 10))
 
-            if board.board[rank][file] is not None:
+            if tile_piece is not None:
 
-                piece = board.board[rank][file].fen_char()
+                piece = tile_piece.fen_char()
                 sprite = piece_sprites[piece]
 
-                centered_file = file * settings.SQUARE_SIZE + \
+                centered_file = rect.x + \
                     (settings.SQUARE_SIZE / 2) - \
                     (sprite.get_width() / 2)
 
-                centered_rank = rank * settings.SQUARE_SIZE + \
+                centered_rank = rect.y + \
                     (settings.SQUARE_SIZE / 2) - \
                     (sprite.get_height() / 2)
 
                 screen.blit(sprite, [centered_file, centered_rank])
 
-    # draw the fen string
-    army_dif = board.army_difference()
-    if army_dif >= 0:
-        army_dif = " : White +" + str(army_dif)
-    else:
-        army_dif = " : Black +" + str(-army_dif)
-    scoreboard = board.fen_encode() + army_dif
-    text = font.render(scoreboard, True, settings.FONT_COLOR_WHITE)
-    screen.blit(text, (8, 8 * settings.SQUARE_SIZE + 8))
-
+            dirty_rects.append(rect)
 
-def handle_events():
-    global done, mouse
+    # draw the fen string, only re-rendered when the position changes
+    if scoreboard_key != board.hash:
+        scoreboard_key = board.hash
+        army_dif = board.army_difference()
+        if army_dif >= 0:
+            army_dif = " : White +" + str(army_dif)
+        else:
+            army_dif = " : Black +" + str(-army_dif)
+        scoreboard = board.fen_encode() + army_dif
+        draw_strip_line(0, scoreboard)
+
+
+def draw_strip_line(line: int, text: str):
+    rect = pygame.Rect(0, STRIP_TOP + line * STRIP_LINE, settings.WIDTH,
+                       STRIP_LINE)
+    screen.fill('black', rect)
+    if text:
+        surface = font.render(text, True, settings.FONT_COLOR_WHITE)
+        screen.blit(surface, (8, rect.y + 6))
+    dirty_rects.append(rect)
+
+
+def draw_engine_info():
+    # the latest iteration of the engine's search, under the fen
+    global engine_text_key
+    if engine is None:
+        return
+    text = ""
+    if engine_info:
+        score = engine_info.get("score", 0)
+        if not isinstance(score, str):
+            score = "cp " + str(score)
+        text = ("pondering " if engine_ponder_move is not None else "") + \
+            "depth " + str(engine_info.get("depth", 0)) + "  " + score + \
+            "  pv " + " ".join(engine_info.get("pv", [])[:8])
+    if text != engine_text_key:
+        engine_text_key = text
+        draw_strip_line(1, text)
+
+
+def engine_to_move():
+    return engine is not None and board.turn == engine_color
+
+
+def engine_line(search_id: int, line: str):
+    # called on the engine's reader thread, the line is handed to the main
+    # loop as an event which also wakes it up
+    pygame.event.post(pygame.event.Event(ENGINE_EVENT, search=search_id,
+                                         line=line))
+
+
+def engine_search(ponder_move: str = None):
+    # think on the engine's move, or with ponder_move on the position after
+    # the reply the engine expects
+    global engine_search_id, engine_ponder_move, engine_info
+    engine_ponder_move = ponder_move
+    engine_info = None
+    # the moves since the last capture or pawn move are sent along so the
+    # engine knows which positions would repeat
+    fen, moves = board.recent_history()
+    moves = [move_to_uci(move) for move in moves]
+    if ponder_move:
+        moves.append(ponder_move)
+    engine_search_id = engine.go(fen, moves, settings.ENGINE_MOVETIME_MS,
+                                 ponder=ponder_move is not None)
+
+
+def engine_position_changed(played: str = None):
+    # after a move from the board or a take-back, played is the move made
+    global engine_search_id, engine_ponder_move, engine_info
+    if engine is None:
+        return
+    if engine_search_id is not None:
+        if played is not None and played == engine_ponder_move:
+            # the expected reply, the ponder search carries on for real
+            engine.ponder_hit()
+            engine_ponder_move = None
+            return
+        engine.stop()
+        engine_search_id = None
+        engine_ponder_move = None
+        engine_info = None
+    if engine_to_move():
+        engine_search()
+
+
+def handle_engine_line(search_id: int, line: str):
+    # returns True when the line changed something on screen
+    global engine_search_id, engine_info
+    if search_id != engine_search_id:
+        # left over from a search that was called off
+        return False
+
+    tokens = line.split()
+    if tokens[0] == "info":
+        info = parse_info(line)
+        if "depth" not in info:
+            return False
+        engine_info = info
+        return True
+    if tokens[0] != "bestmove" or engine_ponder_move is not None:
+        return False
+
+    engine_search_id = None
+    move = board.parse_move(tokens[1]) if tokens[1] != "0000" else None
+    if move is None:
+        return False
+    board.make_move(move)
+    if settings.ENGINE_PONDER and len(tokens) == 4 and tokens[2] == "ponder":
+        engine_search(tokens[3])
+    return True
+
+
+def handle_events(events):
+    # returns True when an event changed something on screen
+    global done, mouse, scoreboard_key, engine_text_key
     mouse['clicked'] = False
-    for event in pygame.event.get():
+    changed = False
+    for event in events:
         if event.type == pygame.QUIT:
             done = True
         if event.type == pygame.KEYDOWN:
             if event.key == pygame.K_ESCAPE:
                 done = True
+            if event.key == pygame.K_BACKSPACE and board.ply > 0:
+                # take back the last move, against the engine back to the
+                # last position with the player to move
+                board.unmake_move()
+                if engine_to_move() and board.ply > 0:
+                    board.unmake_move()
+                mouse['dragging'] = None
+                mouse['moves'] = None
+                mouse['targets'] = set()
+                engine_position_changed()
+                changed = True
         if event.type == pygame.MOUSEBUTTONDOWN:
             mouse['clicked'] = True
+            changed = True
+        if event.type == ENGINE_EVENT:
+            changed = handle_engine_line(event.search, event.line) or changed
+        if event.type in (pygame.WINDOWEXPOSED, pygame.VIDEOEXPOSE):
+            # the window contents were lost, paint everything again
+            square_state[:] = [None] * 64
+            scoreboard_key = None
+            engine_text_key = None
+            screen.fill('black')
+            dirty_rects.append(screen.get_rect())
+            changed = True
+    return changed
 
 
 def draw_screen():
-    screen.fill('black')
-    # draw the screen
+    # draw the screen, pushing only what changed
     draw_board()
+    draw_engine_info()
 
-    pygame.display.flip()
+    if dirty_rects:
+        pygame.display.update(dirty_rects)
+        dirty_rects.clear()
 
 
 def get_mouse_tile():
@@ -766,23 +317,65 @@ def get_mouse_tile():
 
 
 def handle_input():
-    mouse['tile'] = get_mouse_tile()
+    # returns True when the mouse moved onto another tile
+    tile = get_mouse_tile()
+    if tile == mouse['tile']:
+        return False
+    mouse['tile'] = tile
+    return True
 
 
-def main():
+def next_events():
+    # block until something happens unless the polling loop was asked for
+    # in settings
+    if settings.EVENT_DRIVEN:
+        return [pygame.event.wait()] + pygame.event.get()
+    return pygame.event.get()
+
 
+def main():
+    draw_screen()
     while not done:
-        handle_events()
-        handle_input()
-        draw_screen()
-        clock.tick(settings.FPS)
+        changed = handle_events(next_events())
+        changed = handle_input() or changed
+        # a click changes the game before anything is drawn, so the squares
+        # are diffed against the position they will show
+        handle_clicks()
+        if changed or not settings.EVENT_DRIVEN:
+            draw_screen()
+        if not settings.EVENT_DRIVEN:
+            clock.tick(settings.FPS)
 
 
 if __name__ == "__main__":
 
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Play chess in a window.")
+    parser.add_argument("--engine", choices=("white", "black"),
+                        default=settings.ENGINE_PLAYS,
+                        help="side the engine plays (default: nobody)")
+    parser.add_argument("--movetime", type=int,
+                        default=settings.ENGINE_MOVETIME_MS,
+                        help="engine thinking time per move in ms")
+    parser.add_argument("--record", default=settings.GAME_RECORD,
+                        help="pgn file to append the game to on exit")
+    stats.add_profile_argument(parser)
+    args = parser.parse_args()
+    settings.ENGINE_MOVETIME_MS = args.movetime
+
+    import pygame
+
     pygame.init()
     screen = pygame.display.set_mode((settings.WIDTH, settings.HEIGHT))
     pygame.display.set_caption("bad-chess")
+    # only events that can change the picture wake the event-driven loop
+    pygame.event.set_blocked(None)
+    ENGINE_EVENT = pygame.USEREVENT
+    pygame.event.set_allowed([pygame.QUIT, pygame.KEYDOWN,
+                              pygame.MOUSEBUTTONDOWN, pygame.MOUSEMOTION,
+                              pygame.WINDOWEXPOSED, pygame.VIDEOEXPOSE,
+                              ENGINE_EVENT])
     font = pygame.font.SysFont(None, settings.FONT_SIZE_NORMAL)
     clock = pygame.time.Clock()
 
@@ -805,16 +398,19 @@ if __name__ == "__main__":
         "tile": None,
         "clicked": None,
         "dragging": None,
-        "moves": None
+        "moves": None,
+        "targets": set()
     }
 
-    board = Board()
-    board.move('e2', 'e4')
-    print(board.fen_encode())
-    board.move('e7', 'e5')
-    print(board.fen_encode())
+    build_static_layer()
+    # what each square showed when last drawn, None forces a redraw
+    square_state = [None] * 64
+    scoreboard_key = None
+    dirty_rects = []
+    screen.fill('black')
+    pygame.display.flip()
 
-    # print(board.fen_encode())
+    board = Board()
 
     # board.fen_decode("r1b1k1nr/p2p1pNp/n2B4/1p1NP2P/6P1/3P1Q2/P1P1K3/q5b1 w")
     # board.fen_decode("8/8/8/4p1K1/2k1P3/8/8/8 b")
@@ -822,6 +418,52 @@ if __name__ == "__main__":
     # board.fen_decode(
     #     "qQqQqQqQ/QqQqQqQq/qQqQqQqQ/QqQqQqQq/qQqQqQqQ/QqQqQqQq/qQqQqQqQ/QqQqQqQq w")
 
+    # the record starts from whatever position the game was set up in
+    starting_fen = board.fen_encode()
+
+    # the engine searches in its own process and never blocks the window
+    engine = None
+    engine_color = None
+    engine_search_id = None
+    engine_ponder_move = None
+    engine_info = None
+    engine_text_key = None
+    if args.engine is not None:
+        engine_color = PieceColor.WHITE if args.engine == "white" \
+            else PieceColor.BLACK
+        engine = EngineProcess(on_line=engine_line)
+        engine.start()
+        if settings.ENGINE_BOOK:
+            engine.send("setoption name Book File value " +
+                        settings.ENGINE_BOOK)
+        engine_position_changed()
+
     done = False
 
-    main()
+    # the drawing is timed along with the board while profiling
+    stats.watch(sys.modules[__name__], "draw_board")
+    stats.watch(sys.modules[__name__], "draw_screen")
+    with stats.profiling(args.profile):
+        main()
+
+    if engine is not None:
+        engine.close()
+
+    if args.record and board.ply:
+        import time
+
+        import pgn
+
+        engine_name = "bad-chess"
+        headers = {
+            "Event": "bad-chess game",
+            "Site": "bad-chess",
+            "Date": time.strftime("%Y.%m.%d"),
+            "White": engine_name if engine_color == PieceColor.WHITE
+            else "Player",
+            "Black": engine_name if engine_color == PieceColor.BLACK
+            else "Player",
+        }
+        with open(args.record, "a") as record:
+            pgn.write_game(record, pgn.game_from_board(board, starting_fen,
+                                                       headers))
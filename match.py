@@ -0,0 +1,573 @@
+# Bad Chess
+# Copyright (C) Jared De Blander 2022
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+
+# engine against engine matches, to tell whether a change is an improvement
+#
+# two uci engines, by default this tree's uci.py for both, play each
+# opening of a suite twice with colours swapped. games run side by side in
+# a pool of worker processes, every worker keeps its own pair of engine
+# processes for all the games it plays, and a Board referees every move:
+# illegal moves, time forfeits, mate, stalemate, repetition, the fifty move
+# rule and bare material all end the game here, not in the engines. long
+# games are cut short once both engines agree on a clear result.
+#
+# every result is folded into a running Elo estimate and, with --sprt, a
+# sequential probability ratio test that stops the match as soon as one of
+# its two hypotheses is accepted.
+#
+#   python match.py --engine-b "python ../old/uci.py" --games 400 --tc 10+0.1
+#   python match.py --movetime 100 --sprt --elo0 0 --elo1 10 --pgn out.pgn
+#
+# --openings takes a file of fens or epd lines, one per line, or a pgn file
+# whose games are played out to their last position.
+
+import math
+import multiprocessing
+import os
+import platform
+import queue
+import shlex
+import subprocess
+import sys
+import threading
+import time
+
+import pgn
+import stats
+from board import Board, PieceColor
+from engine_process import parse_info
+from moves import move_to_uci
+
+# a small built-in suite of balanced positions a few moves into the game
+DEFAULT_OPENINGS = (
+    "rnbqkbnr/pp1ppppp/8/2p5/4P3/8/PPPP1PPP/RNBQKBNR w KQkq - 0 2",
+    "rnbqkbnr/pppp1ppp/4p3/8/4P3/8/PPPP1PPP/RNBQKBNR w KQkq - 0 2",
+    "rnbqkbnr/pp1ppppp/2p5/8/4P3/8/PPPP1PPP/RNBQKBNR w KQkq - 0 2",
+    "r1bqkbnr/pppp1ppp/2n5/4p3/4P3/5N2/PPPP1PPP/RNBQKB1R w KQkq - 2 3",
+    "rnbqkb1r/pppppppp/5n2/8/3P4/8/PPP1PPPP/RNBQKBNR w KQkq - 1 2",
+    "rnbqkbnr/ppp1pppp/8/3p4/3P4/8/PPP1PPPP/RNBQKBNR w KQkq - 0 2",
+    "rnbqkbnr/pppppppp/8/8/2P5/8/PP1PPPPP/RNBQKBNR b KQkq - 0 1",
+    "rnbqkbnr/pppppppp/8/8/8/5N2/PPPPPPPP/RNBQKB1R b KQkq - 1 1",
+)
+
+UCI_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          "uci.py")
+
+# how long an engine gets to answer uci and isready
+HANDSHAKE_SECONDS = 30.0
+# extra time past its clock before an engine loses on time
+DEFAULT_MARGIN_MS = 100
+# engine scores for a forced mate, in centipawns
+MATE_CP = 100000
+
+RESULT_SCORES = {"1-0": 1.0, "0-1": 0.0, "1/2-1/2": 0.5}
+
+
+class EngineError(Exception):
+    pass
+
+
+class UciPlayer:
+    # an engine process spoken to over uci, its output is read on a thread
+    # so every wait can have a deadline
+    def __init__(self, command, options=()):
+        self.command = command
+        self.lines = queue.Queue()
+        self.name = os.path.basename(command[-1]) if command else "?"
+        try:
+            self.process = subprocess.Popen(
+                command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL, text=True, bufsize=1)
+        except (OSError, ValueError) as error:
+            raise EngineError("cannot start " + " ".join(command) + ": " +
+                              str(error))
+        self.reader = threading.Thread(target=self._read, daemon=True)
+        self.reader.start()
+
+        try:
+            self.send("uci")
+            for line in self._until("uciok",
+                                    time.monotonic() + HANDSHAKE_SECONDS):
+                if line.startswith("id name "):
+                    self.name = line[8:].strip()
+            for option in options:
+                name, _, value = option.partition("=")
+                self.send("setoption name " + name.strip() + " value " +
+                          value.strip())
+            self.ready()
+        except EngineError:
+            self.process.kill()
+            self.process.wait()
+            raise
+
+    def _read(self):
+        for line in self.process.stdout:
+            self.lines.put(line.strip())
+        self.lines.put(None)
+
+    def send(self, line: str):
+        try:
+            self.process.stdin.write(line + "\n")
+            self.process.stdin.flush()
+        except OSError as error:
+            raise EngineError(self.name + " is gone: " + str(error))
+
+    def _until(self, prefix: str, deadline: float):
+        # lines up to and including the first starting with prefix
+        while True:
+            try:
+                line = self.lines.get(timeout=max(0.0, deadline -
+                                                  time.monotonic()))
+            except queue.Empty:
+                raise EngineError(self.name + " did not answer in time")
+            if line is None:
+                raise EngineError(self.name + " exited")
+            yield line
+            if line.startswith(prefix):
+                return
+
+    def ready(self):
+        self.send("isready")
+        for line in self._until("readyok",
+                                time.monotonic() + HANDSHAKE_SECONDS):
+            pass
+
+    def new_game(self):
+        self.send("ucinewgame")
+        self.ready()
+
+    def go(self, position: str, limits: str, timeout: float):
+        # (move in uci, last reported score in centipawns or None)
+        self.send(position)
+        self.send("go " + limits)
+        score = None
+        for line in self._until("bestmove", time.monotonic() + timeout):
+            if line.startswith("info ") and " score " in line:
+                reported = parse_info(line).get("score")
+                if isinstance(reported, int):
+                    score = reported
+                elif reported is not None:
+                    moves = int(reported.split()[1])
+                    score = MATE_CP - moves if moves > 0 else -MATE_CP - moves
+        tokens = line.split()
+        return (tokens[1] if len(tokens) > 1 else "0000"), score
+
+    def close(self):
+        try:
+            self.send("quit")
+            self.process.wait(1.0)
+        except (EngineError, subprocess.TimeoutExpired):
+            self.process.kill()
+            self.process.wait()
+
+
+def parse_time_control(text: str):
+    # "40+0.4" is 40 seconds with 0.4 seconds added per move, in ms
+    base, _, increment = text.partition("+")
+    return int(float(base) * 1000), int(float(increment or 0) * 1000)
+
+
+def load_openings(path: str = None):
+    # fens of the opening suite, a pgn game counts as its final position
+    if path is None:
+        return list(DEFAULT_OPENINGS)
+    if path.endswith((".pgn", ".pgn.gz", ".pgn.bz2", ".pgn.xz")):
+        fens = []
+        board = Board()
+        for game in pgn.read_games(path):
+            try:
+                for move in game.replay(board):
+                    pass
+            except pgn.PgnError:
+                continue
+            fens.append(board.fen_encode())
+        return fens
+    fens = []
+    with open(path) as suite:
+        for line in suite:
+            fields = line.split(";")[0].split()
+            if len(fields) >= 4:
+                # an epd line has no move counters
+                fens.append(" ".join(fields[:6] if len(fields) >= 6 and
+                                     fields[4].isdigit() else
+                                     fields[:4] + ["0", "1"]))
+    return fens
+
+
+def check_engines(commands, options):
+    # start and stop every engine once, EngineError if one does not work.
+    # an engine that fails inside a worker would otherwise only show as a
+    # match that never gets going.
+    for command, option in zip(commands, options):
+        UciPlayer(command, option).close()
+
+
+# what the engines of this worker process are started with, set by
+# _worker_start, and the engines themselves once the first game needs them
+_engines = None
+_players = None
+
+
+def _worker_start(commands, options):
+    # nothing here may fail, an exception in a pool initializer only gets
+    # the worker started again, and again
+    global _engines
+    _engines = list(zip(commands, options))
+    # run when the pool shuts the worker down
+    multiprocessing.util.Finalize(None, _worker_stop, exitpriority=10)
+
+
+def _worker_players():
+    # the engines for the next game, one that exited during the last game
+    # is started again. EngineError goes back to run_match with the game.
+    global _players
+    if _players is None:
+        _players = [None] * len(_engines)
+    for index, (command, options) in enumerate(_engines):
+        player = _players[index]
+        if player is None or player.process.poll() is not None:
+            _players[index] = UciPlayer(command, options)
+    return _players
+
+
+def _worker_stop():
+    global _players
+    if _players is not None:
+        for player in _players:
+            if player is not None:
+                player.close()
+        _players = None
+
+
+def _adjudicate(scores, ply: int, config):
+    # a result both engines agree on, from white's view of the last scores
+    plies = config["adjudicate_moves"] * 2
+    if plies <= 0 or len(scores) < plies:
+        return None
+    recent = scores[-plies:]
+    if None in recent:
+        return None
+    resign = config["resign_cp"]
+    if resign:
+        if all(score >= resign for score in recent):
+            return "1-0"
+        if all(score <= -resign for score in recent):
+            return "0-1"
+    draw = config["draw_cp"]
+    if draw is not None and ply >= config["draw_ply"] and \
+            all(abs(score) <= draw for score in recent):
+        return "1/2-1/2"
+    return None
+
+
+def play_game(task):
+    # one game on this worker's engines, returns its result and pgn text
+    number, fen, a_is_white, config = task
+    engine_a, engine_b = _worker_players()
+    white, black = (engine_a, engine_b) if a_is_white else \
+        (engine_b, engine_a)
+    for player in (white, black):
+        player.new_game()
+
+    board = Board(fen)
+    start_fen = board.fen_encode()
+    played = []
+    scores = []
+    clocks = {PieceColor.WHITE: config["base_ms"],
+              PieceColor.BLACK: config["base_ms"]}
+    increment = config["increment_ms"]
+    result = termination = None
+    while result is None:
+        if not board.generate_legal_moves().count:
+            if board.in_check():
+                result = "0-1" if board.turn == PieceColor.WHITE else "1-0"
+                termination = "checkmate"
+            else:
+                result, termination = "1/2-1/2", "stalemate"
+            break
+        if board.is_repetition(2):
+            result, termination = "1/2-1/2", "threefold repetition"
+            break
+        if board.is_fifty_moves():
+            result, termination = "1/2-1/2", "fifty move rule"
+            break
+        if board.is_insufficient_material():
+            result, termination = "1/2-1/2", "insufficient material"
+            break
+        if len(played) >= config["max_plies"]:
+            result, termination = "1/2-1/2", "adjudication: move limit"
+            break
+
+        mover = board.turn
+        player = white if mover == PieceColor.WHITE else black
+        lost = "0-1" if mover == PieceColor.WHITE else "1-0"
+        position = "position fen " + start_fen
+        if played:
+            position += " moves " + " ".join(played)
+        if config["movetime_ms"] is not None:
+            limits = "movetime " + str(config["movetime_ms"])
+            allowed_ms = config["movetime_ms"] + config["margin_ms"]
+        else:
+            limits = ("wtime " + str(clocks[PieceColor.WHITE]) +
+                      " btime " + str(clocks[PieceColor.BLACK]) +
+                      " winc " + str(increment) + " binc " + str(increment))
+            allowed_ms = clocks[mover] + config["margin_ms"]
+
+        start = time.monotonic()
+        try:
+            uci, score = player.go(position, limits,
+                                   allowed_ms / 1000 + HANDSHAKE_SECONDS)
+        except EngineError as error:
+            result, termination = lost, "abandoned: " + str(error)
+            break
+        used_ms = int((time.monotonic() - start) * 1000)
+        if used_ms > allowed_ms:
+            result, termination = lost, "time forfeit"
+            break
+        if config["movetime_ms"] is None:
+            clocks[mover] += increment - used_ms
+
+        move = board.parse_move(uci)
+        if move is None or move_to_uci(move) != uci and \
+                move_to_uci(move) != uci + "q":
+            result, termination = lost, "illegal move " + uci
+            break
+        board.make_move(move)
+        played.append(uci)
+        if score is not None and mover == PieceColor.BLACK:
+            score = -score
+        scores.append(score)
+        result = _adjudicate(scores, len(played), config)
+        if result is not None:
+            termination = "adjudication"
+
+    headers = {
+        "Event": config["event"],
+        "Site": platform.node() or "?",
+        "Date": time.strftime("%Y.%m.%d"),
+        "Round": str(number + 1),
+        "White": white.name,
+        "Black": black.name,
+        "Result": result,
+        "Termination": termination,
+    }
+    game = pgn.game_from_board(board, start_fen, headers)
+    return number, a_is_white, result, termination, len(played), \
+        pgn.format_game(game)
+
+
+def elo_from_score(score: float):
+    score = min(max(score, 1e-6), 1 - 1e-6)
+    return -400 * math.log10(1 / score - 1)
+
+
+def elo_estimate(wins: int, losses: int, draws: int):
+    # Elo difference and its 95% error margin from a + w - l = d record
+    games = wins + losses + draws
+    if not games:
+        return 0.0, 0.0
+    score = (wins + draws / 2) / games
+    variance = (wins * (1 - score) ** 2 + draws * (0.5 - score) ** 2 +
+                losses * score ** 2) / games
+    margin = 1.96 * math.sqrt(variance / games)
+    elo = elo_from_score(score)
+    high = elo_from_score(score + margin)
+    low = elo_from_score(score - margin)
+    return elo, (high - low) / 2
+
+
+def sprt_bounds(alpha: float, beta: float):
+    return math.log(beta / (1 - alpha)), math.log((1 - beta) / alpha)
+
+
+def sprt_llr(wins: int, losses: int, draws: int, elo0: float, elo1: float):
+    # log likelihood ratio of elo1 against elo0, the game results taken as
+    # normally distributed around their mean score
+    games = wins + losses + draws
+    if not wins + draws or not losses + draws:
+        return 0.0
+    score = (wins + draws / 2) / games
+    variance = (wins * (1 - score) ** 2 + draws * (0.5 - score) ** 2 +
+                losses * score ** 2) / games
+    if variance <= 0:
+        return 0.0
+    score0 = 1 / (1 + 10 ** (-elo0 / 400))
+    score1 = 1 / (1 + 10 ** (-elo1 / 400))
+    return games * (score1 - score0) * (2 * score - score0 - score1) / \
+        (2 * variance)
+
+
+def run_match(config, commands, options, openings, games: int,
+              concurrency: int, pgn_path: str = None, sprt=None,
+              report=print):
+    # plays the match and returns (wins, losses, draws) of engine a. sprt
+    # is (elo0, elo1, alpha, beta) or None.
+    tasks = []
+    for number in range(games):
+        # each opening twice in a row, engine a white first
+        fen = openings[(number // 2) % len(openings)]
+        tasks.append((number, fen, number % 2 == 0, config))
+
+    bounds = sprt_bounds(sprt[2], sprt[3]) if sprt else None
+    wins = losses = draws = 0
+    terminations = {}
+    record = open(pgn_path, "a") if pgn_path else None
+    context = multiprocessing.get_context("spawn")
+    pool = context.Pool(concurrency, initializer=_worker_start,
+                        initargs=(commands, options))
+    start = time.perf_counter()
+    try:
+        for finished, outcome in enumerate(
+                pool.imap_unordered(play_game, tasks), 1):
+            number, a_is_white, result, termination, plies, text = outcome
+            score = RESULT_SCORES[result]
+            if not a_is_white:
+                score = 1 - score
+            if score == 1:
+                wins += 1
+            elif score == 0:
+                losses += 1
+            else:
+                draws += 1
+            reason = termination.split(":")[0]
+            terminations[reason] = terminations.get(reason, 0) + 1
+            if record is not None:
+                record.write(text)
+                record.flush()
+
+            elapsed = time.perf_counter() - start
+            elo, margin = elo_estimate(wins, losses, draws)
+            line = ("game " + str(finished) + "/" + str(games) + " " +
+                    result + " " + termination + ", " + str(plies) +
+                    " plies | +" + str(wins) + " -" + str(losses) + " =" +
+                    str(draws) + " | elo " + format(elo, "+.1f") + " +/- " +
+                    format(margin, ".1f") + " | " +
+                    format(finished / elapsed * 3600, ".0f") + " games/h")
+            verdict = None
+            if sprt:
+                llr = sprt_llr(wins, losses, draws, sprt[0], sprt[1])
+                line += " | llr " + format(llr, ".2f") + " [" + \
+                    format(bounds[0], ".2f") + ", " + \
+                    format(bounds[1], ".2f") + "]"
+                if llr >= bounds[1]:
+                    verdict = "H1 accepted: elo >= " + str(sprt[1])
+                elif llr <= bounds[0]:
+                    verdict = "H0 accepted: elo <= " + str(sprt[0])
+            report(line)
+            if verdict is not None:
+                report("sprt " + verdict)
+                break
+    finally:
+        if record is not None:
+            record.close()
+        pool.terminate()
+        pool.join()
+
+    report("terminations " + ", ".join(
+        name + " " + str(count)
+        for name, count in sorted(terminations.items())))
+    return wins, losses, draws
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Play two uci engines against each other.")
+    default_engine = shlex.join([sys.executable, UCI_SCRIPT])
+    parser.add_argument("--engine-a", default=default_engine,
+                        help="command of the engine under test "
+                             "(default: this tree's uci.py)")
+    parser.add_argument("--engine-b", default=default_engine,
+                        help="command of the reference engine "
+                             "(default: this tree's uci.py)")
+    parser.add_argument("--option-a", action="append", default=[],
+                        metavar="NAME=VALUE", help="uci option for engine a")
+    parser.add_argument("--option-b", action="append", default=[],
+                        metavar="NAME=VALUE", help="uci option for engine b")
+    parser.add_argument("--games", type=int, default=100,
+                        help="games to play, each opening is played twice")
+    parser.add_argument("--concurrency", type=int,
+                        help="games at once (default: one per core)")
+    parser.add_argument("--openings",
+                        help="fen, epd or pgn file (default: built-in suite)")
+    parser.add_argument("--tc", default="10+0.1",
+                        help="seconds per game + increment (default: 10+0.1)")
+    parser.add_argument("--movetime", type=int,
+                        help="fixed ms per move instead of a clock")
+    parser.add_argument("--margin", type=int, default=DEFAULT_MARGIN_MS,
+                        help="ms past its time before an engine forfeits")
+    parser.add_argument("--pgn", help="pgn file the games are appended to")
+    parser.add_argument("--max-plies", type=int, default=400,
+                        help="plies before a game is drawn by adjudication")
+    parser.add_argument("--adjudicate-moves", type=int, default=4,
+                        help="moves in a row both engines must agree for a "
+                             "resign or draw adjudication, 0 turns it off")
+    parser.add_argument("--resign", type=int, default=800,
+                        help="centipawns at which the game is resigned")
+    parser.add_argument("--draw", type=int, default=10,
+                        help="centipawns within which the game is drawn")
+    parser.add_argument("--draw-ply", type=int, default=80,
+                        help="ply before which no draw is adjudicated")
+    parser.add_argument("--sprt", action="store_true",
+                        help="stop once the sprt accepts a hypothesis")
+    parser.add_argument("--elo0", type=float, default=0.0)
+    parser.add_argument("--elo1", type=float, default=10.0)
+    parser.add_argument("--alpha", type=float, default=0.05)
+    parser.add_argument("--beta", type=float, default=0.05)
+    stats.add_profile_argument(parser)
+    args = parser.parse_args()
+
+    base_ms, increment_ms = parse_time_control(args.tc)
+    config = {
+        "event": "bad-chess match",
+        "base_ms": base_ms,
+        "increment_ms": increment_ms,
+        "movetime_ms": args.movetime,
+        "margin_ms": args.margin,
+        "max_plies": args.max_plies,
+        "adjudicate_moves": args.adjudicate_moves,
+        "resign_cp": args.resign,
+        "draw_cp": args.draw,
+        "draw_ply": args.draw_ply,
+    }
+    commands = [shlex.split(args.engine_a), shlex.split(args.engine_b)]
+    options = [args.option_a, args.option_b]
+    openings = load_openings(args.openings)
+    if not openings:
+        parser.error("no positions in " + args.openings)
+    concurrency = args.concurrency or os.cpu_count() or 1
+    sprt = (args.elo0, args.elo1, args.alpha, args.beta) if args.sprt \
+        else None
+
+    start = time.perf_counter()
+    try:
+        with stats.profiling(args.profile):
+            check_engines(commands, options)
+            wins, losses, draws = run_match(config, commands, options,
+                                            openings, args.games,
+                                            concurrency, args.pgn, sprt)
+    except EngineError as error:
+        print("match stopped: " + str(error), file=sys.stderr)
+        return 1
+    elapsed = time.perf_counter() - start
+    games = wins + losses + draws
+    elo, margin = elo_estimate(wins, losses, draws)
+    print("score of a against b: +" + str(wins) + " -" + str(losses) +
+          " =" + str(draws) + " in " + str(games) + " games")
+    print("elo difference " + format(elo, "+.1f") + " +/- " +
+          format(margin, ".1f"))
+    print(format(elapsed, ".1f") + " s with " + str(concurrency) +
+          " games at once, " + format(games / elapsed * 3600, ".0f") +
+          " games/h")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,114 @@
+# Bad Chess
+# Copyright (C) Jared De Blander 2022
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+
+# moves are packed into 16 bit integers
+#
+#   bits  0-5   from square (a1 = 0 ... h8 = 63)
+#   bits  6-11  to square
+#   bits 12-15  flags
+#
+# the capture flag bit and the promotion flag bit can be tested directly,
+# the low two flag bits of a promotion select the promoted piece.
+
+from array import array
+
+import bitboard
+
+QUIET = 0
+DOUBLE_PAWN_PUSH = 1
+KING_CASTLE = 2
+QUEEN_CASTLE = 3
+CAPTURE = 4
+EN_PASSANT = 5
+PROMOTION = 8
+PROMOTE_KNIGHT = 8
+PROMOTE_BISHOP = 9
+PROMOTE_ROOK = 10
+PROMOTE_QUEEN = 11
+PROMOTE_KNIGHT_CAPTURE = 12
+PROMOTE_BISHOP_CAPTURE = 13
+PROMOTE_ROOK_CAPTURE = 14
+PROMOTE_QUEEN_CAPTURE = 15
+
+NULL_MOVE = 0
+
+# no legal chess position has more than 218 moves
+MAX_MOVES = 256
+
+# promotion piece letters indexed by the low two flag bits
+PROMOTION_CHARS = "nbrq"
+
+
+def encode_move(start: int, end: int, flags: int = QUIET):
+    return start | end << 6 | flags << 12
+
+
+def move_from(move: int):
+    return move & 63
+
+
+def move_to(move: int):
+    return move >> 6 & 63
+
+
+def move_flags(move: int):
+    return move >> 12
+
+
+def is_capture(move: int):
+    return move & 0x4000 != 0
+
+
+def is_promotion(move: int):
+    return move & 0x8000 != 0
+
+
+def move_to_uci(move: int):
+    uci = bitboard.SQUARE_NAMES[move & 63] + bitboard.SQUARE_NAMES[move >> 6 & 63]
+    if move & 0x8000:
+        uci += PROMOTION_CHARS[move >> 12 & 3]
+    return uci
+
+
+# a fixed size buffer of packed moves, search keeps one per ply and reuses it
+# so generating moves at a node allocates nothing
+
+
+class MoveList:
+    __slots__ = ("moves", "count")
+
+    def __init__(self):
+        self.moves = array("H", bytes(2 * MAX_MOVES))
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index: int):
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError("move index out of range")
+        return self.moves[index]
+
+    def __iter__(self):
+        return iter(self.moves[:self.count])
+
+    def __contains__(self, move: int):
+        return move in self.moves[:self.count]
+
+    def clear(self):
+        self.count = 0
+
+    def append(self, move: int):
+        self.moves[self.count] = move
+        self.count += 1
+
+    def to_uci(self):
+        return [move_to_uci(move) for move in self.moves[:self.count]]
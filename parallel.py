@@ -0,0 +1,364 @@
+# Bad Chess
+# Copyright (C) Jared De Blander 2022
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+
+# lazy smp, several processes searching the same root position
+#
+# every worker runs the ordinary iterative deepening search. they only
+# cooperate through one transposition table kept in shared memory, a
+# result one worker stores cuts short the same subtree for all the others.
+# helpers skip some depths and try the root moves in a different order so
+# they spread out over the tree instead of racing each other down the same
+# lines. worker 0 is the main worker, once it finishes, or the deadline
+# passes, everybody is stopped and the deepest result wins.
+#
+# the workers are started once and kept for every following search.
+#
+#   python parallel.py --workers 4 --movetime 5000
+#   python parallel.py --bench --movetime 3000 --max-workers 8
+
+import multiprocessing
+import os
+import time
+from multiprocessing import shared_memory
+from multiprocessing.connection import wait
+
+import log
+import stats
+from board import FEN_NEW_GAME, Board
+from moves import move_to_uci
+from search import DEFAULT_DEPTH, MAX_DEPTH, Searcher, SearchResult
+from transposition import TranspositionTable, table_bytes
+
+# how often the coordinator looks at the clock while waiting on workers
+POLL_INTERVAL = 0.005
+
+# depth skipping pattern for helpers, helper i leaves out depth d when
+# (d + SKIP_PHASE[i]) // SKIP_SIZE[i] is odd
+SKIP_SIZE = (1, 1, 2, 2, 2, 2, 3, 3, 3, 3, 3, 3, 4, 4, 4, 4, 4, 4, 4, 4)
+SKIP_PHASE = (0, 1, 0, 1, 2, 3, 0, 1, 2, 3, 4, 5, 0, 1, 2, 3, 4, 5, 6, 7)
+
+search_log = log.get_logger("search")
+
+
+class HelperSearcher(Searcher):
+    def __init__(self, board, tt, index: int, stop_flag, node_counts):
+        super().__init__(board, tt)
+        self.index = index
+        self.stop_flag = stop_flag
+        self.node_counts = node_counts
+
+    def _skip_iteration(self, iteration: int):
+        if self.index == 0:
+            return False
+        slot = (self.index - 1) % len(SKIP_SIZE)
+        return (iteration + SKIP_PHASE[slot]) // SKIP_SIZE[slot] % 2 == 1
+
+    def _order_root(self, buffer, count: int, tt_move: int):
+        # rotate everything behind the table move by the worker index
+        first = 1 if tt_move and buffer[0] == tt_move else 0
+        length = count - first
+        if self.index == 0 or length < 2:
+            return
+        shift = self.index % length
+        rest = buffer[first:count]
+        buffer[first:count] = rest[shift:] + rest[:shift]
+
+    def _check_limits(self):
+        self.node_counts[self.index] = self.nodes
+        if self.stop_flag.value:
+            self.stopped = True
+        else:
+            super()._check_limits()
+
+
+def worker_main(index, shm_name, size_mb, tasks, results, stop_flag,
+                node_counts, tablebase_path):
+    shm = shared_memory.SharedMemory(name=shm_name)
+    tt = TranspositionTable(size_mb, shm.buf)
+    board = Board()
+    searcher = HelperSearcher(board, tt, index, stop_flag, node_counts)
+    if tablebase_path:
+        from tablebase import Tablebases
+
+        searcher.tablebases = Tablebases(tablebase_path)
+
+    def on_iteration(result):
+        node_counts[index] = result.nodes
+        results.send(("info", result.best_move, result.score, result.pv,
+                      result.depth, result.nodes))
+
+    for task in iter(tasks.get, None):
+        fen, moves, depth, movetime_ms, nodes, infinite, generation = task
+        board.fen_decode(fen)
+        # replayed rather than sent as one fen so repetitions are seen
+        for move in moves:
+            board.make_move(move)
+        # search() moves the generation on by one itself
+        tt.generation = (generation - 1) & 0xFF
+        result = searcher.search(depth, movetime_ms, nodes, infinite,
+                                 on_iteration if index == 0 else None)
+        node_counts[index] = result.nodes
+        results.send(("done", result.best_move, result.score, result.pv,
+                      result.depth, result.nodes))
+
+    tt.close()
+    shm.close()
+
+
+class ParallelSearcher:
+    # drop-in for Searcher that spreads each search over worker processes
+    def __init__(self, board, workers: int = None, size_mb: int = 16,
+                 tablebase_path: str = None):
+        self.board = board
+        self.workers = workers or os.cpu_count() or 1
+        self.size_mb = size_mb
+        self.deadline = None
+        # see Searcher.ponder_deadline
+        self.ponder_deadline = None
+
+        self.shm = shared_memory.SharedMemory(create=True,
+                                              size=table_bytes(size_mb))
+        self.tt = TranspositionTable(size_mb, self.shm.buf)
+        self.tt.clear()
+
+        # spawn keeps the children free of whatever the parent has loaded.
+        # nothing the workers share takes a lock, the stop flag and node
+        # counts are plain shared memory and every worker answers on a pipe
+        # of its own, so a worker killed at any moment cannot leave the
+        # others waiting on a lock it held.
+        context = multiprocessing.get_context("spawn")
+        self.stop_flag = context.RawValue("B", 0)
+        self.node_counts = context.RawArray("Q", self.workers)
+        self.tasks = [context.Queue() for index in range(self.workers)]
+        self.results = []
+        self.processes = []
+        # workers that died, they are left out of every later search
+        self.dead = set()
+        for index in range(self.workers):
+            reader, writer = context.Pipe(duplex=False)
+            process = context.Process(
+                target=worker_main,
+                args=(index, self.shm.name, size_mb, self.tasks[index],
+                      writer, self.stop_flag, self.node_counts,
+                      tablebase_path),
+                daemon=True)
+            process.start()
+            # with only the worker holding the other end, its death reads
+            # as the end of the pipe
+            writer.close()
+            self.results.append(reader)
+            self.processes.append(process)
+
+    def stop(self):
+        self.stop_flag.value = 1
+
+    def search(self, depth: int = None, movetime_ms: int = None,
+               nodes: int = None, infinite: bool = False,
+               on_iteration=None):
+        # same limits as Searcher.search, a node budget is split evenly
+        # between the workers
+        if len(self.dead) == self.workers:
+            raise RuntimeError("every search worker has died")
+        if depth is None and movetime_ms is None and nodes is None and \
+                not infinite:
+            depth = DEFAULT_DEPTH
+        if depth is not None:
+            depth = min(depth, MAX_DEPTH)
+        if nodes is not None:
+            nodes = max(1, nodes // self.workers)
+
+        start = time.perf_counter()
+        self.deadline = None
+        if movetime_ms is not None:
+            self.deadline = start + movetime_ms / 1000
+        if self.ponder_deadline is not None:
+            self.deadline = self.ponder_deadline
+        self.stop_flag.value = 0
+        for index in range(self.workers):
+            self.node_counts[index] = 0
+        self.tt.new_search()
+
+        fen, moves = self.board.recent_history()
+        task = (fen, moves, depth, movetime_ms, nodes, infinite,
+                self.tt.generation)
+        finished = {}
+        waiting = {}
+        for index in range(self.workers):
+            if index in self.dead:
+                finished[index] = SearchResult(0, 0, [], 0, 0, 0.0)
+            else:
+                self.tasks[index].put(task)
+                waiting[self.results[index]] = index
+
+        while waiting:
+            ready = wait(list(waiting), POLL_INTERVAL)
+            # the deadline may be moved by another thread, e.g. a ponderhit
+            if self.deadline is not None and \
+                    time.perf_counter() >= self.deadline:
+                self.stop_flag.value = 1
+            if not ready:
+                # a worker killed before its pipe was set up, or one whose
+                # end has not been closed yet, is caught here instead
+                for reader, index in list(waiting.items()):
+                    if not self.processes[index].is_alive():
+                        self._worker_died(index, finished)
+                        del waiting[reader]
+                continue
+
+            for reader in ready:
+                index = waiting[reader]
+                try:
+                    message = reader.recv()
+                except (EOFError, OSError):
+                    self._worker_died(index, finished)
+                    del waiting[reader]
+                    continue
+                kind, best_move, score, pv, reached, nodes = message
+                if kind == "info":
+                    if on_iteration is not None:
+                        # this worker's count is exact, the others are as
+                        # of their last check
+                        nodes += sum(self.node_counts) - \
+                            self.node_counts[index]
+                        on_iteration(SearchResult(
+                            best_move, score, pv, reached, nodes,
+                            time.perf_counter() - start))
+                    continue
+                finished[index] = SearchResult(best_move, score, pv, reached,
+                                               nodes, 0.0)
+                del waiting[reader]
+                if index == 0:
+                    # the main worker decides when the search is over
+                    self.stop_flag.value = 1
+
+        # the deepest finished iteration wins, the main worker on a tie
+        best = None
+        for index in range(self.workers):
+            result = finished[index]
+            if result.best_move and (best is None or
+                                     result.depth > best.depth):
+                best = result
+        if best is None:
+            if len(self.dead) == self.workers:
+                raise RuntimeError("every search worker has died")
+            # no legal move, or searches cut off before any move was found
+            best = finished[min(set(range(self.workers)) - self.dead)]
+        return SearchResult(best.best_move, best.score, best.pv, best.depth,
+                            sum(result.nodes for result in finished.values()),
+                            time.perf_counter() - start)
+
+    def _worker_died(self, index: int, finished):
+        # a worker that was killed, ran out of memory or crashed counts as
+        # finished without a move, the search goes on with the others
+        process = self.processes[index]
+        process.join(1.0)
+        search_log.warning("search worker %d exited with code %s", index,
+                           process.exitcode)
+        self.dead.add(index)
+        finished[index] = SearchResult(0, 0, [], 0, 0, 0.0)
+        if index == 0:
+            # nobody is left to say when the search is over
+            self.stop_flag.value = 1
+
+    def close(self):
+        self.stop_flag.value = 1
+        for index, tasks in enumerate(self.tasks):
+            if index not in self.dead:
+                tasks.put(None)
+        for process in self.processes:
+            process.join(1.0)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+        self.processes = []
+        for reader in self.results:
+            reader.close()
+        self.results = []
+        if self.shm is not None:
+            self.tt.close()
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
+
+
+def bench(fen: str, movetime_ms: int, max_workers: int):
+    # nodes per second for a doubling number of workers on the same search
+    counts = []
+    workers = 1
+    while workers < max_workers:
+        counts.append(workers)
+        workers *= 2
+    counts.append(max_workers)
+
+    print("cores available " + str(os.cpu_count()))
+    print("workers       nodes        nps  speedup  efficiency  depth  move")
+    base_nps = None
+    for workers in counts:
+        searcher = ParallelSearcher(Board(fen), workers)
+        try:
+            # a throwaway search waits out the worker start up, the timed
+            # one then starts from an empty table again
+            searcher.search(depth=1)
+            searcher.tt.clear()
+            result = searcher.search(movetime_ms=movetime_ms)
+        finally:
+            searcher.close()
+        nps = result.nps()
+        if base_nps is None:
+            base_nps = max(1, nps)
+        speedup = nps / base_nps
+        print(format(workers, ">7") + format(result.nodes, ">12") +
+              format(nps, ">11") + format(speedup, ">8.2f") + "x" +
+              format(speedup / workers, ">11.0%") +
+              format(result.depth, ">7") + "  " +
+              move_to_uci(result.best_move))
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Search a position on several cores at once.")
+    parser.add_argument("--fen", default=FEN_NEW_GAME,
+                        help="position to search (default: new game)")
+    parser.add_argument("--workers", type=int,
+                        help="worker processes (default: one per core)")
+    parser.add_argument("--depth", type=int, help="maximum depth")
+    parser.add_argument("--movetime", type=int, help="time budget in ms")
+    parser.add_argument("--hash", type=int, default=16,
+                        help="shared transposition table size in MB")
+    parser.add_argument("--bench", action="store_true",
+                        help="report nps scaling from 1 to --max-workers")
+    parser.add_argument("--max-workers", type=int,
+                        help="largest worker count for --bench "
+                             "(default: one per core)")
+    stats.add_profile_argument(parser)
+    args = parser.parse_args()
+
+    # only this process is profiled, the workers search on their own
+    if args.bench:
+        with stats.profiling(args.profile):
+            bench(args.fen, args.movetime or 3000,
+                  args.max_workers or os.cpu_count() or 1)
+        return 0
+
+    searcher = ParallelSearcher(Board(args.fen), args.workers, args.hash)
+    try:
+        with stats.profiling(args.profile):
+            result = searcher.search(args.depth, args.movetime)
+    finally:
+        searcher.close()
+    print("info " + str(result))
+    print("bestmove " + (move_to_uci(result.best_move)
+                         if result.best_move else "0000"))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,156 @@
+# Bad Chess
+# Copyright (C) Jared De Blander 2022
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+
+# perft counts the leaf nodes of the legal move tree to a fixed depth, it is
+# both the correctness oracle for move generation and its throughput bench
+#
+#   python perft.py 5
+#   python perft.py 3 --fen "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1"
+#   python perft.py --suite --max-depth 4
+
+import argparse
+import time
+
+import stats
+from board import FEN_NEW_GAME, Board
+from moves import MoveList, move_to_uci
+
+# the standard positions and node counts published on the chess
+# programming wiki, counts are listed from depth 1 upwards
+PERFT_SUITE = [
+    ("start position",
+     FEN_NEW_GAME,
+     [20, 400, 8902, 197281, 4865609, 119060324]),
+    ("kiwipete",
+     "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+     [48, 2039, 97862, 4085603, 193690690]),
+    ("position 3",
+     "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+     [14, 191, 2812, 43238, 674624, 11030083]),
+    ("position 4",
+     "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+     [6, 264, 9467, 422333, 15833292]),
+    ("position 4 mirrored",
+     "r2q1rk1/pP1p2pp/Q4n2/bbp1p3/Np6/1B3NBn/pPPP1PPP/R3K2R b KQ - 0 1",
+     [6, 264, 9467, 422333, 15833292]),
+    ("position 5",
+     "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",
+     [44, 1486, 62379, 2103487, 89941194]),
+    ("position 6",
+     "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+     [46, 2079, 89890, 3894594, 164075551]),
+]
+
+
+def perft(board: Board, depth: int, buffers=None):
+    # one move buffer per remaining ply, the last ply is counted in bulk
+    if depth == 0:
+        return 1
+    if buffers is None:
+        buffers = [MoveList() for ply in range(depth + 1)]
+
+    moves = board.generate_legal_moves(buffers[depth])
+    if depth == 1:
+        return moves.count
+
+    nodes = 0
+    for move in moves:
+        board.make_move(move)
+        nodes += perft(board, depth - 1, buffers)
+        board.unmake_move()
+    return nodes
+
+
+def divide(board: Board, depth: int):
+    # node counts below each root move, keyed by the move in UCI form
+    buffers = [MoveList() for ply in range(depth + 1)]
+    counts = {}
+    for move in board.generate_legal_moves(MoveList()):
+        board.make_move(move)
+        counts[move_to_uci(move)] = perft(board, depth - 1, buffers)
+        board.unmake_move()
+    return counts
+
+
+def run_divide(fen: str, depth: int):
+    board = Board(fen)
+    start = time.perf_counter()
+    counts = divide(board, depth)
+    elapsed = time.perf_counter() - start
+
+    for uci in sorted(counts):
+        print(uci + ": " + str(counts[uci]))
+
+    nodes = sum(counts.values())
+    print()
+    print("Moves: " + str(len(counts)))
+    print("Nodes: " + str(nodes))
+    print("Time: " + format(elapsed, ".3f") + " s")
+    if elapsed > 0:
+        print("NPS: " + str(int(nodes / elapsed)))
+    return nodes
+
+
+def run_suite(max_depth: int):
+    # returns True when every count matches the published value
+    passed = True
+    total_nodes = 0
+    total_time = 0.0
+
+    for name, fen, expected_counts in PERFT_SUITE:
+        board = Board(fen)
+        for depth, expected in enumerate(expected_counts[:max_depth], 1):
+            start = time.perf_counter()
+            nodes = perft(board, depth)
+            elapsed = time.perf_counter() - start
+            total_nodes += nodes
+            total_time += elapsed
+
+            if nodes == expected:
+                status = "ok"
+            else:
+                status = "FAIL expected " + str(expected)
+                passed = False
+            print(format(name, "<20") + " depth " + str(depth) + ": " +
+                  format(nodes, ">10") + " nodes " +
+                  format(elapsed, ">8.3f") + " s  " + status)
+
+    print()
+    print("Nodes: " + str(total_nodes))
+    print("Time: " + format(total_time, ".3f") + " s")
+    if total_time > 0:
+        print("NPS: " + str(int(total_nodes / total_time)))
+    print("Result: " + ("passed" if passed else "FAILED"))
+    return passed
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Count legal move tree leaves to benchmark and verify "
+                    "move generation.")
+    parser.add_argument("depth", type=int, nargs="?", default=4,
+                        help="search depth for a single position")
+    parser.add_argument("--fen", default=FEN_NEW_GAME,
+                        help="position to divide (default: new game)")
+    parser.add_argument("--suite", action="store_true",
+                        help="run the standard perft positions instead")
+    parser.add_argument("--max-depth", type=int, default=3,
+                        help="deepest suite depth to run (default: 3)")
+    stats.add_profile_argument(parser)
+    args = parser.parse_args()
+
+    with stats.profiling(args.profile):
+        if args.suite:
+            return 0 if run_suite(args.max_depth) else 1
+        run_divide(args.fen, args.depth)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,316 @@
+# Bad Chess
+# Copyright (C) Jared De Blander 2022
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+
+# portable game notation, reading and writing
+#
+# read_games() walks a file line by line and hands out one Game at a time,
+# so memory does not grow with the size of the database. files ending in
+# .gz, .bz2 or .xz are decompressed on the fly. a Game keeps its tags and
+# its moves as text, the moves are only resolved against a Board when the
+# game is replayed. comments, variations and annotation glyphs are
+# skipped.
+#
+#   python pgn.py fens games.pgn.gz
+#   python pgn.py bench games.pgn --replay
+
+import io
+import re
+
+import stats
+from board import FEN_NEW_GAME, Board, PieceColor
+
+# tags every game is written with, in this order, before any others
+SEVEN_TAG_ROSTER = ("Event", "Site", "Date", "Round", "White", "Black",
+                    "Result")
+GAME_RESULTS = ("1-0", "0-1", "1/2-1/2", "*")
+LINE_LENGTH = 80
+# a move number in front of a move, with one dot for white and three for
+# black
+MOVE_NUMBER = re.compile(r"\d+\.+")
+
+
+class PgnError(ValueError):
+    pass
+
+
+class Game:
+    def __init__(self, headers=None, moves=None):
+        # headers maps tag names to values, moves are in san
+        self.headers = headers if headers is not None else {}
+        self.moves = moves if moves is not None else []
+
+    @property
+    def result(self):
+        return self.headers.get("Result", "*")
+
+    def starting_fen(self):
+        return self.headers.get("FEN", FEN_NEW_GAME)
+
+    def replay(self, board=None):
+        # play the moves on the board, which is set to the starting
+        # position first, yielding each move after it has been made
+        if board is None:
+            board = Board()
+        board.fen_decode(self.starting_fen())
+        for number, san in enumerate(self.moves):
+            move = board.parse_san(san)
+            if move is None:
+                raise PgnError("illegal or ambiguous move " + san +
+                               " at ply " + str(number + 1) + " of " +
+                               self.headers.get("White", "?") + " - " +
+                               self.headers.get("Black", "?"))
+            board.make_move(move)
+            yield move
+
+
+def open_pgn(path: str):
+    # text stream over a pgn file, compressed or not
+    if path.endswith(".gz"):
+        import gzip
+
+        raw = gzip.open(path, "rb")
+    elif path.endswith(".bz2"):
+        import bz2
+
+        raw = bz2.open(path, "rb")
+    elif path.endswith(".xz"):
+        import lzma
+
+        raw = lzma.open(path, "rb")
+    else:
+        raw = open(path, "rb")
+    # databases are often latin-1, keep going over bytes that are not utf-8
+    return io.TextIOWrapper(raw, encoding="utf-8", errors="replace")
+
+
+def _parse_tag(line: str):
+    # [Name "value"] with \" and \\ escapes in the value
+    end = line.rfind("]")
+    name, _, value = line[1:end if end > 0 else len(line)].partition(" ")
+    value = value.strip()
+    if value.startswith('"') and value.endswith('"') and len(value) > 1:
+        value = value[1:-1].replace('\\"', '"').replace("\\\\", "\\")
+    return name, value
+
+
+def read_games(stream):
+    # yield every game of a text stream or of the file at a path
+    if isinstance(stream, str):
+        with open_pgn(stream) as opened:
+            yield from read_games(opened)
+        return
+
+    headers = {}
+    moves = []
+    in_moves = False
+    # inside a {comment}, and nesting of (variations)
+    in_comment = False
+    depth = 0
+    for line in stream:
+        line = line.strip()
+        if not in_comment and depth == 0 and line.startswith("["):
+            if in_moves:
+                yield Game(headers, moves)
+                headers, moves, in_moves = {}, [], False
+            name, value = _parse_tag(line)
+            headers[name] = value
+            continue
+        if not line or line.startswith("%"):
+            continue
+        in_moves = True
+        for char in "{}()":
+            if char in line:
+                line = line.replace(char, " " + char + " ")
+        for token in line.split():
+            if in_comment:
+                # comments do not nest, the first brace ends them
+                in_comment = token != "}"
+            elif token == "{":
+                in_comment = True
+            elif token == "(":
+                depth += 1
+            elif token == ")":
+                depth = max(0, depth - 1)
+            elif depth:
+                continue
+            elif token[0] == ";":
+                # the rest of the line is a comment
+                break
+            elif token in GAME_RESULTS:
+                # the result ends the game, whether or not tags follow
+                headers.setdefault("Result", token)
+                yield Game(headers, moves)
+                headers, moves, in_moves = {}, [], False
+            elif token[0] != "$":
+                # "12." "12..." and "12.e4" all lose their move number,
+                # "0-0" castling has none to lose
+                if token[0].isdigit():
+                    number = MOVE_NUMBER.match(token)
+                    if number is not None:
+                        token = token[number.end():]
+                if token:
+                    moves.append(token)
+    if in_moves or headers:
+        yield Game(headers, moves)
+
+
+def format_game(game: Game):
+    # the game as pgn text, tags first then the moves wrapped at
+    # LINE_LENGTH columns
+    headers = dict(game.headers)
+    headers.setdefault("Result", "*")
+    lines = []
+    for name in SEVEN_TAG_ROSTER:
+        value = headers.pop(name, "?")
+        lines.append(_format_tag(name, value))
+    for name, value in headers.items():
+        lines.append(_format_tag(name, value))
+    lines.append("")
+
+    fen_chunks = game.starting_fen().split()
+    number = int(fen_chunks[5]) if len(fen_chunks) > 5 and \
+        fen_chunks[5].isdigit() else 1
+    white_to_move = len(fen_chunks) < 2 or fen_chunks[1] == "w"
+    tokens = []
+    for san in game.moves:
+        if white_to_move:
+            tokens.append(str(number) + ".")
+        elif not tokens:
+            tokens.append(str(number) + "...")
+        tokens.append(san)
+        if not white_to_move:
+            number += 1
+        white_to_move = not white_to_move
+    tokens.append(game.result)
+
+    line = ""
+    for token in tokens:
+        if line and len(line) + 1 + len(token) > LINE_LENGTH:
+            lines.append(line)
+            line = token
+        else:
+            line = line + " " + token if line else token
+    lines.append(line)
+    return "\n".join(lines) + "\n\n"
+
+
+def _format_tag(name: str, value: str):
+    return "[" + name + ' "' + value.replace("\\", "\\\\").replace(
+        '"', '\\"') + '"]'
+
+
+def write_game(stream, game: Game):
+    stream.write(format_game(game))
+
+
+def game_from_board(board, starting_fen: str = FEN_NEW_GAME, headers=None):
+    # the moves played on a board since starting_fen as a Game. the result
+    # is filled in when the game is over on the board.
+    moves = [board.undo_stack[ply].move for ply in range(board.ply)]
+    for ply in range(board.ply):
+        board.unmake_move()
+    sans = []
+    for move in moves:
+        sans.append(board.move_to_san(move))
+        board.make_move(move)
+
+    game = Game(dict(headers or {}), sans)
+    if starting_fen != FEN_NEW_GAME:
+        game.headers["SetUp"] = "1"
+        game.headers["FEN"] = starting_fen
+    if "Result" not in game.headers:
+        game.headers["Result"] = game_result(board)
+    return game
+
+
+def game_result(board):
+    # "1-0", "0-1" or "1/2-1/2" once the side to move has no legal move or
+    # a draw can be claimed by repetition or the fifty move rule,
+    # otherwise "*"
+    if board.generate_legal_moves().count:
+        if board.is_fifty_moves() or board.is_repetition(2):
+            return "1/2-1/2"
+        return "*"
+    if not board.in_check():
+        return "1/2-1/2"
+    return "0-1" if board.turn == PieceColor.WHITE else "1-0"
+
+
+def bench(path: str, replay: bool, limit: int = None):
+    import time
+
+    games = 0
+    moves = 0
+    board = Board()
+    start = time.perf_counter()
+    for game in read_games(path):
+        if replay:
+            try:
+                for move in game.replay(board):
+                    moves += 1
+            except PgnError:
+                pass
+        else:
+            moves += len(game.moves)
+        games += 1
+        if limit is not None and games >= limit:
+            break
+    elapsed = time.perf_counter() - start
+    rate = games / elapsed if elapsed > 0 else 0.0
+    print(str(games) + " games, " + str(moves) + " moves in " +
+          format(elapsed, ".2f") + " s: " + format(rate, ".0f") +
+          " games/s, " + format(moves / elapsed if elapsed > 0 else 0, ".0f") +
+          " moves/s" + (" replayed" if replay else " parsed"))
+    try:
+        import resource
+    except ImportError:
+        return
+    # kilobytes on linux, bytes on macos
+    print("peak resident memory " +
+          str(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss))
+
+
+def main():
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(
+        description="Read pgn files, plain or compressed.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    fens_parser = commands.add_parser(
+        "fens", help="print the position after every move of every game")
+    fens_parser.add_argument("pgn", help="pgn file, .gz .bz2 and .xz work")
+    bench_parser = commands.add_parser(
+        "bench", help="measure games per second")
+    bench_parser.add_argument("pgn", help="pgn file, .gz .bz2 and .xz work")
+    bench_parser.add_argument("--replay", action="store_true",
+                              help="also resolve and play every move")
+    bench_parser.add_argument("--games", type=int,
+                              help="stop after this many games")
+    stats.add_profile_argument(parser)
+    args = parser.parse_args()
+
+    with stats.profiling(args.profile):
+        if args.command == "bench":
+            bench(args.pgn, args.replay, args.games)
+            return 0
+
+        board = Board()
+        for game in read_games(args.pgn):
+            try:
+                for move in game.replay(board):
+                    sys.stdout.write(board.fen_encode() + "\n")
+            except PgnError as error:
+                sys.stderr.write(str(error) + "\n")
+            sys.stdout.write("\n")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
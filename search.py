@@ -0,0 +1,489 @@
+# Bad Chess
+# Copyright (C) Jared De Blander 2022
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+
+# negamax alpha-beta search with iterative deepening
+#
+# every iteration searches one ply deeper than the last and starts from the
+# previous principal variation, which the transposition table hands back as
+# the first move to try. a depth, a node budget and a hard deadline can all
+# limit the search, the result of the last finished iteration is returned.
+#
+# after the table move come captures that do not lose material, most
+# valuable victim first and cheapest attacker first among equals, then the
+# two killer moves of the ply (quiet moves that caused a cutoff in a
+# sibling), then the other quiet moves by how often they cut off before,
+# and last the captures that lose material. at the leaves a quiescence
+# search plays out the captures that do not lose material until the
+# position is quiet, so the evaluation is never taken in the middle of an
+# exchange.
+#
+#   python search.py --depth 5
+#   python search.py --movetime 2000 --fen "<fen>"
+
+import time
+
+import log
+import stats
+from board import (FEN_NEW_GAME, PROMOTION_TYPES, SEE_VALUES, TYPE_MASK,
+                   Board, PieceType)
+from moves import EN_PASSANT, MoveList, move_to_uci
+from transposition import (BOUND_EXACT, BOUND_LOWER, BOUND_UPPER,
+                           TranspositionTable)
+
+INFINITY = 32000
+MATE_SCORE = 30000
+# scores beyond this are mates, stored in the table relative to the node
+MATE_BOUND = MATE_SCORE - 1000
+
+MAX_DEPTH = 64
+MAX_PLY = 128
+DEFAULT_DEPTH = 4
+
+# how many nodes pass between clock checks
+CHECK_INTERVAL = 1024
+
+# move ordering scores, higher is searched first. losing captures score
+# below ORDER_QUIET and quiet moves above it by their history.
+ORDER_TT_MOVE = 1 << 30
+ORDER_GOOD_CAPTURE = 1 << 28
+ORDER_KILLER = 1 << 27
+ORDER_QUIET = 1 << 20
+# history scores are halved once one of them passes this
+HISTORY_LIMIT = 1 << 19
+# rank of each piece type for most valuable victim, least valuable attacker
+ORDER_RANK = (0, 1, 4, 2, 3, 5, 6)
+
+search_log = log.get_logger("search")
+
+
+def score_to_uci(score: int):
+    # "cp <centipawns>", or "mate <moves>" negative when getting mated
+    if score > MATE_BOUND:
+        return "mate " + str((MATE_SCORE - score + 1) // 2)
+    if score < -MATE_BOUND:
+        return "mate -" + str((MATE_SCORE + score + 1) // 2)
+    return "cp " + str(score)
+
+
+class SearchResult:
+    def __init__(self, best_move, score, pv, depth, nodes, elapsed):
+        self.best_move = best_move
+        self.score = score
+        self.pv = pv
+        self.depth = depth
+        self.nodes = nodes
+        self.elapsed = elapsed
+
+    def nps(self):
+        if self.elapsed > 0:
+            return int(self.nodes / self.elapsed)
+        return 0
+
+    def __str__(self):
+        return ("depth " + str(self.depth) + " score " +
+                score_to_uci(self.score) +
+                " nodes " + str(self.nodes) + " nps " + str(self.nps()) +
+                " pv " + " ".join(move_to_uci(move) for move in self.pv))
+
+
+class Searcher:
+    def __init__(self, board, tt: TranspositionTable = None):
+        self.board = board
+        self.tt = tt if tt is not None else TranspositionTable()
+        self.move_lists = [MoveList() for ply in range(MAX_PLY)]
+        self.pv = [[] for ply in range(MAX_PLY + 1)]
+        self.nodes = 0
+        # how well the table and the move order work, see stats.py
+        self.tt_probes = 0
+        self.tt_hits = 0
+        self.tt_cutoffs = 0
+        self.cutoffs = 0
+        self.first_move_cutoffs = 0
+        self.quiescence_nodes = 0
+        # nodes searched by each finished iteration
+        self.iteration_nodes = []
+        # two quiet moves per ply that last caused a cutoff, and cutoff
+        # counts weighted by depth per piece code and target square
+        self.killers = [[0, 0] for ply in range(MAX_PLY)]
+        self.history = [[0] * 64 for code in range(23)]
+        self.node_limit = None
+        self.deadline = None
+        # set from another thread on ponderhit, the deadline of a search
+        # that may not have started yet
+        self.ponder_deadline = None
+        self.stopped = False
+        # endgame tables probed below the root, see tablebase.py
+        self.tablebases = None
+
+    def stop(self):
+        # may be called from another thread, the search unwinds at its next
+        # node and returns the last finished iteration
+        self.stopped = True
+
+    def evaluate(self):
+        return self.board.evaluate()
+
+    def search(self, depth: int = None, movetime_ms: int = None,
+               nodes: int = None, infinite: bool = False,
+               on_iteration=None):
+        # an infinite search only ends on stop(), on_iteration is called
+        # with the SearchResult of every finished iteration
+        if depth is None and movetime_ms is None and nodes is None and \
+                not infinite:
+            depth = DEFAULT_DEPTH
+        max_depth = min(depth, MAX_DEPTH) if depth is not None else MAX_DEPTH
+
+        start = time.perf_counter()
+        self.nodes = 0
+        self.tt_probes = 0
+        self.tt_hits = 0
+        self.tt_cutoffs = 0
+        self.cutoffs = 0
+        self.first_move_cutoffs = 0
+        self.quiescence_nodes = 0
+        self.iteration_nodes = []
+        for killers in self.killers:
+            killers[0] = killers[1] = 0
+        # what cut off in the last search is a good guess for this one
+        for scores in self.history:
+            for square in range(64):
+                scores[square] >>= 1
+        self.node_limit = nodes
+        self.deadline = None
+        if movetime_ms is not None:
+            self.deadline = start + movetime_ms / 1000
+        # a ponderhit that came before the search started
+        if self.ponder_deadline is not None:
+            self.deadline = self.ponder_deadline
+        self.stopped = False
+        self.tt.new_search()
+
+        result = SearchResult(0, 0, [], 0, 0, 0.0)
+        for iteration in range(1, max_depth + 1):
+            if iteration < max_depth and self._skip_iteration(iteration):
+                continue
+            score = self._negamax(iteration, -INFINITY, INFINITY, 0)
+            if self.stopped and result.depth > 0:
+                break
+
+            self.iteration_nodes.append(self.nodes)
+            elapsed = time.perf_counter() - start
+            pv = self._complete_pv(self.pv[0], iteration)
+            result = SearchResult(pv[0] if pv else 0, score, pv, iteration,
+                                  self.nodes, elapsed)
+            search_log.debug("iteration %s", result)
+            if on_iteration is not None:
+                on_iteration(result)
+            if self.stopped or not pv or abs(score) >= MATE_BOUND:
+                break
+            # another iteration would rarely finish in the time left
+            if self.deadline is not None and \
+                    time.perf_counter() + elapsed > self.deadline:
+                break
+
+        if result.best_move == 0:
+            # interrupted before the first iteration finished, any legal
+            # move beats none
+            moves = self.board.generate_legal_moves(self.move_lists[0])
+            if moves.count:
+                result.best_move = moves[0]
+                result.pv = [moves[0]]
+
+        result.nodes = self.nodes
+        result.elapsed = time.perf_counter() - start
+        return result
+
+    def branching_factor(self):
+        # effective branching factor, by how much each extra ply multiplied
+        # the nodes of an iteration. taken over the last two iterations,
+        # since odd and even depths alternate between cheap and dear.
+        counts = self.iteration_nodes
+        spent = [counts[0]] + [counts[index] - counts[index - 1]
+                               for index in range(1, len(counts))]
+        if len(spent) < 2:
+            return 0.0
+        if len(spent) < 3:
+            return spent[-1] / max(1, spent[-2])
+        return (spent[-1] / max(1, spent[-3])) ** 0.5
+
+    def _skip_iteration(self, iteration: int):
+        # helpers of a parallel search leave out some depths so they are
+        # not all working on the same iteration
+        return False
+
+    def _order_root(self, buffer, count: int, tt_move: int):
+        # called with the root moves once the table move is in front
+        pass
+
+    def _complete_pv(self, pv, depth: int):
+        # a table cutoff inside the principal variation leaves it short, the
+        # rest is recovered by following the table's best moves
+        pv = list(pv)
+        board = self.board
+        for move in pv:
+            board.make_move(move)
+        moves = self.move_lists[0]
+        while len(pv) < depth:
+            move = self.tt.probe_move(board.hash)
+            if not move or move not in board.generate_legal_moves(moves):
+                break
+            board.make_move(move)
+            pv.append(move)
+        for move in pv:
+            board.unmake_move()
+        return pv
+
+    def _check_limits(self):
+        if self.node_limit is not None and self.nodes >= self.node_limit:
+            self.stopped = True
+        elif self.deadline is not None and \
+                time.perf_counter() >= self.deadline:
+            self.stopped = True
+
+    def _order_moves(self, buffer, count: int, tt_move: int, ply: int):
+        # sort the moves in place, best first. returns their sort keys,
+        # a move's score shifted up by 16 bits with the move below it.
+        board = self.board
+        squares = board.squares
+        killers = self.killers[ply]
+        history = self.history
+        keys = []
+        for index in range(count):
+            move = buffer[index]
+            if move == tt_move:
+                score = ORDER_TT_MOVE
+            elif move & 0xC000:
+                # a capture or a promotion
+                attacker = squares[move & 63] & TYPE_MASK
+                if move >> 12 == EN_PASSANT:
+                    victim = PieceType.PAWN
+                else:
+                    victim = squares[move >> 6 & 63] & TYPE_MASK
+                score = ORDER_RANK[victim] * 8 - ORDER_RANK[attacker]
+                if move & 0x8000:
+                    score += ORDER_RANK[PROMOTION_TYPES[move >> 12 & 3]] * 8
+                # taking a piece worth at least the attacker never loses
+                if victim and SEE_VALUES[victim] >= SEE_VALUES[attacker] or \
+                        board.see(move) >= 0:
+                    score += ORDER_GOOD_CAPTURE
+            elif move == killers[0]:
+                score = ORDER_KILLER + 1
+            elif move == killers[1]:
+                score = ORDER_KILLER
+            else:
+                score = ORDER_QUIET + history[squares[move & 63]][move >> 6 & 63]
+            keys.append(score << 16 | move)
+        keys.sort(reverse=True)
+        for index in range(count):
+            buffer[index] = keys[index] & 0xFFFF
+        return keys
+
+    def _quiet_cutoff(self, move: int, depth: int, ply: int):
+        # remember a quiet move that refuted the opponent's last move
+        killers = self.killers[ply]
+        if killers[0] != move:
+            killers[1] = killers[0]
+            killers[0] = move
+        scores = self.history[self.board.squares[move & 63]]
+        end = move >> 6 & 63
+        scores[end] += depth * depth
+        if scores[end] > HISTORY_LIMIT:
+            for scores in self.history:
+                for square in range(64):
+                    scores[square] >>= 1
+
+    def _quiesce(self, alpha: int, beta: int, ply: int):
+        # search captures only until the position is quiet. the side to
+        # move may always stand pat on the static evaluation instead,
+        # unless it is in check, then every evasion is searched.
+        self.nodes += 1
+        self.quiescence_nodes += 1
+        if self.nodes % CHECK_INTERVAL == 0:
+            self._check_limits()
+        if self.stopped:
+            return 0
+
+        board = self.board
+        self.pv[ply] = []
+        if board.halfmove_clock >= 100 or board.is_repetition():
+            return 0
+        if ply >= MAX_PLY - 1:
+            return self.evaluate()
+
+        in_check = board.in_check()
+        if in_check:
+            moves = board.generate_legal_moves(self.move_lists[ply])
+            if moves.count == 0:
+                return -MATE_SCORE + ply
+            best_score = -INFINITY
+        else:
+            best_score = self.evaluate()
+            if best_score >= beta:
+                return best_score
+            if best_score > alpha:
+                alpha = best_score
+            moves = board.generate_legal_moves(self.move_lists[ply], True)
+
+        keys = self._order_moves(moves.moves, moves.count, 0, ply)
+        for key in keys:
+            if not in_check and key < ORDER_GOOD_CAPTURE << 16:
+                # the rest lose material by static exchange
+                break
+            board.make_move(key & 0xFFFF)
+            score = -self._quiesce(-beta, -alpha, ply + 1)
+            board.unmake_move()
+            if self.stopped:
+                return 0
+            if score > best_score:
+                best_score = score
+                if score > alpha:
+                    alpha = score
+                    if alpha >= beta:
+                        break
+        return best_score
+
+    def _negamax(self, depth: int, alpha: int, beta: int, ply: int):
+        if depth <= 0:
+            return self._quiesce(alpha, beta, ply)
+        self.nodes += 1
+        if self.nodes % CHECK_INTERVAL == 0:
+            self._check_limits()
+        if self.stopped:
+            return 0
+
+        board = self.board
+        self.pv[ply] = []
+        # a repetition inside the tree or of the game before the root is
+        # scored as a draw straight away, the opponent could repeat again
+        if ply > 0 and (board.halfmove_clock >= 100 or
+                        board.is_repetition()):
+            return 0
+
+        if self.tablebases is not None and ply > 0:
+            entry = self.tablebases.probe(board)
+            if entry is not None:
+                wdl, plies = entry
+                if wdl > 0:
+                    return MATE_SCORE - ply - plies
+                if wdl < 0:
+                    return -MATE_SCORE + ply + plies
+                return 0
+
+        key = board.hash
+        tt_move = 0
+        self.tt_probes += 1
+        entry = self.tt.probe(key)
+        if entry is not None:
+            self.tt_hits += 1
+            tt_move, tt_score, tt_depth, bound = entry
+            if ply > 0 and tt_depth >= depth:
+                if tt_score > MATE_BOUND:
+                    tt_score -= ply
+                elif tt_score < -MATE_BOUND:
+                    tt_score += ply
+                if bound == BOUND_EXACT or \
+                        (bound == BOUND_LOWER and tt_score >= beta) or \
+                        (bound == BOUND_UPPER and tt_score <= alpha):
+                    self.tt_cutoffs += 1
+                    return tt_score
+
+        if ply >= MAX_PLY - 1:
+            return self.evaluate()
+
+        moves = board.generate_legal_moves(self.move_lists[ply])
+        count = moves.count
+        if count == 0:
+            if board.in_check():
+                return -MATE_SCORE + ply
+            return 0
+
+        buffer = moves.moves
+        self._order_moves(buffer, count, tt_move, ply)
+        if ply == 0:
+            self._order_root(buffer, count, tt_move)
+
+        original_alpha = alpha
+        best_score = -INFINITY
+        best_move = 0
+        for index in range(count):
+            move = buffer[index]
+            board.make_move(move)
+            score = -self._negamax(depth - 1, -beta, -alpha, ply + 1)
+            board.unmake_move()
+            if self.stopped:
+                return 0
+
+            if score > best_score:
+                best_score = score
+                best_move = move
+                if score > alpha:
+                    alpha = score
+                    self.pv[ply] = [move] + self.pv[ply + 1]
+                    if alpha >= beta:
+                        self.cutoffs += 1
+                        if index == 0:
+                            self.first_move_cutoffs += 1
+                        if not move & 0xC000:
+                            self._quiet_cutoff(move, depth, ply)
+                        break
+
+        if best_score >= beta:
+            bound = BOUND_LOWER
+        elif best_score > original_alpha:
+            bound = BOUND_EXACT
+        else:
+            bound = BOUND_UPPER
+        stored_score = best_score
+        if stored_score > MATE_BOUND:
+            stored_score += ply
+        elif stored_score < -MATE_BOUND:
+            stored_score -= ply
+        self.tt.store(key, depth, stored_score, bound, best_move)
+
+        return best_score
+
+
+def search(board, depth: int = None, movetime_ms: int = None,
+           nodes: int = None, tt: TranspositionTable = None):
+    # search the board for the side to move, with no limit given the search
+    # stops at DEFAULT_DEPTH
+    return Searcher(board, tt).search(depth, movetime_ms, nodes)
+
+
+# the counters of every search are added up while stats collection is on
+stats.watch(Searcher, "search", after=stats.record_search)
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Search a position and print the best move.")
+    parser.add_argument("--fen", default=FEN_NEW_GAME,
+                        help="position to search (default: new game)")
+    parser.add_argument("--depth", type=int, help="maximum depth")
+    parser.add_argument("--movetime", type=int, help="time budget in ms")
+    parser.add_argument("--nodes", type=int, help="node budget")
+    parser.add_argument("--hash", type=int, default=16,
+                        help="transposition table size in MB")
+    stats.add_profile_argument(parser)
+    args = parser.parse_args()
+
+    board = Board(args.fen)
+    with stats.profiling(args.profile):
+        result = search(board, args.depth, args.movetime, args.nodes,
+                        TranspositionTable(args.hash))
+    print("info " + str(result))
+    print("bestmove " + (move_to_uci(result.best_move)
+                         if result.best_move else "0000"))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
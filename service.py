@@ -0,0 +1,545 @@
+# Bad Chess
+# Copyright (C) Jared De Blander 2022
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+
+# local analysis service, the engine over http and json
+#
+# one asyncio process takes the requests and answers the cheap ones, the
+# legal moves and the static evaluation of a position, itself. searches go
+# to a fixed pool of worker processes, each keeping its own transposition
+# table from one search to the next. the event loop never waits on a
+# search, so a slow search only holds up the requests that asked for it.
+#
+# finished searches are kept in a least recently used cache keyed by the
+# zobrist key of the position and the search limits, every entry for at
+# most --cache-ttl seconds. a request for a search that is already running
+# waits for that search instead of starting another. once --max-pending
+# searches are queued further ones are turned away with 503 right away,
+# rather than letting every request wait longer and longer. a worker that
+# dies breaks the whole pool, the searches it held are answered with 503
+# and a new pool is started for the ones after.
+#
+#   python service.py --port 8765 --workers 4
+#   curl "localhost:8765/bestmove?depth=5&fen=<fen>"
+#   curl -d '{"fen": "<fen>", "moves": ["e2e4"], "movetime": 500}' \
+#       localhost:8765/bestmove
+#
+# every endpoint takes fen, the position (default: new game), and moves,
+# played from it, as query parameters or as a json body
+#
+#   /moves     legal moves in uci and san, and whether the game is over
+#   /eval      static evaluation in centipawns
+#   /bestmove  search to depth or for movetime milliseconds
+#   /stats     cache and pool counters
+#
+# bench_service.py measures the latency of a running service under load.
+
+import asyncio
+import collections
+import json
+import multiprocessing
+import os
+import re
+import signal
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from urllib.parse import parse_qs, urlsplit
+
+import log
+import pgn
+import stats
+from board import (CASTLE_BLACK_KING, CASTLE_BLACK_QUEEN, CASTLE_WHITE_KING,
+                   CASTLE_WHITE_QUEEN, CASTLING_CHARS, COLOR_MASK,
+                   FEN_NEW_GAME, Board, PieceColor, PieceType)
+from engine_process import WORKER_NICENESS
+from moves import move_to_uci
+from search import DEFAULT_DEPTH, Searcher, score_to_uci
+from transposition import TranspositionTable
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+DEFAULT_HASH_MB = 16
+DEFAULT_CACHE_ENTRIES = 10000
+DEFAULT_CACHE_SECONDS = 600.0
+# the deepest and longest search a request may ask for
+DEFAULT_MAX_DEPTH = 10
+DEFAULT_MAX_MOVETIME_MS = 10000
+# moves a request may play from its fen, the board's undo stack also has
+# to hold the search
+MAX_HISTORY = 128
+MAX_BODY = 64 * 1024
+
+CASTLING_FIELD = re.compile(r"-|K?Q?k?q?")
+EN_PASSANT_FIELD = re.compile(r"-|[a-h][36]")
+# right, color, king square and rook square of every castling right
+CASTLING_HOMES = ((CASTLE_WHITE_KING, PieceColor.WHITE, 4, 7),
+                  (CASTLE_WHITE_QUEEN, PieceColor.WHITE, 4, 0),
+                  (CASTLE_BLACK_KING, PieceColor.BLACK, 60, 63),
+                  (CASTLE_BLACK_QUEEN, PieceColor.BLACK, 60, 56))
+
+service_log = log.get_logger("service")
+
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found",
+           405: "Method Not Allowed", 413: "Payload Too Large",
+           500: "Internal Server Error", 503: "Service Unavailable"}
+
+
+class RequestError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+
+class ResultCache:
+    # least recently used results, each kept for at most ttl seconds (None
+    # keeps them until they are pushed out)
+    def __init__(self, max_entries: int = DEFAULT_CACHE_ENTRIES,
+                 ttl: float = DEFAULT_CACHE_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evicted = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is not None and self.ttl is not None and \
+                time.monotonic() - entry[0] > self.ttl:
+            del self.entries[key]
+            self.expired += 1
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key, value):
+        if self.max_entries <= 0:
+            return
+        self.entries[key] = (time.monotonic(), value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evicted += 1
+
+
+def load_position(fen: str = None, moves=()):
+    # a Board at fen after the uci moves, RequestError when either is no good
+    fen = (fen or FEN_NEW_GAME).strip()
+    fields = fen.split()
+    if len(fields) not in (4, 6) or fields[1] not in ("w", "b") or \
+            any(sum(int(char) if char.isdigit() else 1 for char in rank) != 8
+                for rank in _ranks(fields[0])) or \
+            not CASTLING_FIELD.fullmatch(fields[2]) or \
+            not EN_PASSANT_FIELD.fullmatch(fields[3]):
+        raise RequestError(400, "not a fen: " + fen)
+    try:
+        board = Board(fen)
+    except (KeyError, ValueError, IndexError):
+        raise RequestError(400, "not a fen: " + fen)
+    for color in (PieceColor.WHITE, PieceColor.BLACK):
+        if bin(board.pieces[color | PieceType.KING]).count("1") != 1:
+            raise RequestError(400, "each side needs exactly one king")
+    # the side that just moved cannot have left its king in check
+    mover = board.turn ^ COLOR_MASK
+    king = board.pieces[mover | PieceType.KING]
+    if board.is_square_attacked(king.bit_length() - 1, board.turn):
+        raise RequestError(400, "the side not to move is in check")
+    # fen_decode takes both fields on trust, and make_move would conjure a
+    # rook or take a pawn that is not there
+    for right, color, king_square, rook_square in CASTLING_HOMES:
+        if board.castling & right and \
+                (board.squares[king_square] != color | PieceType.KING or
+                 board.squares[rook_square] != color | PieceType.ROOK):
+            raise RequestError(400, "castling right " +
+                               CASTLING_CHARS[right.bit_length() - 1] +
+                               " without king and rook at home")
+    if board.en_passant is not None:
+        square = board.en_passant
+        # the square the pawn crossed, the one it stands on now and the one
+        # it came from, seen from the side to move
+        step = -8 if board.turn == PieceColor.WHITE else 8
+        pawn = (board.turn ^ COLOR_MASK) | PieceType.PAWN
+        if square >> 3 != (5 if board.turn == PieceColor.WHITE else 2) or \
+                board.squares[square] or board.squares[square - step] or \
+                board.squares[square + step] != pawn:
+            raise RequestError(400, "no pawn just passed " + fields[3])
+
+    if isinstance(moves, str):
+        moves = moves.replace(",", " ").split()
+    if len(moves) > MAX_HISTORY:
+        raise RequestError(400, "at most " + str(MAX_HISTORY) + " moves")
+    for uci in moves:
+        move = board.parse_move(str(uci))
+        if move is None:
+            raise RequestError(400, "illegal move " + str(uci))
+        board.make_move(move)
+    return board
+
+
+def _ranks(placement: str):
+    ranks = placement.split("/")
+    # a placement of fewer than eight ranks never adds up
+    return ranks if len(ranks) == 8 else ["x"]
+
+
+def position_key(board):
+    # the position and every position since the last capture or pawn move,
+    # which is what a search can tell apart through repetitions
+    count = min(board.halfmove_clock, board.ply)
+    return (board.hash,) + tuple(board.undo_stack[ply].hash
+                                 for ply in range(board.ply - count,
+                                                  board.ply))
+
+
+def score_json(score: int):
+    # {"cp": 31} or {"mate": -2}, from the side to move's view
+    kind, value = score_to_uci(score).split()
+    return {kind: int(value)}
+
+
+# the searcher of this worker process, made by _worker_start
+_searcher = None
+
+
+def _worker_start(hash_mb: int):
+    global _searcher
+    # searches run nicer than the event loop so the cheap requests keep
+    # being answered while every worker is busy
+    if hasattr(os, "nice"):
+        try:
+            os.nice(WORKER_NICENESS)
+        except OSError:
+            pass
+    _searcher = Searcher(Board(), TranspositionTable(hash_mb))
+
+
+def _search_task(fen: str, moves, depth: int, movetime_ms: int):
+    board = _searcher.board
+    board.fen_decode(fen)
+    for move in moves:
+        board.make_move(move)
+    result = _searcher.search(depth, movetime_ms)
+    pv = []
+    sans = []
+    for move in result.pv:
+        pv.append(move_to_uci(move))
+        sans.append(board.move_to_san(move))
+        board.make_move(move)
+    return {
+        "bestmove": move_to_uci(result.best_move) if result.best_move
+        else None,
+        "san": sans[0] if sans else None,
+        "score": score_json(result.score),
+        "depth": result.depth,
+        "nodes": result.nodes,
+        "time_ms": round(result.elapsed * 1000, 1),
+        "pv": pv,
+        "pv_san": sans,
+    }
+
+
+class AnalysisService:
+    def __init__(self, workers: int = None, hash_mb: int = DEFAULT_HASH_MB,
+                 cache_entries: int = DEFAULT_CACHE_ENTRIES,
+                 cache_seconds: float = DEFAULT_CACHE_SECONDS,
+                 max_pending: int = None,
+                 max_depth: int = DEFAULT_MAX_DEPTH,
+                 max_movetime_ms: int = DEFAULT_MAX_MOVETIME_MS):
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending or self.workers * 8
+        self.max_depth = max_depth
+        self.max_movetime_ms = max_movetime_ms
+        self.cache = ResultCache(cache_entries, cache_seconds or None)
+        self.hash_mb = hash_mb
+        # search key -> future of the search running for it and the pool
+        # it runs in
+        self.in_flight = {}
+        self.counters = {"requests": 0, "errors": 0, "searches": 0,
+                         "coalesced": 0, "rejected": 0, "restarts": 0}
+        self.started = time.monotonic()
+        self.pool = self._start_pool()
+
+    def _start_pool(self):
+        return ProcessPoolExecutor(
+            self.workers, mp_context=multiprocessing.get_context("spawn"),
+            initializer=_worker_start, initargs=(self.hash_mb,))
+
+    def _restart_pool(self, broken):
+        # a worker that dies breaks the whole pool, and every search sent
+        # to it afterwards would fail the same way
+        if self.pool is not broken:
+            return
+        service_log.warning("a search worker died, restarting the pool")
+        self.counters["restarts"] += 1
+        broken.shutdown(wait=False, cancel_futures=True)
+        self.pool = self._start_pool()
+
+    def warm_up(self):
+        # start every worker now so the first requests do not pay for it
+        futures = [self.pool.submit(_search_task, FEN_NEW_GAME, [], 1, None)
+                   for worker in range(self.workers)]
+        for future in futures:
+            future.result()
+
+    def close(self):
+        self.pool.shutdown(wait=True, cancel_futures=True)
+
+    def legal_moves(self, board):
+        moves = list(board.generate_legal_moves())
+        return {
+            "fen": board.fen_encode(),
+            "moves": [move_to_uci(move) for move in moves],
+            "san": [board.move_to_san(move) for move in moves],
+            "check": board.in_check(),
+            "result": pgn.game_result(board),
+        }
+
+    def evaluation(self, board):
+        score = board.evaluate()
+        return {
+            "fen": board.fen_encode(),
+            "score": {"cp": score},
+            "white_cp": score if board.turn == PieceColor.WHITE else -score,
+        }
+
+    async def best_move(self, board, depth: int = None,
+                        movetime_ms: int = None):
+        if depth is None and movetime_ms is None:
+            depth = DEFAULT_DEPTH
+        if depth is not None and not 1 <= depth <= self.max_depth:
+            raise RequestError(400, "depth must be 1 to " +
+                               str(self.max_depth))
+        if movetime_ms is not None and \
+                not 1 <= movetime_ms <= self.max_movetime_ms:
+            raise RequestError(400, "movetime must be 1 to " +
+                               str(self.max_movetime_ms))
+        if not board.generate_legal_moves().count:
+            raise RequestError(400, "no legal moves in " + board.fen_encode())
+
+        key = (position_key(board), depth, movetime_ms)
+        result = self.cache.get(key)
+        if result is not None:
+            return dict(result, fen=board.fen_encode(), cached=True)
+
+        if key in self.in_flight:
+            future, pool = self.in_flight[key]
+            self.counters["coalesced"] += 1
+        else:
+            if len(self.in_flight) >= self.max_pending:
+                self.counters["rejected"] += 1
+                raise RequestError(503, "too many searches queued")
+            fen, moves = board.recent_history()
+            pool = self.pool
+            try:
+                future = asyncio.get_running_loop().run_in_executor(
+                    pool, _search_task, fen, moves, depth, movetime_ms)
+            except BrokenProcessPool:
+                self._restart_pool(pool)
+                raise RequestError(503, "search workers restarting")
+            self.in_flight[key] = (future, pool)
+            self.counters["searches"] += 1
+            future.add_done_callback(
+                lambda done: self._search_done(key, done))
+        fen = board.fen_encode()
+        try:
+            # a client hanging up must not call off a search others wait
+            # for
+            result = await asyncio.shield(future)
+        except BrokenProcessPool:
+            self._restart_pool(pool)
+            raise RequestError(503, "search worker died, try again")
+        return dict(result, fen=fen, cached=False)
+
+    def _search_done(self, key, future):
+        self.in_flight.pop(key, None)
+        if not future.cancelled() and future.exception() is None:
+            self.cache.put(key, future.result())
+
+    def status(self):
+        cache = self.cache
+        lookups = cache.hits + cache.misses
+        return dict(self.counters,
+                    workers=self.workers,
+                    pending=len(self.in_flight),
+                    uptime_s=round(time.monotonic() - self.started, 1),
+                    cache={"entries": len(cache), "hits": cache.hits,
+                           "misses": cache.misses, "expired": cache.expired,
+                           "evicted": cache.evicted,
+                           "hit_rate": round(cache.hits / lookups, 4)
+                           if lookups else 0.0})
+
+    async def dispatch(self, method: str, target: str, body: bytes):
+        # (status, json-able reply) for one request
+        url = urlsplit(target)
+        params = {name: values[-1]
+                  for name, values in parse_qs(url.query).items()}
+        if method not in ("GET", "POST"):
+            raise RequestError(405, "use GET or POST")
+        if body:
+            try:
+                sent = json.loads(body)
+            except ValueError:
+                raise RequestError(400, "body is not json")
+            if not isinstance(sent, dict):
+                raise RequestError(400, "body must be a json object")
+            params.update(sent)
+
+        path = url.path.rstrip("/")
+        if path == "/stats":
+            return 200, self.status()
+        if path not in ("/moves", "/eval", "/bestmove"):
+            raise RequestError(404, "no endpoint " + url.path)
+
+        board = load_position(params.get("fen"), params.get("moves") or ())
+        if path == "/moves":
+            return 200, self.legal_moves(board)
+        if path == "/eval":
+            return 200, self.evaluation(board)
+        limits = {}
+        for name in ("depth", "movetime"):
+            if params.get(name) is not None:
+                try:
+                    limits[name] = int(params[name])
+                except (TypeError, ValueError):
+                    raise RequestError(400, name + " must be a number")
+        return 200, await self.best_move(board, limits.get("depth"),
+                                         limits.get("movetime"))
+
+    async def handle(self, reader, writer):
+        # one connection, requests are answered in turn while it is kept
+        # alive
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                keep_alive = False
+                try:
+                    method, target, version = \
+                        request_line.decode("latin-1").split()
+                    headers = {}
+                    while True:
+                        line = await reader.readline()
+                        if not line.strip():
+                            break
+                        name, _, value = line.decode("latin-1").partition(":")
+                        headers[name.strip().lower()] = value.strip()
+                    length = int(headers.get("content-length", 0))
+                    if length > MAX_BODY:
+                        raise RequestError(413, "body over " +
+                                           str(MAX_BODY) + " bytes")
+                    body = await reader.readexactly(length) if length else b""
+                    keep_alive = version == "HTTP/1.1" and \
+                        headers.get("connection", "").lower() != "close"
+                    self.counters["requests"] += 1
+                    status, reply = await self.dispatch(method, target, body)
+                except RequestError as error:
+                    status, reply = error.status, {"error": str(error)}
+                except ValueError:
+                    status, reply = 400, {"error": "malformed request"}
+                except asyncio.CancelledError:
+                    raise
+                except Exception as error:
+                    status, reply = 500, {"error": repr(error)}
+                if status != 200:
+                    self.counters["errors"] += 1
+                self._respond(writer, status, reply, keep_alive)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    def _respond(self, writer, status: int, reply, keep_alive: bool):
+        body = json.dumps(reply).encode() + b"\n"
+        head = ("HTTP/1.1 " + str(status) + " " + REASONS[status] + "\r\n"
+                "Content-Type: application/json\r\n"
+                "Content-Length: " + str(len(body)) + "\r\n"
+                "Connection: " + ("keep-alive" if keep_alive else "close") +
+                "\r\n")
+        if status == 503:
+            head += "Retry-After: 1\r\n"
+        writer.write(head.encode("latin-1") + b"\r\n" + body)
+
+
+async def serve(service, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT):
+    server = await asyncio.start_server(service.handle, host, port)
+    address = server.sockets[0].getsockname()
+    # bench_service.py reads this line to find a port picked with --port 0
+    print("listening on " + str(address[0]) + ":" + str(address[1]),
+          flush=True)
+    # a terminate ends the service like ctrl-c does, so the workers are
+    # shut down with it
+    stopped = asyncio.Event()
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM,
+                                                      stopped.set)
+    except NotImplementedError:
+        # no signal handlers in the windows event loop
+        pass
+    async with server:
+        await stopped.wait()
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Serve legal moves, evaluations and searches over http.")
+    parser.add_argument("--host", default=DEFAULT_HOST,
+                        help="address to listen on (default: localhost only)")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT,
+                        help="port to listen on, 0 picks a free one")
+    parser.add_argument("--workers", type=int,
+                        help="search processes (default: one per core)")
+    parser.add_argument("--hash", type=int, default=DEFAULT_HASH_MB,
+                        help="transposition table MB per worker")
+    parser.add_argument("--max-pending", type=int,
+                        help="searches queued before requests are turned "
+                             "away (default: 8 per worker)")
+    parser.add_argument("--cache-size", type=int,
+                        default=DEFAULT_CACHE_ENTRIES,
+                        help="search results kept, 0 turns the cache off")
+    parser.add_argument("--cache-ttl", type=float,
+                        default=DEFAULT_CACHE_SECONDS,
+                        help="seconds a result is kept, 0 for no limit")
+    parser.add_argument("--max-depth", type=int, default=DEFAULT_MAX_DEPTH,
+                        help="deepest search a request may ask for")
+    parser.add_argument("--max-movetime", type=int,
+                        default=DEFAULT_MAX_MOVETIME_MS,
+                        help="longest search in ms a request may ask for")
+    stats.add_profile_argument(parser)
+    args = parser.parse_args()
+
+    service = AnalysisService(args.workers, args.hash, args.cache_size,
+                              args.cache_ttl, args.max_pending,
+                              args.max_depth, args.max_movetime)
+    try:
+        service.warm_up()
+        with stats.profiling(args.profile):
+            asyncio.run(serve(service, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.close()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
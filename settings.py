@@ -9,3 +9,18 @@ WIDTH = SQUARE_SIZE * 8 + FONT_SIZE_NORMAL * 2
 HEIGHT = SQUARE_SIZE * 8 + FONT_SIZE_NORMAL * 2
 
 FONT_COLOR_WHITE = (220, 220, 220)
+
+# sleep until input arrives instead of redrawing FPS times a second, False
+# goes back to polling at FPS
+EVENT_DRIVEN = True
+
+# "white" or "black" hands that side to the engine, None is two players
+ENGINE_PLAYS = None
+ENGINE_MOVETIME_MS = 1000
+# think on the player's time about the reply the engine expects
+ENGINE_PONDER = True
+# polyglot opening book the engine plays from while in book, see book.py
+ENGINE_BOOK = None
+
+# pgn file every game played in the window is appended to on exit, see pgn.py
+GAME_RECORD = None
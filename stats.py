@@ -0,0 +1,242 @@
+# Bad Chess
+# Copyright (C) Jared De Blander 2022
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+
+# call counters and timers for the hot paths
+#
+# modules name their hot functions with watch(). collection is off by
+# default and then costs nothing at all: enable() swaps a timing wrapper in
+# for every watched function and disable() puts the originals back, so the
+# code that runs with collection off is exactly the code that was written.
+# the search keeps its own node, table and cutoff counts, which are read
+# after every search while collection is on.
+#
+# collection can be switched on from the environment
+#
+#   BAD_CHESS_STATS=1 python perft.py 4
+#
+# from code with enable(), with "debug on" in uci, or together with
+# cProfile through the --profile option of the command line tools
+#
+#   python search.py --depth 5 --profile run
+#
+# which writes run.prof for pstats (python -m pstats run.prof) and
+# run.json with the counters, so two builds can be compared.
+
+import contextlib
+import os
+import time
+
+# name of the instrumented function -> [calls, seconds]
+timers = {}
+# totals over every search since the last reset()
+search_totals = {}
+
+enabled = False
+
+# (owner, attribute, label, after) of every watched function, and the
+# original of every one currently wrapped
+_watched = []
+_originals = {}
+
+SEARCH_COUNTERS = ("searches", "nodes", "seconds", "tt_probes", "tt_hits",
+                   "tt_cutoffs", "cutoffs", "first_move_cutoffs",
+                   "quiescence_nodes", "branching_sum", "branching_searches")
+
+
+def _wrap(function, label: str, after):
+    timer = timers.setdefault(label, [0, 0.0])
+    perf_counter = time.perf_counter
+
+    def timed(*args, **kwargs):
+        start = perf_counter()
+        try:
+            result = function(*args, **kwargs)
+        finally:
+            timer[0] += 1
+            timer[1] += perf_counter() - start
+        if after is not None:
+            after(args[0], result)
+        return result
+
+    timed.__name__ = function.__name__
+    timed.__doc__ = function.__doc__
+    timed.__wrapped__ = function
+    return timed
+
+
+def _install(owner, attribute: str, label: str, after):
+    key = (id(owner), attribute)
+    if key in _originals:
+        return
+    function = getattr(owner, attribute)
+    _originals[key] = (owner, attribute, function)
+    setattr(owner, attribute, _wrap(function, label, after))
+
+
+def watch(owner, attribute: str, label: str = None, after=None):
+    # time owner.attribute, a class method or a module function, whenever
+    # collection is on. after(first argument, result) is called once the
+    # function returns.
+    label = label or attribute
+    _watched.append((owner, attribute, label, after))
+    timers.setdefault(label, [0, 0.0])
+    if enabled:
+        _install(owner, attribute, label, after)
+
+
+def enable():
+    global enabled
+    enabled = True
+    for owner, attribute, label, after in _watched:
+        _install(owner, attribute, label, after)
+
+
+def disable():
+    global enabled
+    enabled = False
+    for owner, attribute, function in _originals.values():
+        setattr(owner, attribute, function)
+    _originals.clear()
+
+
+def reset():
+    for timer in timers.values():
+        timer[0] = 0
+        timer[1] = 0.0
+    search_totals.clear()
+
+
+def record_search(searcher, result):
+    # add the counters of a finished search to the totals
+    totals = search_totals
+    for name in SEARCH_COUNTERS:
+        totals.setdefault(name, 0)
+    totals["searches"] += 1
+    totals["nodes"] += searcher.nodes
+    totals["seconds"] += result.elapsed
+    totals["tt_probes"] += searcher.tt_probes
+    totals["tt_hits"] += searcher.tt_hits
+    totals["tt_cutoffs"] += searcher.tt_cutoffs
+    totals["cutoffs"] += searcher.cutoffs
+    totals["first_move_cutoffs"] += searcher.first_move_cutoffs
+    totals["quiescence_nodes"] += searcher.quiescence_nodes
+    branching = searcher.branching_factor()
+    if branching:
+        totals["branching_sum"] += branching
+        totals["branching_searches"] += 1
+
+
+def _ratio(numerator, denominator):
+    return numerator / denominator if denominator else 0.0
+
+
+def summary():
+    # everything collected so far as plain data, ready for json
+    functions = {}
+    for label, (calls, seconds) in sorted(timers.items()):
+        if calls:
+            functions[label] = {
+                "calls": calls,
+                "seconds": round(seconds, 6),
+                "us_per_call": round(_ratio(seconds, calls) * 1e6, 3),
+            }
+    data = {"enabled": enabled, "functions": functions}
+    totals = search_totals
+    if totals:
+        data["search"] = {
+            "searches": totals["searches"],
+            "nodes": totals["nodes"],
+            "seconds": round(totals["seconds"], 6),
+            "nps": int(_ratio(totals["nodes"], totals["seconds"])),
+            "quiescence_nodes": totals["quiescence_nodes"],
+            "tt_probes": totals["tt_probes"],
+            "tt_hits": totals["tt_hits"],
+            "tt_hit_rate": round(_ratio(totals["tt_hits"],
+                                        totals["tt_probes"]), 4),
+            "tt_cutoffs": totals["tt_cutoffs"],
+            "cutoffs": totals["cutoffs"],
+            "first_move_cutoff_rate": round(_ratio(
+                totals["first_move_cutoffs"], totals["cutoffs"]), 4),
+            "branching_factor": round(_ratio(totals["branching_sum"],
+                                             totals["branching_searches"]), 3),
+        }
+    return data
+
+
+def report():
+    # the summary as short lines of text
+    data = summary()
+    lines = []
+    for label, timer in data["functions"].items():
+        lines.append(format(label, "<22") + format(timer["calls"], ">11") +
+                     " calls " + format(timer["seconds"], ">10.3f") + " s " +
+                     format(timer["us_per_call"], ">10.2f") + " us/call")
+    search = data.get("search")
+    if search is not None:
+        lines.append("search nodes " + str(search["nodes"]) +
+                     " nps " + str(search["nps"]) +
+                     " tt hits " + format(search["tt_hit_rate"], ".1%") +
+                     " tt cutoffs " + str(search["tt_cutoffs"]) +
+                     " cutoffs " + str(search["cutoffs"]) +
+                     " first move " +
+                     format(search["first_move_cutoff_rate"], ".1%") +
+                     " branching " + format(search["branching_factor"], ".2f"))
+    return lines
+
+
+def write_json(path: str, extra=None):
+    import json
+    import platform
+    import sys
+
+    data = summary()
+    data["python"] = platform.python_version()
+    data["implementation"] = platform.python_implementation()
+    data["argv"] = sys.argv
+    if extra:
+        data.update(extra)
+    with open(path, "w") as out:
+        json.dump(data, out, indent=2)
+        out.write("\n")
+
+
+def add_profile_argument(parser):
+    parser.add_argument("--profile", metavar="PREFIX",
+                        help="write cProfile output to PREFIX.prof and the "
+                             "counters to PREFIX.json")
+
+
+@contextlib.contextmanager
+def profiling(prefix: str = None):
+    # with profiling(prefix): counts and runs cProfile over the block, then
+    # writes PREFIX.prof and PREFIX.json. a prefix of None does nothing.
+    if not prefix:
+        yield
+        return
+    import cProfile
+
+    was_enabled = enabled
+    reset()
+    enable()
+    profiler = cProfile.Profile()
+    start = time.perf_counter()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        elapsed = time.perf_counter() - start
+        profiler.dump_stats(prefix + ".prof")
+        write_json(prefix + ".json", {"wall_seconds": round(elapsed, 6)})
+        if not was_enabled:
+            disable()
+
+
+if os.environ.get("BAD_CHESS_STATS", "").strip() not in ("", "0"):
+    enable()
@@ -0,0 +1,523 @@
+# Bad Chess
+# Copyright (C) Jared De Blander 2022
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+
+# endgame tablebases for a king and up to two pieces against a lone king
+#
+# a table is solved backwards from the mates. every position is given an
+# index, a pass over all of them finds the mates and counts the moves the
+# lone king has. then one ply at a time every predecessor of a lost
+# position is a win, and a position of the lone king is lost once the last
+# of its moves has been found to lead to a win. whatever is left is a draw.
+#
+# tables are written from the side of the stronger army, called white
+# here, and probing swaps the colors when black is the one with pieces.
+# every position is stored in one byte for white to move and one for black
+# to move
+#
+#   0    draw
+#   n    the strong side mates in n - 1 plies
+#   255  not a legal position
+#
+# a position and its mirror images across the middle files and ranks have
+# the same value, so the white king is moved into the a1-d4 corner (the a
+# to d files when there are pawns) and only that quarter or half is kept.
+# no square lies on either mirror line, so every position has exactly four
+# (or two) distinct images and moves map one to one between them.
+#
+#   python tablebase.py generate --dir tables
+#   python tablebase.py generate --dir tables KQK KPK --workers 8
+#   python tablebase.py probe --dir tables --fen "8/8/8/4k3/8/8/8/KQ6 w - -"
+
+import mmap
+import multiprocessing
+import os
+from array import array
+
+import bitboard
+import stats
+from bitboard import (KING_ATTACKS, KNIGHT_ATTACKS, WHITE_PAWN_ATTACKS,
+                      bishop_attacks, queen_attacks, rook_attacks)
+from board import PieceColor, PieceType
+
+# short names for the generator's inner loops, the codes are the board's
+PAWN = PieceType.PAWN
+ROOK = PieceType.ROOK
+KNIGHT = PieceType.KNIGHT
+BISHOP = PieceType.BISHOP
+QUEEN = PieceType.QUEEN
+KING = PieceType.KING
+WHITE = PieceColor.WHITE
+BLACK = PieceColor.BLACK
+
+DRAW = 0
+INVALID = 255
+# move count of a lone king that can never be lost, it can take a piece or
+# is stalemated
+ESCAPES = 255
+
+PIECE_LETTERS = {"P": PAWN, "N": KNIGHT, "B": BISHOP, "R": ROOK, "Q": QUEEN}
+# order of the pieces in a table name
+LETTER_ORDER = "QRBNP"
+TABLES = ("KQK", "KRK", "KPK", "KBNK")
+# pieces a pawn promotes to that can still win against a lone king
+PROMOTION_LETTERS = "QR"
+
+# indices handed to a worker at a time
+CHUNK_SIZE = 1 << 14
+
+
+def piece_attacks(piece: int, square: int, occupied: int):
+    if piece == KNIGHT:
+        return KNIGHT_ATTACKS[square]
+    if piece == BISHOP:
+        return bishop_attacks(square, occupied)
+    if piece == ROOK:
+        return rook_attacks(square, occupied)
+    if piece == QUEEN:
+        return queen_attacks(square, occupied)
+    if piece == PAWN:
+        return WHITE_PAWN_ATTACKS[square]
+    return KING_ATTACKS[square]
+
+
+def table_name(letters):
+    return "K" + "".join(sorted(letters, key=LETTER_ORDER.index)) + "K"
+
+
+class TableLayout:
+    # the index space of one table: white king slot, black king and then
+    # one square per piece in the order of the name
+    def __init__(self, name: str):
+        self.name = name
+        self.letters = name[1:-1]
+        self.pieces = [PIECE_LETTERS[letter] for letter in self.letters]
+        self.has_pawns = PAWN in self.pieces
+        self.king_slots = 32 if self.has_pawns else 16
+        self.size = self.king_slots * 64 ** (1 + len(self.pieces))
+
+    def index(self, white_king: int, black_king: int, squares):
+        flip = 7 if white_king & 7 > 3 else 0
+        if not self.has_pawns and white_king >> 3 > 3:
+            flip |= 56
+        white_king ^= flip
+        index = ((white_king >> 3) * 4 + (white_king & 7)) * 64 + \
+            (black_king ^ flip)
+        for square in squares:
+            index = index * 64 + (square ^ flip)
+        return index
+
+    def decode(self, index: int):
+        squares = []
+        for piece in self.pieces:
+            index, square = divmod(index, 64)
+            squares.append(square)
+        squares.reverse()
+        slot, black_king = divmod(index, 64)
+        return (slot >> 2) * 8 + (slot & 3), black_king, squares
+
+    def valid(self, white_king: int, black_king: int, squares):
+        # distinct squares, no pawn on the first or last rank and the
+        # kings apart
+        seen = 1 << white_king | 1 << black_king
+        for piece, square in zip(self.pieces, squares):
+            bit = 1 << square
+            if seen & bit or piece == PAWN and not 8 <= square < 56:
+                return False
+            seen |= bit
+        return white_king != black_king and \
+            not KING_ATTACKS[white_king] >> black_king & 1
+
+    def attacks(self, white_king: int, squares, occupied: int):
+        # squares attacked by white
+        attacked = KING_ATTACKS[white_king]
+        for piece, square in zip(self.pieces, squares):
+            attacked |= piece_attacks(piece, square, occupied)
+        return attacked
+
+
+class Tablebases:
+    # the tables found in a directory, memory mapped and probed in place
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.tables = {}
+        for name in TABLES:
+            path = os.path.join(directory, name + ".tb")
+            if os.path.exists(path):
+                self.load(name, path)
+
+    def load(self, name: str, path: str):
+        layout = TableLayout(name)
+        with open(path, "rb") as table_file:
+            if table_file.seek(0, 2) != 2 * layout.size:
+                raise ValueError(path + " is not a " + name + " table")
+            table = mmap.mmap(table_file.fileno(), 0,
+                              access=mmap.ACCESS_READ)
+        self.tables[name] = (layout, table)
+
+    def close(self):
+        for layout, table in self.tables.values():
+            table.close()
+        self.tables = {}
+
+    def value(self, name: str, white_to_move: bool, white_king: int,
+              black_king: int, squares):
+        # raw table byte, None when the table is not loaded
+        entry = self.tables.get(name)
+        if entry is None:
+            return None
+        layout, table = entry
+        index = layout.index(white_king, black_king, squares)
+        return table[index if white_to_move else layout.size + index]
+
+    def probe(self, board):
+        # (wdl, plies to mate) for the side to move: 1 wins, 0 draws and
+        # -1 loses. None when no loaded table covers the position.
+        occupied = board.occupied
+        if board.castling or bin(occupied).count("1") > 4:
+            return None
+        pieces = board.pieces
+        white_army = board.occupied_by[WHITE] ^ pieces[WHITE | KING]
+        black_army = board.occupied_by[BLACK] ^ pieces[BLACK | KING]
+        if white_army and black_army:
+            return None
+        if not white_army and not black_army:
+            return 0, 0
+
+        # the side with the pieces plays white in the table
+        strong = WHITE if white_army else BLACK
+        weak = strong ^ (WHITE | BLACK)
+        flip = 0 if strong == WHITE else 56
+        squares = []
+        letters = []
+        for square in bitboard.squares_of(white_army | black_army):
+            code = board.squares[square]
+            letters.append("PRNBQK"[(code & 7) - 1])
+            squares.append(square ^ flip)
+        order = sorted(range(len(letters)),
+                       key=lambda number: LETTER_ORDER.index(letters[number]))
+        value = self.value(table_name(letters), board.turn == strong,
+                           bitboard.lsb(pieces[strong | KING]) ^ flip,
+                           bitboard.lsb(pieces[weak | KING]) ^ flip,
+                           [squares[number] for number in order])
+        if value is None:
+            return None
+        if value == DRAW or value == INVALID:
+            return 0, 0
+        return (1 if board.turn == strong else -1), value - 1
+
+
+# generation, the functions below run in worker processes
+
+_layout = None
+_tablebases = None
+
+
+def _init_worker(name: str, directory: str):
+    global _layout, _tablebases
+    _layout = TableLayout(name)
+    _tablebases = Tablebases(directory)
+
+
+def _promotion_seed(white_king: int, black_king: int, squares):
+    # fewest plies to mate through a promotion, 0 when none wins. the
+    # promotion is one ply, which the stored value's offset of one covers.
+    best = 0
+    occupied = 1 << white_king | 1 << black_king
+    for square in squares:
+        occupied |= 1 << square
+    for number, piece in enumerate(_layout.pieces):
+        square = squares[number]
+        if piece != PAWN or square >> 3 != 6 or occupied >> (square + 8) & 1:
+            continue
+        for letter in PROMOTION_LETTERS:
+            letters = list(_layout.letters)
+            letters[number] = letter
+            moved = list(squares)
+            moved[number] = square + 8
+            order = sorted(range(len(letters)),
+                           key=lambda n: LETTER_ORDER.index(letters[n]))
+            value = _tablebases.value(table_name(letters), False, white_king,
+                                      black_king, [moved[n] for n in order])
+            if value is None:
+                raise RuntimeError(table_name(letters) + " is needed first")
+            if value != DRAW and value != INVALID and \
+                    (best == 0 or value < best):
+                best = value
+    return best
+
+
+def _classify(bounds):
+    # first pass over a range of indices: validity, mates, the lone king's
+    # move counts and wins through promotion
+    start, end = bounds
+    layout = _layout
+    white = bytearray(end - start)
+    black = bytearray(end - start)
+    counts = bytearray(end - start)
+    mates = array("I")
+    seeds = array("I")
+    for index in range(start, end):
+        offset = index - start
+        white_king, black_king, squares = layout.decode(index)
+        if not layout.valid(white_king, black_king, squares):
+            white[offset] = black[offset] = INVALID
+            continue
+
+        occupied = 1 << white_king | 1 << black_king
+        army = 0
+        for square in squares:
+            army |= 1 << square
+        occupied |= army
+
+        # white to move with black in check cannot happen
+        if layout.attacks(white_king, squares, occupied) >> black_king & 1:
+            white[offset] = INVALID
+        elif layout.has_pawns:
+            plies = _promotion_seed(white_king, black_king, squares)
+            if plies:
+                seeds.append(index)
+                seeds.append(plies)
+
+        without_king = occupied ^ 1 << black_king
+        attacked = layout.attacks(white_king, squares, without_king)
+        moves = 0
+        escapes = False
+        for target in bitboard.squares_of(KING_ATTACKS[black_king] &
+                                          ~attacked):
+            if army >> target & 1:
+                # taking an undefended piece leaves no mating material
+                escapes = True
+            else:
+                moves += 1
+        if escapes:
+            counts[offset] = ESCAPES
+        elif moves:
+            counts[offset] = moves
+        elif attacked >> black_king & 1:
+            black[offset] = 1
+            mates.append(index)
+        else:
+            counts[offset] = ESCAPES
+    return start, bytes(white), bytes(black), bytes(counts), mates, seeds
+
+
+def _white_predecessors(indices):
+    # white to move positions one white move before the black to move ones
+    layout = _layout
+    found = array("I")
+    for index in indices:
+        white_king, black_king, squares = layout.decode(index)
+        occupied = 1 << white_king | 1 << black_king
+        for square in squares:
+            occupied |= 1 << square
+        empty = ~occupied
+
+        origins = KING_ATTACKS[white_king] & empty & \
+            ~KING_ATTACKS[black_king]
+        for origin in bitboard.squares_of(origins):
+            moved_occupied = occupied ^ 1 << white_king | 1 << origin
+            if not layout.attacks(origin, squares, moved_occupied) >> \
+                    black_king & 1:
+                found.append(layout.index(origin, black_king, squares))
+
+        for number, piece in enumerate(layout.pieces):
+            square = squares[number]
+            if piece == PAWN:
+                origins = 0
+                if square >> 3 >= 2 and empty >> (square - 8) & 1:
+                    origins = 1 << (square - 8)
+                    if square >> 3 == 3 and empty >> (square - 16) & 1:
+                        origins |= 1 << (square - 16)
+            else:
+                origins = piece_attacks(piece, square, occupied) & empty
+            for origin in bitboard.squares_of(origins):
+                moved = list(squares)
+                moved[number] = origin
+                moved_occupied = occupied ^ 1 << square | 1 << origin
+                if not layout.attacks(white_king, moved, moved_occupied) >> \
+                        black_king & 1:
+                    found.append(layout.index(white_king, black_king, moved))
+    return found
+
+
+def _black_predecessors(indices):
+    # black to move positions one king move before the white to move ones
+    layout = _layout
+    found = array("I")
+    for index in indices:
+        white_king, black_king, squares = layout.decode(index)
+        occupied = 1 << white_king | 1 << black_king
+        for square in squares:
+            occupied |= 1 << square
+        origins = KING_ATTACKS[black_king] & ~occupied & \
+            ~KING_ATTACKS[white_king]
+        for origin in bitboard.squares_of(origins):
+            found.append(layout.index(white_king, origin, squares))
+    return found
+
+
+def _chunks(indices):
+    return [indices[start:start + CHUNK_SIZE]
+            for start in range(0, len(indices), CHUNK_SIZE)]
+
+
+def generate(name: str, directory: str, workers: int = None, report=None):
+    # solve one table and write it to directory/name.tb, the tables its
+    # pawns promote into must already be there
+    layout = TableLayout(name)
+    workers = workers or os.cpu_count() or 1
+    if workers > 1:
+        context = multiprocessing.get_context("spawn")
+        pool = context.Pool(workers, _init_worker, (name, directory))
+        run = pool.imap_unordered
+    else:
+        _init_worker(name, directory)
+        pool = None
+        run = map
+
+    try:
+        white = bytearray(layout.size)
+        black = bytearray(layout.size)
+        counts = bytearray(layout.size)
+        lost = array("I")
+        seeds = {}
+        bounds = [(start, min(start + CHUNK_SIZE * 4, layout.size))
+                  for start in range(0, layout.size, CHUNK_SIZE * 4)]
+        for start, white_part, black_part, count_part, mates, seed_part in \
+                run(_classify, bounds):
+            end = start + len(white_part)
+            white[start:end] = white_part
+            black[start:end] = black_part
+            counts[start:end] = count_part
+            lost.extend(mates)
+            for number in range(0, len(seed_part), 2):
+                seeds.setdefault(seed_part[number + 1], array("I")).append(
+                    seed_part[number])
+
+        # lost holds the black to move positions mated in plies
+        plies = 0
+        while lost or any(depth > plies for depth in seeds):
+            won = array("I")
+            candidates = [found for found in
+                          run(_white_predecessors, _chunks(lost))]
+            candidates.append(seeds.pop(plies + 1, array("I")))
+            for found in candidates:
+                for index in found:
+                    if white[index] == DRAW:
+                        white[index] = plies + 2
+                        won.append(index)
+
+            lost = array("I")
+            for found in run(_black_predecessors, _chunks(won)):
+                for index in found:
+                    if black[index] == DRAW and counts[index] != ESCAPES:
+                        counts[index] -= 1
+                        if counts[index] == 0:
+                            black[index] = plies + 3
+                            lost.append(index)
+            if report is not None:
+                report(name + " ply " + str(plies + 1) + ": " +
+                       str(len(won)) + " won, ply " + str(plies + 2) + ": " +
+                       str(len(lost)) + " lost")
+            plies += 2
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, name + ".tb")
+    with open(path + ".tmp", "wb") as table_file:
+        table_file.write(white)
+        table_file.write(black)
+    os.replace(path + ".tmp", path)
+    return path
+
+
+def dependencies(name: str):
+    # tables a table's promotions lead into, in generation order
+    needed = []
+    letters = name[1:-1]
+    for number, letter in enumerate(letters):
+        if letter != "P":
+            continue
+        for promotion in PROMOTION_LETTERS:
+            child = table_name(letters[:number] + promotion +
+                               letters[number + 1:])
+            for table in dependencies(child) + [child]:
+                if table not in needed:
+                    needed.append(table)
+    return needed
+
+
+def main():
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(
+        description="Generate or probe endgame tablebases.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    generate_parser = commands.add_parser("generate",
+                                          help="solve tables by retrograde "
+                                               "analysis")
+    generate_parser.add_argument("tables", nargs="*",
+                                 help="tables to solve (default: " +
+                                      " ".join(TABLES) + ")")
+    generate_parser.add_argument("--dir", default="tables",
+                                 help="directory of the table files")
+    generate_parser.add_argument("--workers", type=int,
+                                 help="worker processes (default: one per "
+                                      "core)")
+    generate_parser.add_argument("--force", action="store_true",
+                                 help="solve tables that already exist")
+    probe_parser = commands.add_parser("probe", help="look up a position")
+    probe_parser.add_argument("--dir", default="tables",
+                              help="directory of the table files")
+    probe_parser.add_argument("--fen", required=True,
+                              help="position to look up")
+    stats.add_profile_argument(parser)
+    args = parser.parse_args()
+
+    with stats.profiling(args.profile):
+        if args.command == "probe":
+            from board import Board
+
+            tablebases = Tablebases(args.dir)
+            result = tablebases.probe(Board(args.fen))
+            if result is None:
+                print("not in the tables")
+            else:
+                wdl, plies = result
+                print(("win", "draw", "loss")[1 - wdl] +
+                      (" mate in " + str(plies) + " plies" if wdl else ""))
+            return 0
+
+        order = []
+        for name in args.tables or TABLES:
+            name = name.upper()
+            if name not in TABLES:
+                parser.error("unknown table " + name)
+            for table in dependencies(name) + [name]:
+                if table not in order:
+                    order.append(table)
+
+        for name in order:
+            path = os.path.join(args.dir, name + ".tb")
+            if os.path.exists(path) and not args.force:
+                print(name + " exists, skipped")
+                continue
+            start = time.perf_counter()
+            generate(name, args.dir, args.workers)
+            print(name + " solved in " +
+                  format(time.perf_counter() - start, ".1f") + " s")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,45 @@
+# Bad Chess
+# Copyright (C) Jared De Blander 2022
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+
+# tests for pgn.py
+#
+#   python -m pytest test_pgn.py
+
+import io
+
+import pgn
+from board import Board
+
+
+def read_one(text: str):
+    return next(pgn.read_games(io.StringIO(text)))
+
+
+def test_move_numbers_are_stripped():
+    game = read_one("1. e4 e5 2.Nf3 2... Nc6 3.Bb5 *")
+    assert game.moves == ["e4", "e5", "Nf3", "Nc6", "Bb5"]
+
+
+def test_zero_castling_is_kept_and_replays():
+    game = read_one("1. d4 d5 2. Nc3 Nc6 3. Bf4 Bf5 4. Qd2 Qd7 5. Nf3 Nf6 "
+                    "6. 0-0-0 e6 7. e3 Be7 8. Be2 0-0 *")
+    assert game.moves[10] == "0-0-0"
+    assert game.moves[15] == "0-0"
+    board = Board()
+    for move in game.replay(board):
+        pass
+    assert board.fen_encode().split()[0] == \
+        "r4rk1/pppqbppp/2n1pn2/3p1b2/3P1B2/2N1PN2/PPPQBPPP/2KR3R"
+
+
+def test_result_ends_a_game_without_tags():
+    games = list(pgn.read_games(io.StringIO("1. e4 e5 1-0\n\n"
+                                            "1. d4 d5 0-1\n")))
+    assert [game.moves for game in games] == [["e4", "e5"], ["d4", "d5"]]
+    assert [game.result for game in games] == ["1-0", "0-1"]
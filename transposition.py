@@ -0,0 +1,146 @@
+# Bad Chess
+# Copyright (C) Jared De Blander 2022
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+
+# the transposition table remembers search results by zobrist key so a
+# position reached through a different move order is not searched again
+#
+# it is two flat arrays of unsigned 64 bit words allocated once for the
+# whole memory budget. entries live in buckets of two: the first slot keeps
+# the deepest result, the second is always overwritten. each entry is one
+# packed data word plus the full key xored with it. a hit is verified
+# against both words, so an entry torn by two processes writing the same
+# slot of a shared table reads as a miss instead of a wrong move.
+#
+#   bits  0-15  best move
+#   bits 16-31  score + 32768
+#   bits 32-39  depth
+#   bits 40-41  bound
+#   bits 42-49  generation
+
+from array import array
+
+BOUND_NONE = 0
+BOUND_EXACT = 1
+BOUND_LOWER = 2
+BOUND_UPPER = 3
+
+ENTRY_BYTES = 16
+BUCKET_SIZE = 2
+SCORE_OFFSET = 32768
+
+
+def table_entries(size_mb: int):
+    # round the bucket count down to a power of two so the key can be
+    # masked into an index
+    buckets = max(1, size_mb * 1024 * 1024 // (ENTRY_BYTES * BUCKET_SIZE))
+    return (1 << (buckets.bit_length() - 1)) * BUCKET_SIZE
+
+
+def table_bytes(size_mb: int):
+    # size of the buffer a table of size_mb needs
+    return table_entries(size_mb) * ENTRY_BYTES
+
+
+class TranspositionTable:
+    def __init__(self, size_mb: int = 16, buffer=None):
+        # with a buffer, e.g. the buf of a SharedMemory, the table lives in
+        # it instead of memory of its own
+        self.size_mb = size_mb
+        self.generation = 0
+        self.entries = table_entries(size_mb)
+        self.bucket_mask = self.entries // BUCKET_SIZE - 1
+        self.buffer = buffer
+        if buffer is None:
+            self.keys = array("Q", bytes(8 * self.entries))
+            self.data = array("Q", bytes(8 * self.entries))
+        else:
+            words = memoryview(buffer).cast("B").cast("Q")
+            self.keys = words[:self.entries]
+            self.data = words[self.entries:2 * self.entries]
+            words.release()
+
+    def clear(self):
+        if self.buffer is None:
+            self.keys = array("Q", bytes(8 * self.entries))
+            self.data = array("Q", bytes(8 * self.entries))
+        else:
+            size = table_bytes(self.size_mb)
+            memoryview(self.buffer).cast("B")[:size] = bytes(size)
+        self.generation = 0
+
+    def close(self):
+        # a table on a borrowed buffer lets go of it so it can be freed
+        if self.buffer is not None:
+            self.keys.release()
+            self.data.release()
+            self.buffer = None
+
+    def new_search(self):
+        # entries from older searches become the first to be replaced
+        self.generation = (self.generation + 1) & 0xFF
+
+    def probe(self, key: int):
+        # returns (move, score, depth, bound) or None when the key is absent
+        index = (key & self.bucket_mask) << 1
+        keys = self.keys
+        data = self.data[index]
+        if keys[index] ^ data != key:
+            index += 1
+            data = self.data[index]
+            if keys[index] ^ data != key:
+                return None
+        if data == 0:
+            return None
+        return (data & 0xFFFF, (data >> 16 & 0xFFFF) - SCORE_OFFSET,
+                data >> 32 & 0xFF, data >> 40 & 3)
+
+    def probe_move(self, key: int):
+        # best move stored for the key, 0 when there is none
+        index = (key & self.bucket_mask) << 1
+        keys = self.keys
+        data = self.data
+        if keys[index] ^ data[index] == key:
+            return data[index] & 0xFFFF
+        if keys[index + 1] ^ data[index + 1] == key:
+            return data[index + 1] & 0xFFFF
+        return 0
+
+    def store(self, key: int, depth: int, score: int, bound: int,
+              move: int = 0):
+        index = (key & self.bucket_mask) << 1
+        keys = self.keys
+        data = self.data
+
+        # the depth-preferred slot is taken when the key already lives
+        # there, the new result is at least as deep, or the entry is stale
+        stored = data[index]
+        if keys[index] ^ stored != key and stored and \
+                depth < (stored >> 32 & 0xFF) and \
+                (stored >> 42 & 0xFF) == self.generation:
+            index += 1
+            stored = data[index]
+
+        if move == 0 and keys[index] ^ stored == key:
+            move = stored & 0xFFFF
+
+        stored = (move | (score + SCORE_OFFSET) << 16 |
+                  min(depth, 0xFF) << 32 | bound << 40 |
+                  self.generation << 42)
+        data[index] = stored
+        keys[index] = key ^ stored
+
+    def hashfull(self):
+        # permille of sampled entries written during the current search
+        sample = min(1000, self.entries)
+        used = 0
+        data = self.data
+        for index in range(sample):
+            if data[index] and (data[index] >> 42 & 0xFF) == self.generation:
+                used += 1
+        return used * 1000 // sample
@@ -0,0 +1,359 @@
+# Bad Chess
+# Copyright (C) Jared De Blander 2022
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+
+# universal chess interface front end so tournament managers and chess GUIs
+# can drive the engine over stdin and stdout
+#
+#   python uci.py
+#   python uci.py --profile session
+#
+# "debug on" switches on the counters of stats.py and reports them after
+# every search as info strings.
+#
+# commands are read on the main thread while "go" runs the search on a
+# worker thread, so "stop", "isready" and "quit" are answered at once.
+
+import sys
+import threading
+import time
+
+import stats
+from board import FEN_NEW_GAME, Board, PieceColor
+from moves import move_to_uci
+from search import Searcher, score_to_uci
+from transposition import TranspositionTable
+
+ENGINE_NAME = "bad-chess"
+ENGINE_AUTHOR = "Jared De Blander"
+
+DEFAULT_HASH_MB = 16
+MAX_HASH_MB = 4096
+MAX_THREADS = 256
+
+# time held back from every move for process and pipe latency
+MOVE_OVERHEAD_MS = 30
+# moves the remaining clock is spread over when the GUI does not say
+DEFAULT_MOVES_TO_GO = 30
+
+
+def allocate_time(time_left_ms: int, increment_ms: int = 0,
+                  moves_to_go: int = None):
+    # share of the clock to spend on this move, in milliseconds
+    if not moves_to_go:
+        moves_to_go = DEFAULT_MOVES_TO_GO
+    budget = time_left_ms // moves_to_go + increment_ms * 3 // 4
+    return max(1, min(budget, time_left_ms - MOVE_OVERHEAD_MS))
+
+
+class UciEngine:
+    def __init__(self, output=None):
+        self.output = output if output is not None else sys.stdout
+        self.output_lock = threading.Lock()
+        self.board = Board()
+        self.hash_mb = DEFAULT_HASH_MB
+        self.threads = 1
+        self.tt = TranspositionTable(DEFAULT_HASH_MB)
+        self.searcher = Searcher(self.board, self.tt)
+        self.thread = None
+        # an infinite or ponder search holds its bestmove until this is set
+        self.release = threading.Event()
+        self.ponder_budget_ms = None
+        self.book = None
+        self.book_best = False
+        self.tablebase_path = ""
+
+    def send(self, line: str):
+        with self.output_lock:
+            self.output.write(line + "\n")
+            self.output.flush()
+
+    def loop(self, stream=None):
+        stream = stream if stream is not None else sys.stdin
+        for line in stream:
+            if not self.handle(line):
+                break
+        self.stop()
+        self.close()
+
+    def close(self):
+        self.close_searcher()
+        if self.book is not None:
+            self.book.close()
+            self.book = None
+
+    def handle(self, line: str):
+        # returns False once the engine should exit
+        tokens = line.split()
+        if not tokens:
+            return True
+        command = tokens[0]
+
+        if command == "uci":
+            self.send("id name " + ENGINE_NAME)
+            self.send("id author " + ENGINE_AUTHOR)
+            self.send("option name Hash type spin default " +
+                      str(DEFAULT_HASH_MB) + " min 1 max " + str(MAX_HASH_MB))
+            self.send("option name Threads type spin default 1 min 1 max " +
+                      str(MAX_THREADS))
+            self.send("option name Clear Hash type button")
+            self.send("option name Book File type string default <empty>")
+            self.send("option name Best Book Move type check default false")
+            self.send("option name Tablebase Path type string "
+                      "default <empty>")
+            self.send("uciok")
+        elif command == "isready":
+            self.send("readyok")
+        elif command == "setoption":
+            self.set_option(tokens[1:])
+        elif command == "ucinewgame":
+            self.stop()
+            self.tt.clear()
+        elif command == "position":
+            self.stop()
+            self.set_position(tokens[1:])
+        elif command == "go":
+            self.stop()
+            self.go(tokens[1:])
+        elif command == "stop":
+            self.stop()
+        elif command == "ponderhit":
+            self.ponder_hit()
+        elif command == "debug":
+            if tokens[1:2] == ["on"]:
+                stats.enable()
+            elif tokens[1:2] == ["off"]:
+                stats.disable()
+        elif command == "quit":
+            return False
+        elif command == "d":
+            # not part of uci, handy when driving the engine by hand
+            self.send(self.board.fen_encode())
+        return True
+
+    def set_option(self, tokens):
+        # setoption name <name> [value <value>]
+        if "name" not in tokens:
+            return
+        name_end = tokens.index("value") if "value" in tokens else len(tokens)
+        name = " ".join(tokens[tokens.index("name") + 1:name_end]).lower()
+        value = " ".join(tokens[name_end + 1:])
+
+        if name == "hash":
+            self.stop()
+            try:
+                size_mb = max(1, min(MAX_HASH_MB, int(value)))
+            except ValueError:
+                self.send("info string invalid hash size " + value)
+                return
+            self.set_searcher(size_mb, self.threads)
+        elif name == "threads":
+            self.stop()
+            try:
+                threads = max(1, min(MAX_THREADS, int(value)))
+            except ValueError:
+                self.send("info string invalid thread count " + value)
+                return
+            self.set_searcher(self.hash_mb, threads)
+        elif name == "clear hash":
+            self.stop()
+            self.tt.clear()
+        elif name == "book file":
+            self.set_book(value)
+        elif name == "best book move":
+            self.book_best = value.lower() == "true"
+        elif name == "tablebase path":
+            self.stop()
+            self.tablebase_path = "" if value == "<empty>" else value
+            self.set_searcher(self.hash_mb, self.threads)
+
+    def set_book(self, path: str):
+        # an empty path turns the book off
+        from book import OpeningBook
+
+        if self.book is not None:
+            self.book.close()
+            self.book = None
+        if path and path != "<empty>":
+            try:
+                self.book = OpeningBook(path)
+            except OSError as error:
+                self.send("info string cannot open book " + path + ": " +
+                          str(error))
+
+    def close_searcher(self):
+        # worker processes of a parallel search are shut down
+        if self.threads > 1:
+            self.searcher.close()
+        elif self.searcher.tablebases is not None:
+            self.searcher.tablebases.close()
+
+    def set_searcher(self, hash_mb: int, threads: int):
+        # more than one thread searches in that many processes sharing
+        # one table, see parallel.py
+        self.close_searcher()
+        self.hash_mb = hash_mb
+        self.threads = threads
+        if threads > 1:
+            from parallel import ParallelSearcher
+
+            self.searcher = ParallelSearcher(self.board, threads, hash_mb,
+                                             self.tablebase_path)
+            self.tt = self.searcher.tt
+        else:
+            self.tt = TranspositionTable(hash_mb)
+            self.searcher = Searcher(self.board, self.tt)
+            if self.tablebase_path:
+                from tablebase import Tablebases
+
+                self.searcher.tablebases = Tablebases(self.tablebase_path)
+
+    def set_position(self, tokens):
+        # position startpos|fen <fen> [moves <move> ...]
+        if not tokens:
+            return
+        moves_index = tokens.index("moves") if "moves" in tokens \
+            else len(tokens)
+        if tokens[0] == "startpos":
+            fen = FEN_NEW_GAME
+        elif tokens[0] == "fen":
+            fen = " ".join(tokens[1:moves_index])
+        else:
+            return
+
+        self.board.fen_decode(fen)
+        for uci in tokens[moves_index + 1:]:
+            move = self.board.parse_move(uci)
+            if move is None:
+                self.send("info string illegal move " + uci)
+                break
+            self.board.make_move(move)
+
+    def go(self, tokens):
+        limits = {}
+        flags = set()
+        index = 0
+        while index < len(tokens):
+            token = tokens[index]
+            if token in ("infinite", "ponder"):
+                flags.add(token)
+                index += 1
+            elif token in ("depth", "movetime", "nodes", "wtime", "btime",
+                           "winc", "binc", "movestogo", "mate") and \
+                    index + 1 < len(tokens):
+                try:
+                    limits[token] = int(tokens[index + 1])
+                except ValueError:
+                    pass
+                index += 2
+            else:
+                # searchmoves and anything unknown is skipped
+                index += 1
+
+        depth = limits.get("depth")
+        if "mate" in limits and depth is None:
+            depth = limits["mate"] * 2
+        nodes = limits.get("nodes")
+        movetime_ms = limits.get("movetime")
+
+        if self.board.turn == PieceColor.WHITE:
+            time_left, increment = limits.get("wtime"), limits.get("winc", 0)
+        else:
+            time_left, increment = limits.get("btime"), limits.get("binc", 0)
+        if movetime_ms is None and time_left is not None:
+            movetime_ms = allocate_time(time_left, increment,
+                                        limits.get("movestogo"))
+
+        infinite = "infinite" in flags or "ponder" in flags
+        self.ponder_budget_ms = None
+        if "ponder" in flags:
+            # the clock only starts on ponderhit
+            self.ponder_budget_ms = movetime_ms
+            movetime_ms = None
+
+        if self.book is not None and not infinite:
+            move = self.book.pick(self.board, self.book_best)
+            if move:
+                self.send("info string book move")
+                self.send("bestmove " + move_to_uci(move))
+                return
+
+        self.release.clear()
+        if not infinite:
+            self.release.set()
+        self.searcher.ponder_deadline = None
+        self.thread = threading.Thread(
+            target=self._search, args=(depth, movetime_ms, nodes, infinite),
+            daemon=True)
+        self.thread.start()
+
+    def ponder_hit(self):
+        # the opponent played the expected move, keep searching on our clock
+        if self.ponder_budget_ms is not None:
+            # the search reads ponder_deadline when it starts and deadline
+            # once it runs, setting them in this order covers both
+            deadline = time.perf_counter() + self.ponder_budget_ms / 1000
+            self.searcher.ponder_deadline = deadline
+            self.searcher.deadline = deadline
+        self.ponder_budget_ms = None
+        self.release.set()
+
+    def stop(self):
+        thread = self.thread
+        if thread is None:
+            return
+        self.release.set()
+        # keep flagging until the worker has actually started and unwound
+        while thread.is_alive():
+            self.searcher.stop()
+            thread.join(0.005)
+        self.thread = None
+
+    def _search(self, depth, movetime_ms, nodes, infinite):
+        debugging = stats.enabled
+        if debugging:
+            stats.reset()
+        result = self.searcher.search(depth, movetime_ms, nodes, infinite,
+                                      self._info)
+        if debugging:
+            for line in stats.report():
+                self.send("info string " + " ".join(line.split()))
+        self.release.wait()
+        if result.best_move:
+            line = "bestmove " + move_to_uci(result.best_move)
+            if len(result.pv) > 1:
+                line += " ponder " + move_to_uci(result.pv[1])
+        else:
+            line = "bestmove 0000"
+        self.send(line)
+
+    def _info(self, result):
+        self.send("info depth " + str(result.depth) +
+                  " score " + score_to_uci(result.score) +
+                  " nodes " + str(result.nodes) +
+                  " nps " + str(result.nps()) +
+                  " time " + str(int(result.elapsed * 1000)) +
+                  " hashfull " + str(self.tt.hashfull()) +
+                  " pv " + " ".join(move_to_uci(move) for move in result.pv))
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Speak the universal chess interface on stdin/stdout.")
+    stats.add_profile_argument(parser)
+    args = parser.parse_args()
+
+    with stats.profiling(args.profile):
+        UciEngine().loop()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())